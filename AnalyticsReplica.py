@@ -0,0 +1,262 @@
+from hashlib import sha256
+from os import environ, makedirs, path
+from threading import Lock
+from time import time
+import json
+
+import duckdb
+import pyarrow as pa
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ErrorLevel, SqlglotError
+from sqlalchemy import text
+
+from QueryGuard import ReplicaUnsupported
+from ResultCache import WATERMARK_COLUMNS
+from ResultStream import RESULT_STREAM_CHUNK_ROWS, StreamedResult, decimals_to_float, record_batch
+from SchemaService import get_schema_service
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+# Key of each replicated table, for replacing changed rows on incremental syncs
+REPLICA_KEYS = {
+    "products": "product_id",
+    "orders": "order_id",
+    "workflows": "workflow_id",
+    "workflow_steps": "workflow_step_id",
+}
+
+
+def replica_enabled() -> bool:
+    """Whether exploration should run on the local analytics replica ($ANALYTICS_REPLICA, off by default)."""
+    return environ.get("ANALYTICS_REPLICA", "0") != "0"
+
+
+def duckdb_type(column_type) -> str:
+    """DuckDB type for a MariaDB column type (as stored by SchemaService); unknown types become VARCHAR."""
+    try:
+        data_type = exp.DataType.build(column_type, dialect="mysql")
+    except (SqlglotError, ValueError):
+        return "VARCHAR"
+    if data_type.is_type(*exp.DataType.INTEGER_TYPES, exp.DataType.Type.FLOAT, exp.DataType.Type.DOUBLE):
+        # Display widths like INT(11) mean nothing to DuckDB
+        data_type.set("expressions", [])
+    elif data_type.is_type(*exp.DataType.TEMPORAL_TYPES):
+        return "DATE" if data_type.is_type(exp.DataType.Type.DATE) else "TIMESTAMP"
+    elif not data_type.is_type(exp.DataType.Type.DECIMAL, exp.DataType.Type.ENUM):
+        return "VARCHAR"
+    return data_type.sql(dialect="duckdb")
+
+
+class AnalyticsReplica:
+    """
+    Local DuckDB copy of the OLTP tables, for exploratory queries.
+
+    products, orders, workflows and workflow_steps are copied into a DuckDB
+    file under $AURORA_CACHE_DIR. Syncs are incremental: each table's
+    update_date/workflow_step_date watermark (see ResultCache.WATERMARK_COLUMNS)
+    is remembered, and only rows at or after it are fetched and upserted by
+    key. A table is copied in full the first time, when its columns change,
+    when row counts show deletes, or, for tables without a watermark
+    (products), whenever its row count changes.
+    Generated MariaDB SQL is transpiled to DuckDB with sqlglot; queries it
+    can't translate or run raise ReplicaUnsupported so callers fall back to
+    MariaDB (see QueryGuard).
+    """
+
+    def __init__(self, mysql_engine, replica_path=None, sync_seconds=None, tables=None):
+        """
+        Open (or create) the replica
+
+        Args:
+            mysql_engine: SQLAlchemy engine for the source database
+            replica_path: DuckDB file (default: $ANALYTICS_REPLICA_PATH or $AURORA_CACHE_DIR/replica.duckdb)
+            sync_seconds: Age after which the next query syncs first (default: $ANALYTICS_REPLICA_SYNC_SECONDS or 300)
+            tables: Tables to replicate (default: the keys of REPLICA_KEYS)
+        """
+        self.mysql_engine = mysql_engine
+        self.replica_path = replica_path or environ.get("ANALYTICS_REPLICA_PATH") \
+            or path.join(CACHE_DIR, "replica.duckdb")
+        makedirs(path.dirname(path.abspath(self.replica_path)), exist_ok=True)
+        self.sync_seconds = sync_seconds if sync_seconds is not None \
+            else float(environ.get("ANALYTICS_REPLICA_SYNC_SECONDS", "300"))
+        self.tables = tables if tables is not None else list(REPLICA_KEYS)
+        self.schema_service = get_schema_service(mysql_engine)
+
+        self.connection = duckdb.connect(self.replica_path)
+        # MariaDB's default collation compares text case-insensitively; without this, = and IN on
+        # text silently match fewer rows here than on the source (LIKE is handled in transpile)
+        self.connection.execute("SET default_collation = 'nocase'")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS _replica_sync (table_name VARCHAR PRIMARY KEY, "
+                                "schema_hash VARCHAR, watermark VARCHAR, row_count BIGINT, synced_at DOUBLE)")
+        self._state = {row[0]: {"schema_hash": row[1], "watermark": row[2], "row_count": row[3]}
+                       for row in self.connection.execute("SELECT * FROM _replica_sync").fetchall()}
+        self._lock = Lock()
+        self.last_sync = 0.0
+        self.rows_synced = 0
+
+        self.queries = 0
+
+    def sync(self) -> dict:
+        """
+        Bring every table up to date with the source
+
+        Returns:
+            Dictionary of table name to rows copied
+        """
+        with self._lock:
+            return self._sync()
+
+    def maybe_sync(self) -> dict:
+        """Sync if the last sync is older than sync_seconds; returns rows copied per table, empty if it was fresh."""
+        with self._lock:
+            if time() - self.last_sync >= self.sync_seconds:
+                return self._sync()
+            return {}
+
+    def _sync(self) -> dict:
+        copied = {table: self._sync_table(table) for table in self.tables}
+        self.rows_synced += sum(copied.values())
+        self.last_sync = time()
+        return copied
+
+    def _sync_table(self, table) -> int:
+        source = self.schema_service.tables.get(table)
+        if source is None:
+            return 0
+        schema_hash = sha256(json.dumps(source["columns"]).encode("utf-8")).hexdigest()
+        column = WATERMARK_COLUMNS.get(table)
+        latest = f"CAST(MAX(`{column}`) AS CHAR)" if column else "NULL"
+        with self.mysql_engine.connect() as conn:
+            row_count, watermark = conn.execute(text(f"SELECT COUNT(*), {latest} FROM `{table}`")).one()
+
+        state = self._state.get(table)
+        same_schema = state is not None and state["schema_hash"] == schema_hash
+        if same_schema and (state["row_count"], state["watermark"]) == (row_count, watermark):
+            return 0
+
+        key = REPLICA_KEYS.get(table)
+        self.connection.begin()
+        try:
+            copied = None
+            if same_schema and column and state["watermark"] is not None \
+                    and key in [name for name, *_ in source["columns"]]:
+                # Bounded above by the probed watermark, so the row counts are comparable afterwards
+                copied = self._copy(table, f"SELECT * FROM `{table}` WHERE `{column}` >= :since "
+                                           f"AND `{column}` <= :until",
+                                    {"since": state["watermark"], "until": watermark}, key)
+                replica_count = self.connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                if replica_count != row_count:
+                    # Rows were deleted at the source
+                    copied = None
+            if copied is None:
+                columns = ", ".join(f'"{name}" {duckdb_type(column_type)}'
+                                    for name, column_type, *_ in source["columns"])
+                self.connection.execute(f'CREATE OR REPLACE TABLE "{table}" ({columns})')
+                copied = self._copy(table, f"SELECT * FROM `{table}`", {}, None)
+            self.connection.execute("INSERT OR REPLACE INTO _replica_sync VALUES (?, ?, ?, ?, ?)",
+                                    [table, schema_hash, watermark, row_count, time()])
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self._state[table] = {"schema_hash": schema_hash, "watermark": watermark, "row_count": row_count}
+        return copied
+
+    def _copy(self, table, sql_query, params, key) -> int:
+        """Stream a source query into a replica table as Arrow batches, replacing rows with the same key."""
+        copied = 0
+        with self.mysql_engine.connect() as conn:
+            cursor = conn.execution_options(stream_results=True, max_row_buffer=RESULT_STREAM_CHUNK_ROWS) \
+                .execute(text(sql_query), params)
+            columns, schema = list(cursor.keys()), None
+            while rows := cursor.fetchmany(RESULT_STREAM_CHUNK_ROWS):
+                batch = record_batch(rows, columns, schema)
+                schema = batch.schema
+                self.connection.register("_replica_batch", pa.Table.from_batches([batch]))
+                if key is not None:
+                    self.connection.execute(f'DELETE FROM "{table}" WHERE "{key}" IN '
+                                            f'(SELECT "{key}" FROM _replica_batch)')
+                self.connection.execute(f'INSERT INTO "{table}" BY NAME SELECT * FROM _replica_batch')
+                self.connection.unregister("_replica_batch")
+                copied += len(rows)
+        return copied
+
+    def watermarks(self, tables) -> dict:
+        """Replica-side watermarks ([row count, latest change]) for ResultCache, without touching the source."""
+        self.maybe_sync()
+        return {table: [self._state[table]["row_count"], self._state[table]["watermark"]]
+                for table in tables if table in self._state}
+
+    def transpile(self, sql_query) -> str:
+        """
+        Translate a MariaDB query to DuckDB
+
+        Raises:
+            ReplicaUnsupported: The query reads tables the replica doesn't hold, or sqlglot can't translate it
+        """
+        try:
+            tree = sqlglot.parse_one(sql_query, read="mysql")
+            ctes = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+            for table in tree.find_all(exp.Table):
+                if table.name in ctes:
+                    continue
+                if table.name not in self.tables:
+                    raise ReplicaUnsupported(sql_query, f"table {table.name} is not replicated")
+                # The replica has a single schema, so drop any database qualifier
+                table.set("db", None)
+            # DuckDB's LIKE ignores the collation, so make it as case-insensitive as MariaDB's
+            for like in list(tree.find_all(exp.Like)):
+                like.replace(exp.ILike(**like.args))
+            return tree.sql(dialect="duckdb", unsupported_level=ErrorLevel.RAISE)
+        except SqlglotError as e:
+            raise ReplicaUnsupported(sql_query, str(e)) from e
+
+    def stream(self, sql_query, on_preview=None, on_chunk=None, keep_frame=False, chunk_rows=None):
+        """
+        Run a MariaDB query on the replica; same arguments and result as QueryGuard.stream
+
+        Raises:
+            ReplicaUnsupported: The query can't be translated, or DuckDB rejects the translation
+        """
+        duckdb_query = self.transpile(sql_query)
+        self.maybe_sync()
+        result = StreamedResult(on_preview=on_preview, on_chunk=on_chunk, keep_frame=keep_frame)
+        cursor = self.connection.cursor()
+        try:
+            reader = cursor.execute(duckdb_query).to_arrow_reader(chunk_rows or RESULT_STREAM_CHUNK_ROWS)
+            for batch in reader:
+                result.add(decimals_to_float(batch))
+        except duckdb.Error as e:
+            if result.rows:
+                # Rows already reached the callbacks, so it's too late to start over on the database
+                raise
+            raise ReplicaUnsupported(sql_query, str(e)) from e
+        finally:
+            cursor.close()
+        self.queries += 1
+        return result.finish(reader.schema.names)
+
+    def read_sql(self, sql_query):
+        """Run a MariaDB query on the replica and return a DataFrame; see stream."""
+        return self.stream(sql_query, keep_frame=True).frame
+
+    def summary(self) -> str:
+        """One-line summary for the timing output."""
+        return f"Replica: {self.queries} queries / {self.rows_synced:,} rows synced"
+
+
+_replicas = {}
+_replicas_lock = Lock()
+
+
+def get_replica(mysql_engine):
+    """Return the process-wide AnalyticsReplica for an engine, or None when $ANALYTICS_REPLICA is off."""
+    if not replica_enabled():
+        return None
+    with _replicas_lock:
+        key = mysql_engine.url.render_as_string(hide_password=True)
+        if key not in _replicas:
+            _replicas[key] = AnalyticsReplica(mysql_engine)
+        return _replicas[key]
@@ -0,0 +1,53 @@
+from os import environ
+from time import time
+
+
+def streaming_enabled() -> bool:
+    """Whether the REPL clients should stream answers ($ANSWER_STREAMING, on by default)."""
+    return environ.get("ANSWER_STREAMING", "1") != "0"
+
+
+def stream_answer(llm, prompt, console) -> dict:
+    """
+    Stream an answer to the console as tokens arrive
+
+    Args:
+        llm: Chat model without structured output (e.g. answer_llm_base), so it can stream text
+        prompt: The formatted answer prompt
+        console: Rich Console to print tokens to
+
+    Returns:
+        Dictionary with answer, answer_gen_seconds, answer_ttft_seconds (time to first token),
+        answer_tokens and answer_tokens_per_second
+    """
+    start_ts = time()
+    first_token_ts = None
+    parts = []
+    chunks = 0
+    usage_tokens = None
+
+    for chunk in llm.stream(prompt):
+        content = chunk.content if isinstance(chunk.content, str) else ""
+        if getattr(chunk, "usage_metadata", None):
+            usage_tokens = chunk.usage_metadata.get("output_tokens", usage_tokens)
+        if not content:
+            continue
+        if first_token_ts is None:
+            first_token_ts = time()
+        parts.append(content)
+        chunks += 1
+        console.print(content, end="", markup=False, highlight=False, soft_wrap=True)
+    console.print()
+
+    end_ts = time()
+    # Providers that don't report usage on streams send roughly one token per chunk
+    tokens = usage_tokens if usage_tokens else chunks
+    ttft = (first_token_ts - start_ts) if first_token_ts is not None else end_ts - start_ts
+    generation_seconds = end_ts - (first_token_ts if first_token_ts is not None else start_ts)
+    return {
+        "answer": "".join(parts).strip(),
+        "answer_gen_seconds": end_ts - start_ts,
+        "answer_ttft_seconds": ttft,
+        "answer_tokens": tokens,
+        "answer_tokens_per_second": tokens / generation_seconds if generation_seconds > 0 else 0.0,
+    }
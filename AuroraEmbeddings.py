@@ -0,0 +1,33 @@
+from litellm import embedding
+from os import environ
+import numpy as np
+
+
+EMBEDDING_MODEL = environ.get("AURORA_EMBEDDING_MODEL", "openai/nomic-embed-text:latest")
+EMBEDDING_API_BASE = environ.get("LITELLM_API_BASE", "http://localhost:8000")
+
+
+def embed_texts(texts: list) -> np.ndarray:
+    """
+    Embed a list of texts through the LiteLLM gateway.
+
+    Args:
+        texts: List of strings to embed
+
+    Returns:
+        float32 array of shape (len(texts), dim) with unit-length rows, so a dot
+        product between rows is their cosine similarity
+    """
+    if len(texts) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    response = embedding(
+        model=EMBEDDING_MODEL,
+        input=list(texts),
+        api_base=EMBEDDING_API_BASE,
+        api_key=environ.get("LITELLM_API_KEY", "test")
+    )
+    vectors = np.asarray([item["embedding"] for item in response.data], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
@@ -0,0 +1,93 @@
+from os import environ
+from threading import Lock
+from time import sleep
+
+from sqlalchemy import create_engine, text
+
+
+_engines = {}
+_lock = Lock()
+
+
+def build_dsn(database: str, host=None, user=None, password=None) -> str:
+    """
+    Build a MariaDB DSN, filling anything not given from SQL_HOST/SQL_USER/SQL_PASS.
+
+    Args:
+        database: Database name, e.g. "aurora" or "aurora_logging"
+    """
+    host = host if host is not None else environ.get("SQL_HOST", "localhost")
+    user = user if user is not None else environ.get("SQL_USER", "zero")
+    password = password if password is not None else environ.get("SQL_PASS", "zero")
+    return f"mysql+pymysql://{user}:{password}@{host}/{database}"
+
+
+def get_engine(dsn=None, database=None, max_retries=None, retry_delay=None):
+    """
+    Return the process-wide pooled engine for a DSN, creating it on first use.
+
+    Every caller asking for the same DSN shares one connection pool, so after
+    the first query no caller pays for a new TCP connection or auth handshake.
+    Engines use pre-ping to replace connections the server has dropped, and the
+    first connection is retried with exponential backoff.
+
+    Args:
+        dsn: SQLAlchemy connection string. If None, built from database and the SQL_* env vars
+        database: Database name used when dsn is None
+        max_retries: Connection attempts before giving up (default: $SQL_CONNECT_RETRIES or 5)
+        retry_delay: Delay before the first retry in seconds, doubling each attempt
+                     (default: $SQL_CONNECT_RETRY_DELAY or 1)
+
+    Returns:
+        SQLAlchemy engine
+    """
+    if dsn is None:
+        dsn = build_dsn(database)
+
+    with _lock:
+        if dsn in _engines:
+            return _engines[dsn]
+
+    max_retries = max_retries if max_retries is not None else int(environ.get("SQL_CONNECT_RETRIES", "5"))
+    retry_delay = retry_delay if retry_delay is not None \
+        else float(environ.get("SQL_CONNECT_RETRY_DELAY", "1"))
+
+    # Created and probed outside the lock, so a database that is slow to answer (up to ~30s per retry)
+    # doesn't hold up callers asking for engines that already exist
+    engine = create_engine(
+        dsn,
+        pool_pre_ping=True,
+        pool_size=int(environ.get("SQL_POOL_SIZE", "5")),
+        max_overflow=int(environ.get("SQL_POOL_MAX_OVERFLOW", "10")),
+        pool_recycle=int(environ.get("SQL_POOL_RECYCLE_SECONDS", "3600")),
+    )
+    for attempt in range(max_retries):
+        try:
+            # Test the connection; this also leaves one warm connection in the pool
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            break
+        except Exception as e:
+            if attempt < max_retries - 1:
+                delay = min(retry_delay * 2 ** attempt, 30)
+                print(f"Database connection attempt {attempt + 1} failed: {e}. Retrying in {delay:.0f}s...")
+                sleep(delay)
+            else:
+                engine.dispose()
+                raise Exception(f"Failed to connect to database after {max_retries} attempts: {e}")
+
+    with _lock:
+        if dsn in _engines:
+            # Another thread connected first; keep a single pool per DSN
+            engine.dispose()
+        else:
+            _engines[dsn] = engine
+        return _engines[dsn]
+
+
+def dispose_all():
+    """Close every pooled connection, e.g. before forking worker processes."""
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
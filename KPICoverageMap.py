@@ -0,0 +1,248 @@
+from hashlib import sha256
+from os import environ, makedirs, path, replace
+from threading import Lock
+from math import ceil, sqrt
+
+import numpy as np
+
+from AuroraEmbeddings import embed_texts
+from SQLFingerprint import new_discovered_kpis
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 25, seed: int = 0):
+    """
+    Cluster unit-length vectors by cosine similarity with k-means++ seeding.
+
+    Args:
+        vectors: (n, d) array of unit-length rows
+        k: Number of clusters
+        iterations: Maximum Lloyd iterations
+
+    Returns:
+        Tuple of (labels, sums, counts) where sums[c] is the sum of the vectors in cluster c
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    k = min(k, n)
+
+    centroids = np.empty((k, vectors.shape[1]), dtype=np.float32)
+    centroids[0] = vectors[rng.integers(n)]
+    distance = 1.0 - vectors @ centroids[0]
+    for c in range(1, k):
+        weights = np.maximum(distance, 0.0) ** 2
+        total = weights.sum()
+        index = rng.choice(n, p=weights / total) if total > 0 else rng.integers(n)
+        centroids[c] = vectors[index]
+        distance = np.minimum(distance, 1.0 - vectors @ centroids[c])
+
+    labels = np.zeros(n, dtype=np.int64)
+    for _ in range(iterations):
+        new_labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, new_labels, vectors)
+        counts = np.bincount(new_labels, minlength=k)
+        centroids = np.where(counts[:, None] > 0, _normalize_rows(sums), centroids)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+    sums = np.zeros_like(centroids)
+    np.add.at(sums, labels, vectors)
+    return labels, sums, np.bincount(labels, minlength=k)
+
+
+class KPICoverageMap:
+    """
+    Clustered map of the questions already stored in aurora_discovered_kpis.
+
+    Questions are embedded once and grouped into themes. The explorer prompt gets
+    a fixed-size summary (the most covered themes and the least covered ones)
+    instead of every stored question, so prompt size stops growing with the
+    table. New KPIs are assigned to the nearest theme as they are logged; a
+    question far from every theme starts a new one, and when the theme limit is
+    reached the two most similar themes are merged.
+    """
+
+    def __init__(self, mysql_engine, max_clusters=None, new_theme_similarity=None, summary_themes=None,
+                 least_covered=None, map_path=None, embed=embed_texts):
+        """
+        Initialize the coverage map
+
+        Args:
+            mysql_engine: SQLAlchemy engine holding aurora_discovered_kpis
+            max_clusters: Maximum number of themes (default: $COVERAGE_MAX_CLUSTERS or 24)
+            new_theme_similarity: A new question less similar than this to every theme starts a new theme
+                                  (default: $COVERAGE_NEW_THEME_SIMILARITY or 0.75)
+            summary_themes: Most covered themes listed in the prompt summary (default: 8)
+            least_covered: Least covered themes listed in the prompt summary (default: 4)
+            map_path: Optional .npz path. Defaults to $AURORA_CACHE_DIR/kpi_coverage.npz
+            embed: Function mapping a list of strings to unit-length vectors
+        """
+        self.mysql_engine = mysql_engine
+        self.max_clusters = max_clusters if max_clusters is not None \
+            else int(environ.get("COVERAGE_MAX_CLUSTERS", "24"))
+        self.new_theme_similarity = new_theme_similarity if new_theme_similarity is not None \
+            else float(environ.get("COVERAGE_NEW_THEME_SIMILARITY", "0.75"))
+        self.summary_themes = summary_themes if summary_themes is not None else 8
+        self.least_covered = least_covered if least_covered is not None else 4
+        self.embed = embed
+
+        if map_path is None:
+            makedirs(CACHE_DIR, exist_ok=True)
+            map_path = path.join(CACHE_DIR, "kpi_coverage.npz")
+        self.map_path = map_path
+
+        self.questions = []
+        self._hashes = set()
+        self._embeddings = None
+        self._labels = np.zeros(0, dtype=np.int64)
+        self._sums = None
+        self._counts = np.zeros(0, dtype=np.int64)
+        # sql_fingerprints of the rows already pulled by sync()
+        self._synced = set()
+        self._lock = Lock()
+        self._load()
+
+    @staticmethod
+    def _hash(question: str) -> str:
+        return sha256(" ".join(question.lower().split()).encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not path.exists(self.map_path):
+            return
+        try:
+            state = np.load(self.map_path, allow_pickle=False)
+            self.questions = state["questions"].tolist()
+            self._embeddings = state["embeddings"]
+            self._labels = state["labels"]
+            self._sums = state["sums"]
+            self._counts = state["counts"]
+            self._hashes = {self._hash(question) for question in self.questions}
+        except Exception:
+            # A corrupt or incompatible map is rebuilt on the next sync
+            self.questions, self._hashes, self._embeddings = [], set(), None
+
+    def _save(self):
+        temp_path = self.map_path + ".tmp.npz"
+        np.savez(temp_path, questions=np.array(self.questions, dtype=str), embeddings=self._embeddings,
+                 labels=self._labels, sums=self._sums, counts=self._counts)
+        replace(temp_path, self.map_path)
+
+    def sync(self):
+        """Pull the aurora_discovered_kpis rows added since the last sync and add their questions to the map."""
+        kpis = new_discovered_kpis(self.mysql_engine, self._synced, ["question"])
+        self.add(kpis.question.dropna().tolist())
+        with self._lock:
+            # Rows whose questions failed to embed stay unsynced, so the next sync retries them
+            synced = kpis.question.map(
+                lambda question: not isinstance(question, str) or self._hash(question) in self._hashes).astype(bool)
+            self._synced.update(kpis.sql_fingerprint[synced].dropna())
+
+    def add(self, questions: list):
+        """
+        Add newly discovered questions to the map. Only unseen questions are embedded.
+
+        Args:
+            questions: List of natural language questions
+        """
+        with self._lock:
+            new_questions = []
+            for question in questions:
+                question_hash = self._hash(question)
+                if question_hash not in self._hashes:
+                    self._hashes.add(question_hash)
+                    new_questions.append(question)
+            if not new_questions:
+                return
+
+            try:
+                vectors = self.embed(new_questions)
+            except Exception:
+                # Embedding gateway unavailable: remember nothing so the next sync retries
+                for question in new_questions:
+                    self._hashes.discard(self._hash(question))
+                return
+
+            if self._embeddings is None or len(self._embeddings) == 0:
+                self._bootstrap(new_questions, vectors)
+            else:
+                for question, vector in zip(new_questions, vectors):
+                    self._assign(question, vector)
+            self._save()
+
+    def _bootstrap(self, questions, vectors):
+        k = min(self.max_clusters, max(1, ceil(sqrt(len(questions)))))
+        self.questions = list(questions)
+        self._embeddings = vectors.astype(np.float32)
+        self._labels, self._sums, self._counts = spherical_kmeans(self._embeddings, k)
+
+    def _assign(self, question, vector):
+        similarities = _normalize_rows(self._sums) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.new_theme_similarity:
+            if len(self._counts) >= self.max_clusters:
+                self._merge_closest()
+            best = len(self._counts)
+            self._sums = np.vstack([self._sums, np.zeros_like(vector)[None, :]])
+            self._counts = np.append(self._counts, 0)
+
+        self._sums[best] += vector
+        self._counts[best] += 1
+        self.questions.append(question)
+        self._embeddings = np.vstack([self._embeddings, vector[None, :].astype(np.float32)])
+        self._labels = np.append(self._labels, best)
+
+    def _merge_closest(self):
+        """Merge the two most similar themes (one agglomerative step) to free a slot."""
+        centroids = _normalize_rows(self._sums)
+        similarities = centroids @ centroids.T
+        np.fill_diagonal(similarities, -np.inf)
+        keep, drop = sorted(np.unravel_index(int(np.argmax(similarities)), similarities.shape))
+        self._sums[keep] += self._sums[drop]
+        self._counts[keep] += self._counts[drop]
+        self._sums = np.delete(self._sums, drop, axis=0)
+        self._counts = np.delete(self._counts, drop)
+        self._labels[self._labels == drop] = keep
+        self._labels[self._labels > drop] -= 1
+
+    def _representative(self, cluster: int) -> str:
+        members = np.flatnonzero(self._labels == cluster)
+        centroid = self._sums[cluster] / max(np.linalg.norm(self._sums[cluster]), 1e-12)
+        return self.questions[members[int(np.argmax(self._embeddings[members] @ centroid))]]
+
+    def prompt_summary(self) -> str:
+        """
+        Fixed-size description of what has been explored, for the explorer prompt.
+
+        Returns:
+            Text listing the most covered themes and the least covered ones
+        """
+        with self._lock:
+            if not self.questions:
+                return "No previous questions."
+
+            if self._sums is None or len(self._counts) == 0:
+                recent = self.questions[-(self.summary_themes + self.least_covered):]
+                return "\n".join(f"- {question}" for question in recent)
+
+            order = np.argsort(-self._counts, kind="stable")
+            occupied = [int(c) for c in order if self._counts[c] > 0]
+            covered = occupied[:self.summary_themes]
+            sparse = [c for c in reversed(occupied) if c not in covered][:self.least_covered]
+
+            lines = [f"{len(self.questions)} questions already explored, grouped into {len(occupied)} themes.",
+                     "Most covered themes (avoid these; example question and number of KPIs):"]
+            lines += [f"- {self._representative(c)} ({self._counts[c]} KPIs)" for c in covered]
+            if sparse:
+                lines.append("Least covered themes (good starting points for a new angle):")
+                lines += [f"- {self._representative(c)} ({self._counts[c]} KPIs)" for c in sparse]
+            return "\n".join(lines)
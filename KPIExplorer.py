@@ -1,18 +1,37 @@
+import asyncio
 from langchain_ollama import ChatOllama
 from langchain_litellm import ChatLiteLLM
 from langchain_core.prompts import PromptTemplate
 from pydantic import BaseModel, Field
-from sqlalchemy import create_engine, text
-from pandas import read_sql
 from rich.console import Console
 from time import time, sleep
 from os import environ
 from SQLErrorHandling import SQLErrorHandler
+from EngineRegistry import get_engine
+from SQLCache import SQLCache
+from ResultCache import ResultCache
+from QueryGuard import QueryGuard
+from AnalyticsReplica import get_replica
+from KPICoverageMap import KPICoverageMap
+from NoveltyFilter import NoveltyFilter
+from SQLFingerprint import ensure_fingerprint_column, sql_fingerprint
+from LogWriter import get_log_writer, DISCOVERED_KPI_COLUMNS
+from ResultEncoder import encode_results
+from TokenAccounting import TokenLedger, prompt_sections, merge_usage, ensure_token_usage_column
+from PipelineTracing import get_tracer
+from SchemaService import get_schema_service
+from SQLValidator import SQLValidator
+from SampleProvider import SampleProvider
+import json
 
 class DatabaseQuestion(BaseModel):
     question: str = Field(description="A natural language question about the database intended for exploring new KPIs")
 
 
+class DatabaseQuestions(BaseModel):
+    questions: list[str] = Field(description="Distinct natural language questions about the database, each intended for exploring a different new KPI")
+
+
 class Query(BaseModel):
     sql_query: str = Field(description="A syntactically correct SQL query")
 
@@ -22,27 +41,67 @@ class Answer(BaseModel):
 
 
 class KPIExplorer:
-    def __init__(self, mysql_engine=None, console=None):
+    def __init__(self, mysql_engine=None, console=None, sql_cache=None, result_cache=None, replica=None):
         """
         Initialize the KPI Explorer
 
         Args:
-            mysql_engine: Optional SQLAlchemy engine. If None, will create from env vars
+            mysql_engine: Optional SQLAlchemy engine. If None, will use the shared engine for the env vars
             console: Optional Rich Console. If None, will create a new one
+            sql_cache: Optional SQLCache for generated SQL. If None, will open the default on-disk cache
+            result_cache: Optional ResultCache for query results. If None, will open one on mysql_engine.
+                          With a replica, its cache directory is shared but queries run on the replica
+            replica: Optional AnalyticsReplica that exploration queries run on. If None, uses the shared
+                     replica when $ANALYTICS_REPLICA is set, and the database otherwise
         """
         # Setup database connection
         if mysql_engine is None:
-            SQL_HOST = environ.get("SQL_HOST", "localhost")
-            SQL_USER = environ.get("SQL_USER", "zero")
-            SQL_PASS = environ.get("SQL_PASS", "zero")
             SQL_READ_DB = environ.get("SQL_READ_DB", "aurora")
-            self.mysql_engine = create_engine(f"mysql+pymysql://{SQL_USER}:{SQL_PASS}@{SQL_HOST}/{SQL_READ_DB}")
+            self.mysql_engine = get_engine(database=SQL_READ_DB)
         else:
             self.mysql_engine = mysql_engine
 
         # Setup console
         self.console = console if console is not None else Console()
 
+        # Setup question -> SQL cache
+        self.sql_cache = sql_cache if sql_cache is not None else SQLCache()
+
+        # Setup local columnar replica, so exploration queries stay off the OLTP database
+        self.replica = replica if replica is not None else get_replica(self.mysql_engine)
+        if self.replica is not None:
+            start_time = time()
+            synced = self.replica.maybe_sync()
+            if synced:
+                self.console.print(f"[dim]Analytics replica synced ({sum(synced.values()):,} rows copied, "
+                                   f"{time() - start_time:.2f}s)[/dim]")
+
+        # Setup executed-query result cache
+        if self.replica is not None and (result_cache is None or result_cache.query_guard.replica is not self.replica):
+            # Exploration always reads the replica, even with a caller's MariaDB cache. Its entries stay
+            # compatible: replica watermarks are the source's row counts and latest changes as of the last sync
+            self.result_cache = ResultCache(
+                self.mysql_engine,
+                cache_dir=result_cache.cache_dir if result_cache is not None else None,
+                max_bytes=result_cache.max_bytes if result_cache is not None else None,
+                query_guard=QueryGuard(self.mysql_engine, replica=self.replica),
+                watermarks=self.replica.watermarks)
+        else:
+            self.result_cache = result_cache if result_cache is not None else ResultCache(self.mysql_engine)
+
+        # Setup live schema for the prompts; cached results are dropped if the schema changed
+        self.schema_service = get_schema_service(self.mysql_engine)
+        self.schema_service.invalidate(self.result_cache)
+
+        # Static checks of generated SQL, with one cheap regeneration before anything reaches the database
+        self.sql_validator = SQLValidator(self.schema_service)
+
+        # Setup clustered map of already discovered KPIs
+        self.coverage_map = KPICoverageMap(self.mysql_engine)
+
+        # Setup near-duplicate gate for generated questions
+        self.novelty_filter = NoveltyFilter(self.mysql_engine)
+
         # Setup LLMs
         self.sql_llm_base = ChatLiteLLM(
             api_base="http://localhost:8000",
@@ -69,12 +128,22 @@ class KPIExplorer:
         self.sql_llm_so = self.sql_llm_base.with_structured_output(Query)
         self.answer_llm_so = self.answer_llm_base.with_structured_output(Answer)
         self.explorer_llm_so = self.explorer_llm_base.with_structured_output(DatabaseQuestion)
+        self.explorer_batch_llm_so = self.explorer_llm_base.with_structured_output(DatabaseQuestions)
 
         # Setup prompts
         self._setup_prompts()
 
         self.ExplorerErrors = SQLErrorHandler()
 
+        # Per-stage prompt/completion token accounting, and stage spans/latency metrics
+        self.token_ledger = TokenLedger()
+        self.tracer = get_tracer()
+
+        # Background batched writer for discovered KPIs; INSERT IGNORE on sql_fingerprint drops duplicates
+        self.kpi_writer = get_log_writer(self.mysql_engine, "aurora_discovered_kpis", DISCOVERED_KPI_COLUMNS,
+                                         ignore=True, prepare=ensure_token_usage_column)
+        self._logged_fingerprints = set()
+
     def _setup_prompts(self):
         """Setup all prompt templates"""
         self.query_prompt = """
@@ -85,25 +154,7 @@ class KPIExplorer:
         Generate a SQL query that answers the question `{question}`.
         
         Schema:
-        CREATE TABLE `workflow_steps` (
-  `index` bigint(20) DEFAULT NULL,
-  `workflow_step_id` bigint(20) DEFAULT NULL,
-  `order_id` double DEFAULT NULL,
-  `order_item_id` double DEFAULT NULL,
-  `workflow_id` bigint(20) DEFAULT NULL,
-  `workflow_step_name` text DEFAULT NULL,
-  `workflow_step_description` text DEFAULT NULL,
-  `effective_parent_workflow_status` text DEFAULT NULL,
-  `workflow_step_estimated_duration_days` double DEFAULT NULL,
-  `team_name` text DEFAULT NULL,
-  `team_id` bigint(20) DEFAULT NULL,
-  `team_member` text DEFAULT NULL,
-  `workflow_step_due_date` datetime DEFAULT NULL,
-  `is_automated_step` bigint(20) DEFAULT NULL,
-  `workflow_step_elapsed_duration_hours` double DEFAULT NULL,
-  `workflow_step_date` datetime DEFAULT NULL,
-  KEY `ix_workflow_steps_index` (`index`)
-)
+        {schema}
         
         ### Response format:
         Based on the provided schema and question, here is the MariaDB SQL query:
@@ -114,6 +165,10 @@ class KPIExplorer:
             input_variables=["schema","question"]
         )
 
+        # Define schema for question and query generation
+        self.workflows_schema = self.schema_service.render(["workflow_steps"])
+        self.sql_schema_hash = SQLCache.schema_hash(self.query_prompt, self.workflows_schema)
+
         self.answer_prompt = """### Input:
         The question: {question}
 
@@ -131,30 +186,9 @@ class KPIExplorer:
             input_variables=["question", "query", "results"]
         )
 
-        # Define schema for question generation
-        self.workflows_schema = """
-        CREATE TABLE `workflow_steps` (
-  `index` bigint(20) DEFAULT NULL,
-  `workflow_step_id` bigint(20) DEFAULT NULL,
-  `order_id` double DEFAULT NULL,
-  `order_item_id` double DEFAULT NULL,
-  `workflow_id` bigint(20) DEFAULT NULL,
-  `workflow_step_name` text DEFAULT NULL,
-  `workflow_step_description` text DEFAULT NULL,
-  `effective_parent_workflow_status` text DEFAULT NULL,
-  `workflow_step_estimated_duration_days` double DEFAULT NULL,
-  `team_name` text DEFAULT NULL,
-  `team_id` bigint(20) DEFAULT NULL,
-  `team_member` text DEFAULT NULL,
-  `workflow_step_due_date` datetime DEFAULT NULL,
-  `is_automated_step` bigint(20) DEFAULT NULL,
-  `workflow_step_elapsed_duration_hours` double DEFAULT NULL,
-  `workflow_step_date` datetime DEFAULT NULL,
-  KEY `ix_workflow_steps_index` (`index`)
-)
-        """
-        
-        self.sample_data = read_sql("SELECT * FROM workflow_steps ORDER BY RAND() LIMIT 10", self.mysql_engine).to_markdown()
+        # Stratified sample cached on disk, so construction doesn't sort workflow_steps
+        self.sample_provider = SampleProvider(self.mysql_engine, schema_service=self.schema_service)
+        self.sample_data = self.sample_provider.markdown()
 
         self.question_prompt = """
         ### Improved Prompt for Exploratory Question Generation
@@ -164,7 +198,7 @@ class KPIExplorer:
         ### Inputs:
         - **Database Schema**: {schema} – This describes the tables, columns, data types, relationships, and any constraints.
         - **Sample Data**: {data} – A subset of rows from key tables to understand data patterns, distributions, and quality.
-        - **Previous Questions**: {old_questions} – A comprehensive list of already-generated questions. **Critically analyze this list to avoid any semantic overlap.** Do not regenerate questions that cover similar ground, such as:
+        - **Previous Questions**: {old_questions} – A summary of the themes already explored, with an example question and KPI count per theme. **Critically analyze these themes to avoid any semantic overlap.** Do not regenerate questions that cover similar ground, such as:
           - The same or overlapping KPIs/metrics (e.g., if "average revenue" was asked, avoid variations like "mean sales").
           - Identical or near-identical groupings/segmentations (e.g., by region, time period, or user type).
           - Repeated timeframes (e.g., if last year was covered, shift to quarterly or predictive periods).
@@ -191,29 +225,95 @@ class KPIExplorer:
             input_variables=["schema", "data", "old_questions"]
         )
 
-    def generate_questions(self, count=5):
+        self.batch_question_prompt = """
+        ### Batch Prompt for Exploratory Question Generation
+
+        You are an expert data explorer specializing in uncovering KPIs, metrics, and actionable business insights from databases. Your role is to generate **exactly {count}** novel, natural-language questions that probe the database for valuable discoveries, such as trends, correlations, anomalies, summaries, or comparisons that could inform business decisions.
+
+        ### Inputs:
+        - **Database Schema**: {schema} – This describes the tables, columns, data types, relationships, and any constraints.
+        - **Sample Data**: {data} – A subset of rows from key tables to understand data patterns, distributions, and quality.
+        - **Previous Questions**: {old_questions} – Themes already explored, with an example question per theme. **Do not overlap with any of them**, whether by KPI/metric, grouping, timeframe or entity combination.
+
+        ### Guidelines for Generating the Questions:
+        - **Distinct from each other**: Every question in your list must target a different theme (e.g. team throughput, automation rates, SLA risk, duration estimates vs actuals, trends over time). No two questions may share the same KPI and grouping.
+        - Phrase each question in clear, natural English as if asking a colleague, 1 sentence max, specific enough for accurate NL2SQL translation.
+        - Implicitly reference schema elements without naming tables/columns explicitly. Assume the NL2SQL agent handles translation.
+        - Mix macro (overall summaries) and micro (drill-down) scope, quantitative and qualitative angles, historical and forward-looking.
+        - Every question must tie to decisions, like optimization, risk mitigation, or opportunity identification.
+
+        ### Output Format:
+        Return the {count} questions as a list, with no explanations or additional text."""
+
+        self.batch_question_prompt_template = PromptTemplate(
+            template=self.batch_question_prompt,
+            input_variables=["count", "schema", "data", "old_questions"]
+        )
+
+        # Themes handed to fallback single-question calls so parallel calls don't converge on the same question
+        self.diversity_seeds = [
+            "team workload and throughput",
+            "automated vs manual steps",
+            "due dates and SLA risk",
+            "estimated vs actual step durations",
+            "trends and seasonality over time",
+            "individual team member performance",
+            "workflow and step status mix",
+            "outliers and anomalies",
+        ]
+
+    def generate_questions(self, count=5, batched=None):
         self.console.print("Generating questions...")
         """
         Generate new KPI exploration questions
 
         Args:
             count: Number of questions to generate
-            old_questions: List of previous questions to avoid duplicates
+            batched: Ask for all questions in one structured-output call, topping up any shortfall with
+                     parallel single-question calls (default: $EXPLORER_BATCHED or True)
 
         Returns:
             List of generated questions
         """
-        fetch_questions = read_sql("SELECT question FROM aurora_discovered_kpis", self.mysql_engine)
-        old_questions = fetch_questions.question.tolist()
+        # KPIs logged so far are written first, so the incremental syncs see exactly the rows that were stored
+        self.kpi_writer.flush()
+        self.coverage_map.sync()
+        self.novelty_filter.sync()
+        old_questions = list(self.coverage_map.questions)
+        old_questions_str = self.coverage_map.prompt_summary()
+
+        if batched is None:
+            batched = environ.get("EXPLORER_BATCHED", "1") != "0"
+
+        # Near-duplicates of known KPIs are dropped here, before any SQL/answer spend,
+        # and replaced with fresh candidates for a bounded number of rounds
+        questions = []
+        for _ in range(1 + self.novelty_filter.max_regenerations):
+            candidates = self._generate_candidates(count - len(questions), old_questions, old_questions_str, batched)
+            this_ts = time()
+            accepted, rejected = self.novelty_filter.filter(candidates)
+            self.tracer.record_span("novelty_filter", this_ts, candidates=len(candidates), rejected=len(rejected))
+            for question, similarity, nearest in rejected:
+                self.console.print(f"[dim]Skipped near-duplicate question ({similarity:.2f} similar to "
+                                   f"'{nearest}'): {question}[/dim]")
+            questions += accepted
+            if len(questions) >= count:
+                break
+            old_questions += [candidate["question"] for candidate in candidates]
+            old_questions_str += "".join(f"\n- {candidate['question']}" for candidate in candidates)
+        self.console.print("")
+        return questions
 
-        old_questions_str = "\n".join([f"- {question}" for question in old_questions])
-        if old_questions_str == "":
-            old_questions_str = "No previous questions."
+    def _generate_candidates(self, count, old_questions, old_questions_str, batched):
+        if batched:
+            return self._generate_questions_batched(count, old_questions, old_questions_str)
 
         questions = []
         for _ in range(count):
             start_ts = time()
 
+            sections = prompt_sections(self.question_prompt_template, schema=self.workflows_schema,
+                                       data=self.sample_data, old_questions=old_questions_str)
             response = self.explorer_llm_so.invoke(
                 self.question_prompt_template.format(
                     schema=self.workflows_schema,
@@ -223,122 +323,319 @@ class KPIExplorer:
             )
             this_ts = time()
             question_gen_seconds = this_ts - start_ts
-            questions.append({"question": response.question, "gen_time": question_gen_seconds})
+            usage = self.token_ledger.record("question", sections, response.model_dump_json(), question_gen_seconds,
+                                             self.explorer_llm_base.model)
+            self.tracer.record_span("question_generation", start_ts, this_ts, model=self.explorer_llm_base.model,
+                                    questions=1)
+            questions.append({"question": response.question, "gen_time": question_gen_seconds,
+                              "token_usage": usage})
             old_questions_str += f"\n{response.question}"
-        self.console.print("")
         return questions
 
-    def explore_question(self, question, question_gen_seconds, show_output=True):
+    def _generate_questions_batched(self, count, old_questions, old_questions_str):
+        """
+        Generate count questions with one list-valued LLM call, falling back to parallel
+        single-question calls seeded with different themes for whatever the batch call
+        didn't deliver. Generation time and token usage are amortized evenly across the
+        returned questions.
+        """
+        start_ts = time()
+        seen = {SQLCache.normalize_question(question) for question in old_questions}
+        new_questions = []
+        usages = []
+
+        def add(question):
+            normalized = SQLCache.normalize_question(question)
+            if normalized and normalized not in seen and len(new_questions) < count:
+                seen.add(normalized)
+                new_questions.append(question.strip())
+
+        try:
+            sections = prompt_sections(self.batch_question_prompt_template, count=count, schema=self.workflows_schema,
+                                       data=self.sample_data, old_questions=old_questions_str)
+            response = self.explorer_batch_llm_so.invoke(
+                self.batch_question_prompt_template.format(
+                    count=count,
+                    schema=self.workflows_schema,
+                    data=self.sample_data,
+                    old_questions=old_questions_str
+                )
+            )
+            usages.append(self.token_ledger.record("question", sections, response.model_dump_json(),
+                                                   time() - start_ts, self.explorer_llm_base.model))
+            self.tracer.record_span("question_generation", start_ts, model=self.explorer_llm_base.model,
+                                    questions=len(response.questions), batched=True)
+            for question in response.questions:
+                add(question)
+        except Exception as e:
+            self.tracer.record_span("question_generation", start_ts, error=e, model=self.explorer_llm_base.model,
+                                    batched=True)
+            self.console.print(f"[yellow]Batched question generation failed, falling back: {e}[/yellow]")
+
+        missing = count - len(new_questions)
+        if missing > 0:
+            old_questions_str += "".join(f"\n- {question}" for question in new_questions)
+            focuses = [f"\n\n### Focus:\nTarget this theme: {self.diversity_seeds[i % len(self.diversity_seeds)]}"
+                       for i in range(len(new_questions), count)]
+            prompt = self.question_prompt_template.format(
+                schema=self.workflows_schema,
+                data=self.sample_data,
+                old_questions=old_questions_str
+            )
+            sections = prompt_sections(self.question_prompt_template, schema=self.workflows_schema,
+                                       data=self.sample_data, old_questions=old_questions_str)
+            batch_ts = time()
+            responses = self.explorer_llm_so.batch([prompt + focus for focus in focuses],
+                                                   config={"max_concurrency": missing}, return_exceptions=True)
+            batch_seconds = time() - batch_ts
+            for focus, response in zip(focuses, responses):
+                self.tracer.record_span("question_generation", batch_ts, batch_ts + batch_seconds,
+                                        error=response if isinstance(response, Exception) else None,
+                                        model=self.explorer_llm_base.model, questions=1)
+                if not isinstance(response, Exception):
+                    usages.append(self.token_ledger.record("question", {**sections, "focus": focus},
+                                                           response.model_dump_json(), batch_seconds,
+                                                           self.explorer_llm_base.model))
+                    add(response.question)
+
+        question_gen_seconds = (time() - start_ts) / max(len(new_questions), 1)
+        usage = merge_usage(usages, scale=1 / max(len(new_questions), 1))
+        return [{"question": question, "gen_time": question_gen_seconds, "token_usage": usage}
+                for question in new_questions]
+
+    def explore_question(self, question, question_gen_seconds, show_output=True, question_token_usage=None):
         """
         Explore a single question by generating SQL, executing it, and generating an answer
 
+        Runs aexplore_question to completion, so both paths share one pipeline.
+
         Args:
             question: The natural language question to explore
             show_output: Whether to print output to console
+            question_token_usage: Token usage of generating the question, if it was generated
 
         Returns:
-            Dictionary with question, sql_query, dataframe, answer, and timing info
+            Dictionary with question, sql_query, dataframe, answer, timing info and per-stage token_usage
         """
         self.console.print(f"Question: {question}")
+        return asyncio.run(self.aexplore_question(question, question_gen_seconds, show_output, question_token_usage))
+
+    async def aexplore_question(self, question, question_gen_seconds, show_output=True, question_token_usage=None):
+        """
+        Explore a single question without blocking the event loop. The LLM stages
+        use ainvoke and the blocking cache/database work runs in the default thread pool.
+
+        Args:
+            question: The natural language question to explore
+            show_output: Whether to print output to console
+            question_token_usage: Token usage of generating the question, if it was generated
+
+        Returns:
+            Dictionary with question, sql_query, dataframe, answer, timing info and per-stage token_usage
+        """
         start_ts = time()
         result = {
             'question': question,
             'question_gen_seconds': question_gen_seconds,
+            'token_usage': {'question': question_token_usage} if question_token_usage else {},
             'success': False,
             'error': None
         }
+        span = self.tracer.start_span("explore_question")
 
         try:
-            # Generate SQL query
             this_ts = time()
-            response = self.sql_llm_so.invoke(
-                self.code_prompt_template.format(schema=self.workflows_schema, question=question)
-            )
-            sql_query = response.sql_query
+            sql_query = await asyncio.to_thread(self.sql_cache.get, question, self.sql_schema_hash)
+            result['sql_cache_hit'] = sql_query is not None
+            if sql_query is None:
+                response = await self.sql_llm_so.ainvoke(
+                    self.code_prompt_template.format(schema=self.workflows_schema, question=question)
+                )
+                sql_query = response.sql_query
+                result['token_usage']['query'] = self.token_ledger.record(
+                    "query",
+                    prompt_sections(self.code_prompt_template, schema=self.workflows_schema, question=question),
+                    response.model_dump_json(), time() - this_ts, self.sql_llm_base.model)
+                sql_query = await asyncio.to_thread(self._validate_sql, question, sql_query, result)
             result['sql_query'] = sql_query
             result['query_gen_seconds'] = time() - this_ts
+            self.tracer.record_span("sql_generation", this_ts, model=self.sql_llm_base.model,
+                                    cache_hit=result['sql_cache_hit'])
 
-            # Execute query
             this_ts = time()
-            df = read_sql(text(sql_query), self.mysql_engine)
-            result['dataframe'] = df
+            df = await asyncio.to_thread(self._execute_query, question, result)
             result['query_exec_seconds'] = time() - this_ts
+            self.tracer.record_span("query_execution", this_ts, rows=len(df), bytes=int(df.memory_usage().sum()),
+                                    cache_hit=result['result_cache_hit'])
 
-            # Generate answer
             this_ts = time()
-            answer_response = self.answer_llm_so.invoke(
+            encoded_results = await asyncio.to_thread(encode_results, df, None, self.answer_llm_base)
+            answer_response = await self.answer_llm_so.ainvoke(
                 self.answer_prompt_template.format(
                     question=question,
                     query=sql_query,
-                    results=df.to_markdown()
+                    results=encoded_results
                 )
             )
             result['answer'] = answer_response.answer
             result['answer_gen_seconds'] = time() - this_ts
+            result['token_usage']['answer'] = self._record_answer_usage(question, sql_query, encoded_results,
+                                                                        answer_response, result)
+            self.tracer.record_span("answer_generation", this_ts, model=self.answer_llm_base.model,
+                                    prompt_tokens=result['token_usage']['answer']['prompt_tokens'],
+                                    completion_tokens=result['token_usage']['answer']['completion_tokens'])
             result['total_seconds'] = time() - start_ts
             result['success'] = True
 
             if show_output:
-                self.console.print(f"\n[bold cyan]Question:[/bold cyan] {question}")
-                self.console.print(f"[bold green]SQL[/bold green] ({result['query_gen_seconds']:.2f}s):\n{sql_query}")
-                self.console.print(
-                    f"[bold yellow]Dataset[/bold yellow] ({result['query_exec_seconds']:.2f}s):\n{df.head(20).to_markdown()}")
-                self.console.print(
-                    f"[bold magenta]Answer[/bold magenta] ({result['answer_gen_seconds']:.2f}s):\n{result['answer']}")
-                self.console.print(f"[dim]Total time: {result['total_seconds']:.2f}s[/dim]")
-                self.console.print("\n" + "*" * 60 + "\n")
+                self._print_result(result)
 
         except Exception as e:
-            result['error'] = str(e)
-            self.ExplorerErrors.log_error(str(e))
-            if show_output:
-                self.console.print("")
-                self.console.print(f"[bold red]Error:[/bold red] {e}")
-                self.console.print("-"*60)
-                self.console.print(f"SQL: {result['sql_query']}")
-                if 'sql_query' in result:
-                    self.console.print("*"*60)
+            self._record_error(result, e, show_output, this_ts)
+            span.end(error=e)
 
+        span.end(success=result['success'])
         return result
 
-    def explore_multiple(self, questions, show_output=True):
+    def _record_answer_usage(self, question, sql_query, encoded_results, answer_response, result):
+        sections = prompt_sections(self.answer_prompt_template, question=question, query=sql_query,
+                                   results=encoded_results)
+        return self.token_ledger.record("answer", sections, answer_response.model_dump_json(),
+                                        result['answer_gen_seconds'], self.answer_llm_base.model)
+
+    def _validate_sql(self, question, sql_query, result):
+        """Check generated SQL, regenerating it with the validation errors as feedback; see SQLValidator.regenerate."""
+        def retry(feedback):
+            this_ts = time()
+            prompt = self.code_prompt_template.format(schema=self.workflows_schema, question=question)
+            response = self.sql_llm_so.invoke(prompt + "\n\n" + feedback)
+            result['token_usage']['query_retry'] = self.token_ledger.record(
+                "query_retry",
+                {**prompt_sections(self.code_prompt_template, schema=self.workflows_schema, question=question),
+                 "validation errors": feedback},
+                response.model_dump_json(), time() - this_ts, self.sql_llm_base.model)
+            self.tracer.record_span("sql_retry", this_ts, model=self.sql_llm_base.model)
+            return response.sql_query
+
+        return self.sql_validator.regenerate(sql_query, retry)
+
+    def _execute_query(self, question, result):
+        """Run result['sql_query'] through the result cache, keeping the SQL cache consistent with the outcome."""
+        try:
+            df, result['result_cache_hit'] = self.result_cache.read_sql(result['sql_query'])
+        except Exception:
+            if result['sql_cache_hit']:
+                self.sql_cache.invalidate(question, self.sql_schema_hash)
+            raise
+        result['dataframe'] = df
+        if not result['sql_cache_hit']:
+            self.sql_cache.put(question, self.sql_schema_hash, result['sql_query'])
+        return df
+
+    def _print_result(self, result):
+        df = result['dataframe']
+        self.console.print(f"\n[bold cyan]Question:[/bold cyan] {result['question']}")
+        cached = ", cached" if result['sql_cache_hit'] else ""
+        self.console.print(f"[bold green]SQL[/bold green] ({result['query_gen_seconds']:.2f}s{cached}):\n{result['sql_query']}")
+        cached = ", cached" if result['result_cache_hit'] else ""
+        self.console.print(
+            f"[bold yellow]Dataset[/bold yellow] ({result['query_exec_seconds']:.2f}s{cached}):\n{df.head(20).to_markdown()}")
+        self.console.print(
+            f"[bold magenta]Answer[/bold magenta] ({result['answer_gen_seconds']:.2f}s):\n{result['answer']}")
+        replica = f" | {self.result_cache.query_guard.summary()}" if self.replica is not None else ""
+        self.console.print(f"[dim]Total time: {result['total_seconds']:.2f}s | {self.sql_cache.summary()} | {self.result_cache.summary()} | {self.sql_validator.summary()}{replica}[/dim]")
+        self.console.print("\n" + "*" * 60 + "\n")
+
+    def _record_error(self, result, e, show_output, stage_start_ts):
+        result['error'] = str(e)
+        if 'sql_query' not in result:
+            self.tracer.record_span("sql_generation", stage_start_ts, error=e, model=self.sql_llm_base.model)
+        elif 'dataframe' not in result:
+            self.tracer.record_span("query_execution", stage_start_ts, error=e)
+        else:
+            self.tracer.record_span("answer_generation", stage_start_ts, error=e, model=self.answer_llm_base.model)
+        self.ExplorerErrors.log_error(str(e))
+        if show_output:
+            self.console.print("")
+            self.console.print(f"[bold red]Error:[/bold red] {e}")
+            self.console.print("-"*60)
+            if 'sql_query' in result:
+                self.console.print(f"SQL: {result['sql_query']}")
+                self.console.print("*"*60)
+
+    def explore_multiple(self, questions, show_output=True, concurrency=None):
         """
         Explore multiple questions
 
         Args:
             questions: List of questions to explore
             show_output: Whether to print output to console
+            concurrency: Questions explored at once (default: $EXPLORE_CONCURRENCY or 1).
+                         Above 1, questions run concurrently through aexplore_question
 
         Returns:
-            List of result dictionaries
+            List of result dictionaries, in the same order as questions
         """
+        if concurrency is None:
+            concurrency = int(environ.get("EXPLORE_CONCURRENCY", "1"))
+
+        if concurrency > 1:
+            return asyncio.run(self.aexplore_multiple(questions, show_output, concurrency))
+
         results = []
         for question in questions:
-            result = self.explore_question(question['question'], question['gen_time'], show_output)
+            result = self.explore_question(question['question'], question['gen_time'], show_output,
+                                           question.get('token_usage'))
             results.append(result)
 
         return results
 
+    async def aexplore_multiple(self, questions, show_output=True, concurrency=4):
+        """
+        Explore multiple questions concurrently
+
+        Args:
+            questions: List of questions to explore
+            show_output: Whether to print output to console
+            concurrency: Maximum number of questions in flight at once
+
+        Returns:
+            List of result dictionaries, in the same order as questions
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def explore(question):
+            async with semaphore:
+                return await self.aexplore_question(question['question'], question['gen_time'], show_output,
+                                                    question.get('token_usage'))
+
+        return list(await asyncio.gather(*(explore(question) for question in questions)))
+
     def log_new_kpi(self, user_prompt, generated_query, answer, question_gen_seconds, query_gen_seconds,
-                        answer_gen_seconds):
+                        answer_gen_seconds, token_usage=None):
         self.console.print("Attempting to save new KPI to database...")
-        check_query = read_sql("SELECT distinct(sql_query) FROM aurora_discovered_kpis", self.mysql_engine)
+        start_ts = time()
+        ensure_fingerprint_column(self.mysql_engine)
 
-        if generated_query in check_query.sql_query.tolist():
+        # Duplicates from this session are caught here; ones already in the table are
+        # skipped by the writer's INSERT IGNORE on the unique sql_fingerprint key
+        fingerprint = sql_fingerprint(generated_query)
+        if fingerprint in self._logged_fingerprints:
             self.console.print("Duplicate query found, skipping...")
+            self.tracer.record_span("logging", start_ts, table="aurora_discovered_kpis", duplicate=True)
             return
-
-        with self.mysql_engine.connect() as conn:
-            query = text("INSERT INTO aurora_discovered_kpis (question,sql_query,answer,question_gen_time_seconds,"
-                         "query_gen_time_seconds,answer_gen_time_seconds) VALUES (:question,:sql_query,:answer,"
-                         ":question_gen_time_seconds,:query_gen_time_seconds,:answer_gen_time_seconds)")
-            conn.execute(query, {
-                "question": user_prompt,
-                "sql_query": generated_query,
-                "answer": answer,
-                "question_gen_time_seconds": question_gen_seconds,
-                "query_gen_time_seconds": query_gen_seconds,
-                "answer_gen_time_seconds": answer_gen_seconds
-            })
-            conn.commit()
-            self.console.print("Query saved to database.")
+        self._logged_fingerprints.add(fingerprint)
+
+        self.kpi_writer.write({
+            "question": user_prompt,
+            "sql_query": generated_query,
+            "sql_fingerprint": fingerprint,
+            "answer": answer,
+            "question_gen_time_seconds": question_gen_seconds,
+            "query_gen_time_seconds": query_gen_seconds,
+            "answer_gen_time_seconds": answer_gen_seconds,
+            "token_usage": json.dumps(token_usage) if token_usage else None
+        })
+        # The coverage map and novelty index pick the row up on the next sync, only if INSERT IGNORE kept it
+        self.console.print("Query queued for saving.")
+        self.tracer.record_span("logging", start_ts, table="aurora_discovered_kpis")
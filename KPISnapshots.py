@@ -0,0 +1,429 @@
+from hashlib import sha256
+from os import environ, makedirs, path, remove
+from threading import Lock
+from time import time
+import json
+import sqlite3
+
+import numpy as np
+from pandas import isna, read_parquet, read_sql
+from pandas.api.types import is_numeric_dtype
+from pandas.util import hash_pandas_object
+
+from AuroraEmbeddings import embed_texts
+from ResultCache import ResultCache
+from ResultEncoder import encode_results
+from SQLCache import SQLCache
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+# Changed cells listed in a diff; the counts cover the rest
+DIFF_LIMIT = 20
+
+
+def result_hash(df) -> str:
+    """Hash of a result's columns and values, independent of dtypes like categorical vs string."""
+    digest = sha256(json.dumps([str(column) for column in df.columns]).encode("utf-8"))
+    digest.update(hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _plain(value):
+    """A cell as a JSON value."""
+    if value is None or (np.ndim(value) == 0 and isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    return value if isinstance(value, (bool, int, float, str)) else str(value)
+
+
+def diff_results(old, new, limit=DIFF_LIMIT) -> dict:
+    """
+    Compare two runs of the same query
+
+    Rows are matched on the result's non-numeric columns (e.g. team_name, month)
+    when those identify each row in both runs, and by position otherwise.
+    Numeric columns are compared with a small tolerance.
+
+    Args:
+        old: DataFrame from the previous run
+        new: DataFrame from this run
+        limit: Most added/removed rows and changed cells to list
+
+    Returns:
+        Dictionary with "rows" ([old, new]), "added"/"removed" (key dicts) and "changed"
+        ({"key", "column", "old", "new"}) lists, and "added_count"/"removed_count"/"changed_count";
+        "columns" ([old, new]) instead when the columns differ
+    """
+    diff = {"rows": [len(old), len(new)]}
+    if list(old.columns) != list(new.columns):
+        diff["columns"] = [[str(column) for column in old.columns], [str(column) for column in new.columns]]
+        return diff
+
+    old, new = old.reset_index(drop=True), new.reset_index(drop=True)
+    keys = [column for column in new.columns if not is_numeric_dtype(new[column])]
+    if keys and len(set(keys)) == len(keys) and not old.duplicated(keys).any() and not new.duplicated(keys).any():
+        old = old.astype({key: object for key in keys}).set_index(keys)
+        new = new.astype({key: object for key in keys}).set_index(keys)
+    else:
+        keys = []
+    added = new.index.difference(old.index)
+    removed = old.index.difference(new.index)
+    common = new.index.intersection(old.index)
+
+    changed = []
+    changed_count = 0
+    for column in range(len(new.columns)):
+        before, after = old.iloc[:, column].reindex(common), new.iloc[:, column].reindex(common)
+        missing = before.isna().to_numpy() & after.isna().to_numpy()
+        if is_numeric_dtype(before) and is_numeric_dtype(after):
+            different = ~np.isclose(before.astype(float).to_numpy(), after.astype(float).to_numpy(),
+                                    rtol=1e-9, atol=0, equal_nan=True)
+        else:
+            different = (before.astype(str).to_numpy() != after.astype(str).to_numpy()) & ~missing
+        before, after = before.astype(object).to_numpy(), after.astype(object).to_numpy()
+        changed_count += int(different.sum())
+        for position in np.flatnonzero(different)[:max(0, limit - len(changed))]:
+            changed.append({"key": _row_key(common[position], keys), "column": str(new.columns[column]),
+                            "old": _plain(before[position]), "new": _plain(after[position])})
+
+    diff.update(added=[_row_key(key, keys) for key in added[:limit]], added_count=len(added),
+                removed=[_row_key(key, keys) for key in removed[:limit]], removed_count=len(removed),
+                changed=changed, changed_count=changed_count)
+    return diff
+
+
+def _row_key(key, keys) -> dict:
+    if not keys:
+        return {"row": _plain(key)}
+    values = key if isinstance(key, tuple) else (key,)
+    return {str(name): _plain(value) for name, value in zip(keys, values)}
+
+
+def describe_diff(diff) -> str:
+    """A diff from diff_results as short text, for the answer prompt and the console."""
+    if diff is None:
+        return "First snapshot."
+    old_rows, new_rows = diff["rows"]
+    if "columns" in diff:
+        return f"The result's columns changed from {diff['columns'][0]} to {diff['columns'][1]} " \
+               f"({old_rows} -> {new_rows} rows)."
+
+    def key_text(key):
+        return ", ".join(f"{name}={value}" for name, value in key.items())
+
+    lines = [f"Rows: {old_rows} -> {new_rows}."]
+    for name in ("added", "removed"):
+        if diff[f"{name}_count"]:
+            more = diff[f"{name}_count"] - len(diff[name])
+            lines.append(f"{name.capitalize()} {diff[f'{name}_count']} rows: "
+                         + "; ".join(key_text(key) for key in diff[name]) + (f"; and {more} more" if more else ""))
+    for change in diff["changed"]:
+        delta = ""
+        if isinstance(change["old"], (int, float)) and isinstance(change["new"], (int, float)):
+            delta = f" ({change['new'] - change['old']:+g})"
+        lines.append(f"{key_text(change['key'])}: {change['column']} {change['old']} -> {change['new']}{delta}")
+    if diff["changed_count"] > len(diff["changed"]):
+        lines.append(f"... and {diff['changed_count'] - len(diff['changed'])} more changed values")
+    return "\n".join(lines)
+
+
+class KPISnapshots:
+    """
+    Materialized results for the KPIs in aurora_discovered_kpis.
+
+    refresh() re-runs each stored KPI query on a schedule (no SQL generation),
+    through the result cache so unchanged tables cost nothing. A result is kept
+    as a new version only when its hash differs from the previous run's, as a
+    Parquet file plus a diff against that run. The answer function (the answer
+    LLM) is called only for a new version; the answer stored at discovery time
+    stands for the first one. Interactive questions that match a KPI (same
+    normalized text, or a close embedding) are answered with lookup() straight
+    from the latest snapshot while its answer is current.
+    """
+
+    def __init__(self, mysql_engine, result_cache=None, answer=None, store_dir=None, refresh_seconds=None,
+                 max_versions=None, similarity_threshold=None, max_age_seconds=None, embed=embed_texts):
+        """
+        Initialize the snapshot store
+
+        Args:
+            mysql_engine: SQLAlchemy engine holding aurora_discovered_kpis and the tables the KPIs query
+            result_cache: Optional ResultCache the refresh queries run through. If None, will open one on mysql_engine
+            answer: Optional function (question, sql_query, encoded_results, change) -> answer text, called when a
+                    result changes. If None, changed KPIs keep a stale answer and lookup() skips them
+            store_dir: Optional directory for the snapshots. Defaults to $AURORA_CACHE_DIR/kpi_snapshots
+            refresh_seconds: Age after which a KPI is due for a refresh (default: $KPI_REFRESH_SECONDS or 3600)
+            max_versions: Snapshots kept per KPI (default: $KPI_SNAPSHOT_VERSIONS or 10)
+            similarity_threshold: Cosine similarity for a question to match a KPI
+                                  (default: $KPI_SNAPSHOT_SIMILARITY or 0.95)
+            max_age_seconds: Oldest refresh lookup() answers from (default: $KPI_SNAPSHOT_MAX_AGE_SECONDS or 86400)
+            embed: Function mapping a list of strings to unit-length vectors. None disables paraphrase matching
+        """
+        self.mysql_engine = mysql_engine
+        self.result_cache = result_cache if result_cache is not None else ResultCache(mysql_engine)
+        self.answer = answer
+        self.store_dir = store_dir if store_dir is not None else path.join(CACHE_DIR, "kpi_snapshots")
+        makedirs(self.store_dir, exist_ok=True)
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None \
+            else float(environ.get("KPI_REFRESH_SECONDS", "3600"))
+        self.max_versions = max_versions if max_versions is not None \
+            else int(environ.get("KPI_SNAPSHOT_VERSIONS", "10"))
+        self.similarity_threshold = similarity_threshold if similarity_threshold is not None \
+            else float(environ.get("KPI_SNAPSHOT_SIMILARITY", "0.95"))
+        self.max_age_seconds = max_age_seconds if max_age_seconds is not None \
+            else float(environ.get("KPI_SNAPSHOT_MAX_AGE_SECONDS", "86400"))
+        self.embed = embed
+
+        self.refreshed = 0
+        self.changed = 0
+        self.answered = 0
+        self.failed = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        # The refresher and the REPLs are separate processes sharing this file
+        self._conn = sqlite3.connect(path.join(self.store_dir, "snapshots.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS kpis (
+                sql_fingerprint TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                normalized_question TEXT NOT NULL,
+                sql_query TEXT NOT NULL,
+                embedding BLOB,
+                version INTEGER NOT NULL DEFAULT 0,
+                answer TEXT,
+                answer_version INTEGER NOT NULL DEFAULT 0,
+                refreshed_at REAL,
+                error TEXT
+            )""")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                sql_fingerprint TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                result_hash TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                diff TEXT,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (sql_fingerprint, version)
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_kpis_question ON kpis (normalized_question)")
+        self._conn.commit()
+
+        # (data_version, fingerprints, embedding matrix) of the answerable KPIs, rebuilt after writes
+        self._vectors = (None, [], None)
+
+    def _snapshot_path(self, fingerprint, version) -> str:
+        return path.join(self.store_dir, f"{fingerprint}_{version}.parquet")
+
+    def sync(self) -> int:
+        """
+        Pick up KPIs added to (or removed from) aurora_discovered_kpis
+
+        Returns:
+            Number of new KPIs
+        """
+        kpis = read_sql("SELECT sql_fingerprint, question, sql_query, answer FROM aurora_discovered_kpis "
+                        "WHERE sql_fingerprint IS NOT NULL", self.mysql_engine)
+        kpis = kpis.drop_duplicates("sql_fingerprint")
+        with self._lock:
+            known = {row[0] for row in self._conn.execute("SELECT sql_fingerprint FROM kpis")}
+        new = kpis[~kpis.sql_fingerprint.isin(known)]
+        vectors = None
+        if self.embed is not None and len(new):
+            try:
+                vectors = self.embed([SQLCache.normalize_question(q) for q in new.question])
+            except Exception:
+                # Embedding gateway unavailable: these KPIs only match exact questions for now
+                vectors = None
+        with self._lock:
+            for i, kpi in enumerate(new.itertuples(index=False)):
+                self._conn.execute(
+                    "INSERT INTO kpis (sql_fingerprint, question, normalized_question, sql_query, embedding, answer) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (kpi.sql_fingerprint, kpi.question, SQLCache.normalize_question(kpi.question), kpi.sql_query,
+                     vectors[i].astype(np.float32).tobytes() if vectors is not None else None, kpi.answer))
+            for fingerprint in known - set(kpis.sql_fingerprint):
+                self._drop(fingerprint)
+            self._conn.commit()
+            # data_version only moves for other connections' writes
+            self._vectors = (None, [], None)
+        return len(new)
+
+    def _drop(self, fingerprint):
+        for (version,) in self._conn.execute("SELECT version FROM snapshots WHERE sql_fingerprint = ?",
+                                             (fingerprint,)).fetchall():
+            self._remove_file(self._snapshot_path(fingerprint, version))
+        self._conn.execute("DELETE FROM snapshots WHERE sql_fingerprint = ?", (fingerprint,))
+        self._conn.execute("DELETE FROM kpis WHERE sql_fingerprint = ?", (fingerprint,))
+
+    @staticmethod
+    def _remove_file(file_path):
+        if path.exists(file_path):
+            remove(file_path)
+
+    def due(self) -> list:
+        """(fingerprint, question, sql_query) of the KPIs not refreshed within refresh_seconds."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT sql_fingerprint, question, sql_query FROM kpis WHERE refreshed_at IS NULL OR refreshed_at < ? "
+                "ORDER BY refreshed_at IS NOT NULL, refreshed_at", (time() - self.refresh_seconds,)).fetchall()
+
+    def next_due_seconds(self) -> float:
+        """Seconds until the next KPI is due for a refresh."""
+        with self._lock:
+            oldest = self._conn.execute("SELECT MIN(COALESCE(refreshed_at, 0)) FROM kpis").fetchone()[0]
+        return self.refresh_seconds if oldest is None else max(0.0, oldest + self.refresh_seconds - time())
+
+    def refresh(self, kpis=None) -> list:
+        """
+        Re-run KPI queries and store the results that changed
+
+        Args:
+            kpis: Optional list of (fingerprint, question, sql_query). Defaults to the ones due (see due)
+
+        Returns:
+            List of {"question", "version", "changed", "diff", "answered", "error"} dicts, one per KPI
+        """
+        return [self._refresh_one(*kpi) for kpi in (kpis if kpis is not None else self.due())]
+
+    def _refresh_one(self, fingerprint, question, sql_query) -> dict:
+        outcome = {"question": question, "version": None, "changed": False, "diff": None, "answered": False,
+                   "error": None}
+        try:
+            df, _ = self.result_cache.read_sql(sql_query)
+        except Exception as e:
+            self.failed += 1
+            outcome["error"] = str(e)
+            with self._lock:
+                self._conn.execute("UPDATE kpis SET refreshed_at = ?, error = ? WHERE sql_fingerprint = ?",
+                                   (time(), str(e), fingerprint))
+                self._conn.commit()
+                self._vectors = (None, [], None)
+            return outcome
+
+        self.refreshed += 1
+        digest = result_hash(df)
+        with self._lock:
+            version, answer, answer_version = self._conn.execute(
+                "SELECT version, answer, answer_version FROM kpis WHERE sql_fingerprint = ?", (fingerprint,)).fetchone()
+            previous = self._conn.execute(
+                "SELECT result_hash, diff FROM snapshots WHERE sql_fingerprint = ? AND version = ?",
+                (fingerprint, version)).fetchone()
+        unchanged = previous is not None and previous[0] == digest
+        if unchanged:
+            diff = json.loads(previous[1]) if previous[1] is not None else None
+        else:
+            # A new version: keep it and diff it against the last one
+            self.changed += 1
+            diff = None
+            if previous is not None and path.exists(self._snapshot_path(fingerprint, version)):
+                diff = diff_results(read_parquet(self._snapshot_path(fingerprint, version)), df)
+            version += 1
+            df.to_parquet(self._snapshot_path(fingerprint, version), index=False)
+            if previous is None and answer:
+                # The answer written at discovery time stands for the first snapshot
+                answer_version = version
+        outcome.update(version=version, changed=not unchanged, diff=diff)
+
+        # Re-answer only for a new version, or one whose answer failed or was skipped before
+        if answer_version != version and self.answer is not None:
+            try:
+                answer = self.answer(question, sql_query, encode_results(df), describe_diff(diff))
+                answer_version = version
+                self.answered += 1
+                outcome["answered"] = True
+            except Exception as e:
+                outcome["error"] = str(e)
+
+        now = time()
+        with self._lock:
+            if not unchanged:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO snapshots (sql_fingerprint, version, result_hash, row_count, diff, "
+                    "created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (fingerprint, version, digest, len(df), json.dumps(diff) if diff is not None else None, now))
+                for (old_version,) in self._conn.execute(
+                        "SELECT version FROM snapshots WHERE sql_fingerprint = ? AND version <= ?",
+                        (fingerprint, version - self.max_versions)).fetchall():
+                    self._remove_file(self._snapshot_path(fingerprint, old_version))
+                self._conn.execute("DELETE FROM snapshots WHERE sql_fingerprint = ? AND version <= ?",
+                                   (fingerprint, version - self.max_versions))
+            self._conn.execute(
+                "UPDATE kpis SET version = ?, answer = ?, answer_version = ?, refreshed_at = ?, error = ? "
+                "WHERE sql_fingerprint = ?", (version, answer, answer_version, now, outcome["error"], fingerprint))
+            self._conn.commit()
+            self._vectors = (None, [], None)
+        return outcome
+
+    def _load_vectors(self):
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._vectors[0] != data_version:
+            rows = self._conn.execute("SELECT sql_fingerprint, embedding FROM kpis WHERE embedding IS NOT NULL "
+                                      "AND version > 0 AND answer_version = version").fetchall()
+            matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows else None
+            self._vectors = (data_version, [row[0] for row in rows], matrix)
+        return self._vectors[1], self._vectors[2]
+
+    def lookup(self, question, embed_question=None):
+        """
+        Find the materialized KPI matching a question
+
+        Args:
+            question: The natural language question
+            embed_question: Optional function embedding a question (e.g. SQLCache.embed_question), so callers
+                            that also look the question up in the SQL cache embed it once. Only called
+                            when there is no exact match
+
+        Returns:
+            Dictionary with "question", "sql_query", "answer", "version", "refreshed_at", "created_at",
+            "diff" (see diff_results, None for the first version) and "dataframe", or None when no KPI
+            matches with a current answer and a recent enough refresh
+        """
+        columns = "k.sql_fingerprint, k.question, k.sql_query, k.answer, k.version, k.refreshed_at, s.created_at, s.diff"
+        current = ("k.version > 0 AND k.answer_version = k.version AND k.refreshed_at >= ? AND k.error IS NULL")
+        oldest = time() - self.max_age_seconds
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {columns} FROM kpis k JOIN snapshots s ON s.sql_fingerprint = k.sql_fingerprint "
+                f"AND s.version = k.version WHERE k.normalized_question = ? AND {current}",
+                (SQLCache.normalize_question(question), oldest)).fetchone()
+
+        if row is None and self.embed is not None:
+            with self._lock:
+                fingerprints, matrix = self._load_vectors()
+            if matrix is not None:
+                if embed_question is not None:
+                    vector = embed_question(question)
+                else:
+                    try:
+                        vector = self.embed([SQLCache.normalize_question(question)])[0]
+                    except Exception:
+                        vector = None
+                if vector is not None and matrix.shape[1] == vector.shape[0]:
+                    similarities = matrix @ vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        with self._lock:
+                            row = self._conn.execute(
+                                f"SELECT {columns} FROM kpis k JOIN snapshots s ON s.sql_fingerprint = "
+                                f"k.sql_fingerprint AND s.version = k.version WHERE k.sql_fingerprint = ? "
+                                f"AND {current}", (fingerprints[best], oldest)).fetchone()
+
+        if row is None or not path.exists(self._snapshot_path(row[0], row[4])):
+            self.misses += 1
+            return None
+        self.hits += 1
+        fingerprint, kpi_question, sql_query, answer, version, refreshed_at, created_at, diff = row
+        return {"question": kpi_question, "sql_query": sql_query, "answer": answer, "version": version,
+                "refreshed_at": refreshed_at, "created_at": created_at,
+                "diff": json.loads(diff) if diff is not None else None,
+                "dataframe": read_parquet(self._snapshot_path(fingerprint, version))}
+
+    def summary(self) -> str:
+        """One-line summary for the timing output."""
+        return (f"KPI snapshots: {self.refreshed} refreshed / {self.changed} changed / {self.answered} re-answered / "
+                f"{self.failed} failed | {self.hits} hits / {self.misses} misses")
@@ -0,0 +1,266 @@
+from os import environ, makedirs, path, remove
+from queue import Queue, Full, Empty
+from threading import Event, Lock, Thread
+from time import time
+import atexit
+import json
+
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
+
+from EngineRegistry import get_engine
+from PipelineTracing import get_tracer
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+PROMPT_LOG_COLUMNS = ["user_prompt", "generated_query", "num_results", "user_feedback", "created_at",
+                      "results_returned_fl", "token_usage"]
+DISCOVERED_KPI_COLUMNS = ["question", "sql_query", "sql_fingerprint", "answer", "question_gen_time_seconds",
+                          "query_gen_time_seconds", "answer_gen_time_seconds", "token_usage"]
+
+# MariaDB errors about a row's own values (NULL in NOT NULL, duplicate key, out of range, bad date, bad
+# string value, missing foreign key, data too long, check constraint); anything else is retried later
+DATA_ERRNOS = {1048, 1062, 1264, 1292, 1366, 1406, 1452, 3819}
+
+_writers = {}
+_writers_lock = Lock()
+
+
+def is_data_error(error: DBAPIError) -> bool:
+    """Whether the database rejected a row for its values, so retrying it can never succeed."""
+    if isinstance(error, (DataError, IntegrityError)):
+        return True
+    args = getattr(error.orig, "args", ())
+    return bool(args) and args[0] in DATA_ERRNOS
+
+
+class LogWriter:
+    """
+    Background writer that batches log rows into multi-row INSERTs.
+
+    write() only enqueues, so callers never wait on the logging database. A
+    worker thread flushes with executemany when batch_size rows are waiting or
+    flush_seconds have passed since the oldest one. Rows that can't be written
+    (queue full, database unreachable) are appended to a local JSONL spill file
+    and replayed on the next successful flush; rows the database itself rejects
+    (bad values, data too long) go to a dead-letter file with the error
+    instead, so one bad row can't hold back the rest. Pending rows are flushed
+    at exit.
+    """
+
+    def __init__(self, mysql_engine, table, columns, ignore=False, batch_size=None, flush_seconds=None,
+                 max_queue=None, spill_path=None, dead_letter_path=None, prepare=None):
+        """
+        Initialize and start the writer
+
+        Args:
+            mysql_engine: SQLAlchemy engine to write through, or a DSN to get from EngineRegistry
+                          on the worker thread so connection setup stays off the caller's path
+            table: Table to insert into
+            columns: Column names; each row passed to write() must have these keys
+            ignore: Use INSERT IGNORE, e.g. so unique-key duplicates are skipped
+            batch_size: Rows per transaction (default: $LOG_BATCH_SIZE or 50)
+            flush_seconds: Longest a row waits before being flushed (default: $LOG_FLUSH_SECONDS or 2)
+            max_queue: Rows held in memory before spilling to disk (default: $LOG_MAX_QUEUE or 10000)
+            spill_path: Optional JSONL spill file. Defaults to $AURORA_CACHE_DIR/spill_<table>.jsonl
+            dead_letter_path: Optional JSONL file for rows the database rejects, with the error. Never
+                              replayed. Defaults to dead_letter_<table>.jsonl next to the spill file
+            prepare: Optional callable(engine, table) run on the worker thread before the first
+                     insert, e.g. to add missing columns. Retried on the next flush if it fails
+        """
+        self._engine = mysql_engine
+        self.table = table
+        self.columns = list(columns)
+        self.batch_size = batch_size if batch_size is not None else int(environ.get("LOG_BATCH_SIZE", "50"))
+        self.flush_seconds = flush_seconds if flush_seconds is not None \
+            else float(environ.get("LOG_FLUSH_SECONDS", "2"))
+        max_queue = max_queue if max_queue is not None else int(environ.get("LOG_MAX_QUEUE", "10000"))
+        if spill_path is None:
+            makedirs(CACHE_DIR, exist_ok=True)
+            spill_path = path.join(CACHE_DIR, f"spill_{table}.jsonl")
+        self.spill_path = spill_path
+        self.dead_letter_path = dead_letter_path if dead_letter_path is not None \
+            else path.join(path.dirname(spill_path), f"dead_letter_{table}.jsonl")
+        self._prepare = prepare
+
+        self.ignore = ignore
+        self.insert_query = None
+
+        # Rows offered, rows the database accepted (INSERT IGNORE skips count as not accepted),
+        # and transactions committed
+        self.queued = 0
+        self.inserted = 0
+        self.transactions = 0
+        self.dead_lettered = 0
+
+        # Created before atexit.register(self.close) so the tracer's exit flush runs after this writer's
+        self._tracer = get_tracer()
+        self._queue = Queue(maxsize=max_queue)
+        self._spill_lock = Lock()
+        self._closed = False
+        self._thread = Thread(target=self._run, name=f"LogWriter-{table}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, row: dict):
+        """Queue one row for insertion. Never blocks on the database."""
+        self.queued += 1
+        try:
+            self._queue.put_nowait(row)
+        except Full:
+            self._spill([row])
+
+    def flush(self, timeout=30.0):
+        """Write everything queued so far and wait for it, up to timeout seconds."""
+        if self._closed:
+            return
+        done = Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Flush pending rows and stop the worker thread."""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        batch = []
+        oldest = None
+        while True:
+            timeout = None if oldest is None else max(0.0, oldest + self.flush_seconds - time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Empty:
+                item = Empty
+
+            if item is None:
+                self._flush(batch)
+                return
+            if isinstance(item, Event):
+                self._flush(batch)
+                batch, oldest = [], None
+                item.set()
+                continue
+            if item is not Empty:
+                batch.append(item)
+                oldest = oldest if oldest is not None else time()
+
+            if batch and (len(batch) >= self.batch_size or time() - oldest >= self.flush_seconds):
+                self._flush(batch)
+                batch, oldest = [], None
+
+    def _flush(self, batch):
+        rows = self._take_spill() + batch
+        if not rows:
+            return
+        start_ts = time()
+        # Rows committed or dead-lettered so far; only the rest is spilled if the flush fails
+        done = 0
+        try:
+            if isinstance(self._engine, str):
+                self._engine = get_engine(self._engine)
+            if self.insert_query is None:
+                self.insert_query = self._build_insert_query(self._engine)
+            if self._prepare is not None:
+                self._prepare(self._engine, self.table)
+                self._prepare = None
+            with self._engine.connect() as conn:
+                for start in range(0, len(rows), self.batch_size):
+                    chunk = rows[start:start + self.batch_size]
+                    try:
+                        self.inserted += conn.execute(self.insert_query, self._values(chunk)).rowcount
+                        conn.commit()
+                        self.transactions += 1
+                    except DBAPIError as chunk_error:
+                        conn.rollback()
+                        if not is_data_error(chunk_error):
+                            raise
+                        # Find the rows the database rejects, so they don't block the others forever
+                        rejected = []
+                        try:
+                            for offset, row in enumerate(chunk):
+                                done = start + offset
+                                self._insert_row(conn, row, rejected)
+                        finally:
+                            self._dead_letter(rejected)
+                    done = start + len(chunk)
+            self._tracer.record_span("log_flush", start_ts, table=self.table, rows=len(rows))
+        except Exception as log_error:
+            print(f"Failed to write {self.table} logs, spilling to {self.spill_path}: {log_error}")
+            self._tracer.record_span("log_flush", start_ts, error=log_error, table=self.table, rows=len(rows))
+            self._spill(rows[done:])
+
+    def _values(self, rows):
+        return [{column: row.get(column) for column in self.columns} for row in rows]
+
+    def _insert_row(self, conn, row, rejected):
+        """
+        Insert one row of a failed chunk, adding it to rejected if the database refuses its values
+
+        Raises:
+            DBAPIError: Any other error (connection, missing table, permissions, lock wait), so the
+                        row and the rest of the flush are spilled and replayed
+        """
+        try:
+            self.inserted += conn.execute(self.insert_query, self._values([row])).rowcount
+            conn.commit()
+            self.transactions += 1
+        except DBAPIError as row_error:
+            conn.rollback()
+            if not is_data_error(row_error):
+                raise
+            rejected.append((row, row_error))
+
+    def _dead_letter(self, rejected):
+        if not rejected:
+            return
+        print(f"{self.table}: {len(rejected)} rows rejected by the database, moved to {self.dead_letter_path}")
+        self.dead_lettered += len(rejected)
+        with self._spill_lock:
+            with open(self.dead_letter_path, "a") as dead_letter_file:
+                for row, error in rejected:
+                    dead_letter_file.write(json.dumps({"row": row, "error": str(error.orig)}, default=str) + "\n")
+
+    def _build_insert_query(self, engine):
+        # SQLite (the offline benchmark fixture) spells INSERT IGNORE as INSERT OR IGNORE
+        ignore = ("OR IGNORE " if engine.dialect.name == "sqlite" else "IGNORE ") if self.ignore else ""
+        return text(f"INSERT {ignore}INTO {self.table} ({', '.join(self.columns)}) "
+                    f"VALUES ({', '.join(':' + column for column in self.columns)})")
+
+    def _spill(self, rows):
+        if not rows:
+            return
+        with self._spill_lock:
+            with open(self.spill_path, "a") as spill_file:
+                for row in rows:
+                    spill_file.write(json.dumps(row, default=str) + "\n")
+
+    def _take_spill(self):
+        """Read and remove the spill file; rows that fail again are spilled back by _flush."""
+        with self._spill_lock:
+            if not path.exists(self.spill_path):
+                return []
+            with open(self.spill_path) as spill_file:
+                rows = [json.loads(line) for line in spill_file if line.strip()]
+            remove(self.spill_path)
+            return rows
+
+    def summary(self) -> str:
+        """One-line summary of rows written and transactions used."""
+        dead_lettered = f", {self.dead_lettered} dead-lettered" if self.dead_lettered else ""
+        return (f"{self.table}: {self.inserted} of {self.queued} rows written "
+                f"in {self.transactions} transactions{dead_lettered}")
+
+
+def get_log_writer(mysql_engine, table, columns, ignore=False, prepare=None) -> LogWriter:
+    """Return the process-wide writer for an engine and table, starting it on first use."""
+    key = (mysql_engine if isinstance(mysql_engine, str) else str(mysql_engine.url), table)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = LogWriter(mysql_engine, table, columns, ignore=ignore, prepare=prepare)
+        return _writers[key]
@@ -0,0 +1,198 @@
+from hashlib import sha256
+from os import environ, makedirs, path, remove
+from threading import Lock
+import json
+
+import numpy as np
+
+from AuroraEmbeddings import embed_texts
+from SQLFingerprint import new_discovered_kpis
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+
+class NoveltyFilter:
+    """
+    Gate that drops generated exploration questions too similar to a KPI we already have.
+
+    Embeddings of the questions in aurora_discovered_kpis are kept in an
+    append-only float32 file that is memory-mapped for lookups, so checking a
+    candidate is one matrix-vector product and starting up doesn't re-embed the
+    table. Rejected candidates never reach SQL generation, query execution or
+    answer generation.
+    """
+
+    def __init__(self, mysql_engine, threshold=None, max_regenerations=None, index_dir=None, embed=embed_texts):
+        """
+        Initialize the novelty filter
+
+        Args:
+            mysql_engine: SQLAlchemy engine holding aurora_discovered_kpis
+            threshold: Cosine similarity at or above which a candidate is rejected
+                       (default: $NOVELTY_SIMILARITY or 0.9)
+            max_regenerations: Rounds of replacement questions requested after rejections
+                               (default: $NOVELTY_MAX_REGENERATIONS or 2)
+            index_dir: Optional directory for the index files. Defaults to $AURORA_CACHE_DIR
+            embed: Function mapping a list of strings to unit-length vectors
+        """
+        self.mysql_engine = mysql_engine
+        self.threshold = threshold if threshold is not None else float(environ.get("NOVELTY_SIMILARITY", "0.9"))
+        self.max_regenerations = max_regenerations if max_regenerations is not None \
+            else int(environ.get("NOVELTY_MAX_REGENERATIONS", "2"))
+        self.embed = embed
+
+        index_dir = index_dir if index_dir is not None else CACHE_DIR
+        makedirs(index_dir, exist_ok=True)
+        self.vectors_path = path.join(index_dir, "novelty_index.f32")
+        self.meta_path = path.join(index_dir, "novelty_index.json")
+
+        self.accepted = 0
+        self.rejected = 0
+        # Average LLM seconds a question spends downstream (SQL + answer generation)
+        self.downstream_seconds = 0.0
+        self._downstream_total = 0.0
+        self._downstream_rows = 0
+
+        # sql_fingerprints of the rows already pulled by sync()
+        self._synced = set()
+        self._lock = Lock()
+        self._dim = 0
+        self._hashes = []
+        self._hash_set = set()
+        self._questions = []
+        self._matrix = None
+        self._load()
+
+    @staticmethod
+    def _hash(question: str) -> str:
+        return sha256(" ".join(question.lower().split()).encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not (path.exists(self.meta_path) and path.exists(self.vectors_path)):
+            return
+        try:
+            with open(self.meta_path) as meta_file:
+                meta = json.load(meta_file)
+            self._dim = meta["dim"]
+            self._hashes = meta["hashes"]
+            self._questions = meta["questions"]
+            self._hash_set = set(self._hashes)
+            self._remap()
+        except Exception:
+            self._reset()
+
+    def _reset(self):
+        for stale_path in (self.vectors_path, self.meta_path):
+            if path.exists(stale_path):
+                remove(stale_path)
+        self._dim, self._hashes, self._hash_set, self._questions, self._matrix = 0, [], set(), [], None
+
+    def _remap(self):
+        count = len(self._hashes)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self._dim)) \
+            if count else None
+
+    def _append(self, questions: list, vectors: np.ndarray):
+        if self._dim and vectors.shape[1] != self._dim:
+            # Embedding model changed; vectors aren't comparable any more
+            self._reset()
+        self._dim = vectors.shape[1]
+        with open(self.vectors_path, "ab") as vectors_file:
+            vectors_file.write(vectors.astype(np.float32).tobytes())
+        for question in questions:
+            question_hash = self._hash(question)
+            self._hashes.append(question_hash)
+            self._hash_set.add(question_hash)
+            self._questions.append(question)
+        with open(self.meta_path, "w") as meta_file:
+            json.dump({"dim": self._dim, "hashes": self._hashes, "questions": self._questions}, meta_file)
+        self._remap()
+
+    def sync(self):
+        """Index the aurora_discovered_kpis rows added since the last sync and update the downstream cost estimate."""
+        if not self._synced:
+            # Nothing synced yet, so every row is read again; start the estimate over
+            self._downstream_total, self._downstream_rows = 0.0, 0
+        kpis = new_discovered_kpis(self.mysql_engine, self._synced,
+                                   ["question", "query_gen_time_seconds", "answer_gen_time_seconds"])
+        self.add(kpis.question.dropna().tolist())
+        with self._lock:
+            # Rows whose questions failed to embed stay unsynced, so the next sync retries them
+            synced = kpis.question.map(
+                lambda question: not isinstance(question, str) or self._hash(question) in self._hash_set).astype(bool)
+            kpis = kpis[synced]
+            self._synced.update(kpis.sql_fingerprint.dropna())
+        if len(kpis) > 0:
+            self._downstream_total += float(
+                (kpis.query_gen_time_seconds.fillna(0) + kpis.answer_gen_time_seconds.fillna(0)).sum())
+            self._downstream_rows += len(kpis)
+            self.downstream_seconds = self._downstream_total / self._downstream_rows
+
+    def add(self, questions: list):
+        """
+        Add questions to the index, skipping ones already indexed
+
+        Args:
+            questions: List of natural language questions
+        """
+        with self._lock:
+            new_questions = list(dict.fromkeys(q for q in questions if self._hash(q) not in self._hash_set))
+            if not new_questions:
+                return
+            try:
+                vectors = self.embed(new_questions)
+            except Exception:
+                return
+            self._append(new_questions, vectors)
+
+    def filter(self, candidates: list):
+        """
+        Split generated questions into novel and near-duplicate ones
+
+        Args:
+            candidates: List of {"question", "gen_time"} dicts from question generation
+
+        Returns:
+            Tuple of (accepted candidates, rejected list of (question, similarity, nearest existing question))
+        """
+        if not candidates:
+            return [], []
+        try:
+            vectors = self.embed([candidate["question"] for candidate in candidates])
+        except Exception:
+            # Without embeddings we can't judge novelty, so let everything through
+            self.accepted += len(candidates)
+            return list(candidates), []
+
+        accepted, rejected = [], []
+        accepted_vectors = []
+        with self._lock:
+            matrix = self._matrix if self._matrix is not None and self._matrix.shape[1] == vectors.shape[1] else None
+            for candidate, vector in zip(candidates, vectors):
+                best_similarity, nearest = -1.0, None
+                if matrix is not None:
+                    similarities = matrix @ vector
+                    best = int(np.argmax(similarities))
+                    best_similarity, nearest = float(similarities[best]), self._questions[best]
+                # Also compare against candidates accepted earlier in this batch
+                for other, other_vector in zip(accepted, accepted_vectors):
+                    similarity = float(other_vector @ vector)
+                    if similarity > best_similarity:
+                        best_similarity, nearest = similarity, other["question"]
+
+                if best_similarity >= self.threshold:
+                    rejected.append((candidate["question"], best_similarity, nearest))
+                else:
+                    accepted.append(candidate)
+                    accepted_vectors.append(vector)
+
+        self.accepted += len(accepted)
+        self.rejected += len(rejected)
+        return accepted, rejected
+
+    def report(self) -> str:
+        """One-line summary of rejections and the downstream LLM time they saved."""
+        saved = self.rejected * self.downstream_seconds
+        return (f"Novelty filter: {self.rejected} near-duplicate questions rejected, {self.accepted} accepted, "
+                f"~{saved:.1f}s of LLM time saved")
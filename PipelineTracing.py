@@ -0,0 +1,307 @@
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from os import environ, makedirs, path, replace, urandom
+from threading import Lock
+from time import time
+import atexit
+import json
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+# Latency histogram buckets in seconds, from cached lookups up to slow LLM calls
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current_span = ContextVar("aurora_current_span", default=None)
+
+
+class Span:
+    """
+    One timed unit of pipeline work, with attributes.
+
+    Created by PipelineTracer.start_span; becomes the parent of spans recorded
+    in the same context until end() is called.
+    """
+
+    def __init__(self, tracer, name, parent=None, start_ts=None, **attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else urandom(16).hex()
+        self.span_id = urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ts = start_ts if start_ts is not None else time()
+        self.end_ts = None
+        self.attributes = dict(attributes)
+        self._token = None
+
+    def set(self, **attributes):
+        """Add or overwrite attributes, e.g. rows or cache_hit once they're known."""
+        self.attributes.update(attributes)
+        return self
+
+    def end(self, error=None, end_ts=None, **attributes):
+        """
+        Finish the span and hand it to the tracer
+
+        Args:
+            error: Exception that ended the span, recorded as error.class and error.message
+            end_ts: End time (default: now)
+            **attributes: Final attributes to add
+        """
+        if self.end_ts is not None:
+            return
+        self.attributes.update(attributes)
+        if error is not None:
+            self.attributes["error.class"] = type(error).__name__
+            self.attributes["error.message"] = str(error)[:500]
+        self.end_ts = end_ts if end_ts is not None else time()
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Ended from a different context than it was started in
+                _current_span.set(None)
+            self._token = None
+        self.tracer._finish(self)
+
+    @property
+    def seconds(self):
+        return (self.end_ts if self.end_ts is not None else time()) - self.start_ts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.end(error=exc)
+        return False
+
+
+class PipelineTracer:
+    """
+    Span recorder and latency metrics for the NL->SQL pipeline.
+
+    Stages (question_generation, sql_generation, query_execution,
+    answer_generation, logging, ...) are recorded as spans with attributes such
+    as model, rows, bytes, cache_hit and error.class. Per stage and model the
+    tracer keeps a latency histogram and a window of recent durations for
+    p50/p95/p99. Metrics are written as a Prometheus textfile (for the node
+    exporter's textfile collector) and spans as OTLP/JSON lines, both under
+    $AURORA_CACHE_DIR and batched so the pipeline never waits on file I/O.
+    """
+
+    def __init__(self, exporters=None, metrics_path=None, traces_path=None, flush_seconds=None, window=None,
+                 service_name="aurora-ai-agent"):
+        """
+        Initialize the tracer
+
+        Args:
+            exporters: Comma-separated sinks: "prometheus", "otlp", both, or "off"
+                       (default: $PIPELINE_TRACE_EXPORT or "prometheus")
+            metrics_path: Prometheus textfile (default: $AURORA_CACHE_DIR/aurora_pipeline.prom)
+            traces_path: OTLP/JSON lines file (default: $AURORA_CACHE_DIR/aurora_traces.jsonl)
+            flush_seconds: Minimum time between automatic exports (default: $PIPELINE_TRACE_FLUSH_SECONDS or 15)
+            window: Recent durations kept per stage and model for quantiles
+                    (default: $PIPELINE_TRACE_WINDOW or 10000)
+            service_name: service.name resource attribute on exported spans
+        """
+        exporters = exporters if exporters is not None else environ.get("PIPELINE_TRACE_EXPORT", "prometheus")
+        self.exporters = {name.strip() for name in exporters.split(",") if name.strip() not in ("", "off")}
+        self.metrics_path = metrics_path or path.join(CACHE_DIR, "aurora_pipeline.prom")
+        self.traces_path = traces_path or path.join(CACHE_DIR, "aurora_traces.jsonl")
+        self.flush_seconds = flush_seconds if flush_seconds is not None \
+            else float(environ.get("PIPELINE_TRACE_FLUSH_SECONDS", "15"))
+        self.window = window if window is not None else int(environ.get("PIPELINE_TRACE_WINDOW", "10000"))
+        self.service_name = service_name
+
+        self._lock = Lock()
+        self._buckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self._sums = defaultdict(float)
+        self._recent = defaultdict(lambda: deque(maxlen=self.window))
+        self._errors = defaultdict(int)
+        self._cache_hits = defaultdict(int)
+        self._pending_spans = []
+        self._last_flush = time()
+        atexit.register(self.flush)
+
+    def start_span(self, name, **attributes) -> Span:
+        """
+        Start a span that parents spans recorded in the same context until it ends.
+        Can be used as a context manager, which ends it with any exception raised.
+        """
+        span = Span(self, name, parent=_current_span.get(), **attributes)
+        span._token = _current_span.set(span)
+        return span
+
+    def record_span(self, name, start_ts, end_ts=None, error=None, **attributes) -> Span:
+        """
+        Record an already-timed stage as a child of the current span, for code that
+        measures stages with time() deltas
+
+        Args:
+            name: Stage name
+            start_ts: Stage start time
+            end_ts: Stage end time (default: now)
+            error: Exception the stage failed with, if any
+            **attributes: Span attributes (model, rows, bytes, cache_hit, ...)
+        """
+        span = Span(self, name, parent=_current_span.get(), start_ts=start_ts, **attributes)
+        span.end(error=error, end_ts=end_ts)
+        return span
+
+    def _finish(self, span):
+        key = (span.name, str(span.attributes.get("model") or "none"))
+        seconds = max(span.seconds, 0.0)
+        with self._lock:
+            self._buckets[key][bisect_left(BUCKETS, seconds)] += 1
+            self._sums[key] += seconds
+            self._recent[key].append(seconds)
+            if "error.class" in span.attributes:
+                self._errors[key + (span.attributes["error.class"],)] += 1
+            if span.attributes.get("cache_hit"):
+                self._cache_hits[key] += 1
+            if "otlp" in self.exporters:
+                self._pending_spans.append(span)
+            due = self.exporters and time() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def quantiles(self, stage, model="none") -> dict:
+        """p50/p95/p99 of recent durations for a stage and model, in seconds."""
+        with self._lock:
+            values = sorted(self._recent.get((stage, model), ()))
+        return _quantiles(values)
+
+    def report(self) -> str:
+        """Latency percentiles and error counts per stage and model."""
+        with self._lock:
+            if not self._recent:
+                return "Pipeline timings: no spans recorded"
+            lines = ["Pipeline timings (p50 / p95 / p99):"]
+            for (stage, model), recent in self._recent.items():
+                q = _quantiles(sorted(recent))
+                count = sum(self._buckets[(stage, model)])
+                errors = sum(n for key, n in self._errors.items() if key[:2] == (stage, model))
+                hits = self._cache_hits[(stage, model)]
+                lines.append(
+                    f"- {stage}" + (f" [{model}]" if model != "none" else "")
+                    + f": {q[0.5]:.3f}s / {q[0.95]:.3f}s / {q[0.99]:.3f}s over {count} spans"
+                    + (f", {hits} cache hits" if hits else "") + (f", {errors} errors" if errors else "")
+                )
+            return "\n".join(lines)
+
+    def flush(self):
+        """Write the metrics textfile and any pending spans now."""
+        with self._lock:
+            self._last_flush = time()
+            spans, self._pending_spans = self._pending_spans, []
+            metrics = self._render_metrics() if "prometheus" in self.exporters else None
+        try:
+            if metrics is not None:
+                makedirs(path.dirname(self.metrics_path) or ".", exist_ok=True)
+                # Write-then-rename so the textfile collector never reads a partial file
+                with open(self.metrics_path + ".tmp", "w") as metrics_file:
+                    metrics_file.write(metrics)
+                replace(self.metrics_path + ".tmp", self.metrics_path)
+            if spans:
+                makedirs(path.dirname(self.traces_path) or ".", exist_ok=True)
+                with open(self.traces_path, "a") as traces_file:
+                    traces_file.write(json.dumps(self._otlp_request(spans)) + "\n")
+        except OSError as export_error:
+            print(f"Failed to export pipeline metrics: {export_error}")
+
+    def _render_metrics(self) -> str:
+        lines = [
+            "# HELP aurora_stage_duration_seconds Pipeline stage latency.",
+            "# TYPE aurora_stage_duration_seconds histogram",
+        ]
+        for (stage, model), counts in self._buckets.items():
+            labels = f'stage="{_escape(stage)}",model="{_escape(model)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, counts):
+                cumulative += count
+                lines.append(f'aurora_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'aurora_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"aurora_stage_duration_seconds_sum{{{labels}}} {self._sums[(stage, model)]:.6f}")
+            lines.append(f"aurora_stage_duration_seconds_count{{{labels}}} {cumulative}")
+
+        lines += [
+            "# HELP aurora_stage_duration_recent_seconds Pipeline stage latency quantiles over recent spans.",
+            "# TYPE aurora_stage_duration_recent_seconds summary",
+        ]
+        for (stage, model), recent in self._recent.items():
+            labels = f'stage="{_escape(stage)}",model="{_escape(model)}"'
+            values = sorted(recent)
+            for quantile, value in _quantiles(values).items():
+                lines.append(f'aurora_stage_duration_recent_seconds{{{labels},quantile="{quantile}"}} {value:.6f}')
+            lines.append(f"aurora_stage_duration_recent_seconds_sum{{{labels}}} {sum(values):.6f}")
+            lines.append(f"aurora_stage_duration_recent_seconds_count{{{labels}}} {len(values)}")
+
+        lines += ["# HELP aurora_stage_errors_total Failed pipeline stages by error class.",
+                  "# TYPE aurora_stage_errors_total counter"]
+        for (stage, model, error_class), count in self._errors.items():
+            lines.append(f'aurora_stage_errors_total{{stage="{_escape(stage)}",model="{_escape(model)}",'
+                         f'error_class="{_escape(error_class)}"}} {count}')
+
+        lines += ["# HELP aurora_stage_cache_hits_total Pipeline stages served from a cache.",
+                  "# TYPE aurora_stage_cache_hits_total counter"]
+        for (stage, model), count in self._cache_hits.items():
+            lines.append(f'aurora_stage_cache_hits_total{{stage="{_escape(stage)}",model="{_escape(model)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def _otlp_request(self, spans) -> dict:
+        """Spans as an OTLP/JSON ExportTraceServiceRequest, the format of the collector's file exporter."""
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+            "scopeSpans": [{
+                "scope": {"name": "aurora.pipeline"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(int(span.start_ts * 1e9)),
+                    "endTimeUnixNano": str(int(span.end_ts * 1e9)),
+                    "attributes": [_otlp_attribute(key, value) for key, value in span.attributes.items()
+                                   if value is not None],
+                    "status": {"code": 2 if "error.class" in span.attributes else 1},
+                } for span in spans],
+            }],
+        }]}
+
+
+def _quantiles(sorted_values) -> dict:
+    if not sorted_values:
+        return {quantile: 0.0 for quantile in QUANTILES}
+    last = len(sorted_values) - 1
+    return {quantile: sorted_values[min(last, round(quantile * last))] for quantile in QUANTILES}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _otlp_attribute(key, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+_tracer = None
+_tracer_lock = Lock()
+
+
+def get_tracer() -> PipelineTracer:
+    """Return the process-wide tracer, so every component exports into the same metrics."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = PipelineTracer()
+        return _tracer
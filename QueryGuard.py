@@ -0,0 +1,313 @@
+from os import environ
+from threading import Thread, current_thread, main_thread
+import json
+import re
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import text
+
+from ResultStream import PREVIEW_ROWS, RESULT_STREAM_CHUNK_ROWS, StreamedResult, record_batch
+
+
+class QueryCostExceeded(Exception):
+    """A generated query's estimated cost is over the guard's budget."""
+
+    def __init__(self, sql_query, rows_examined, budget, scans):
+        self.sql_query = sql_query
+        self.rows_examined = rows_examined
+        self.budget = budget
+        self.scans = scans
+        super().__init__(f"Query rejected: estimated {rows_examined:,.0f} rows examined, over the budget of "
+                         f"{budget:,.0f} ({describe_scans(scans)})")
+
+    def rewrite_request(self) -> str:
+        """Instructions for regenerating a cheaper query, to send back to the SQL LLM."""
+        return (f"The query\n{self.sql_query}\nwas rejected before running: the database estimates it examines "
+                f"{self.rows_examined:,.0f} rows ({describe_scans(self.scans)}), over the limit of "
+                f"{self.budget:,.0f}. The join columns are not indexed. Rewrite it to answer the same question "
+                f"while reading fewer rows: join fewer tables, aggregate before joining, or filter earlier.")
+
+
+class ReplicaUnsupported(Exception):
+    """A query can't run on the local analytics replica (see AnalyticsReplica); run it on MariaDB instead."""
+
+    def __init__(self, sql_query, reason):
+        self.sql_query = sql_query
+        self.reason = reason
+        super().__init__(f"Query not supported on the replica: {reason}")
+
+
+def describe_scans(scans) -> str:
+    return "; ".join(f"{table} {access_type} ~{rows:,.0f} rows" for table, access_type, rows in scans)
+
+
+def estimate_rows_examined(plan) -> tuple:
+    """
+    Estimate total rows examined from an EXPLAIN FORMAT=JSON plan (MariaDB or MySQL)
+
+    Tables in a nested loop are each scanned once per row produced by the tables
+    before them, so a table's examined rows are its per-scan rows times that
+    fanout. Materialized derived tables and subqueries are costed once.
+
+    Returns:
+        Tuple of (rows examined, [(table, access type, rows per scan), ...])
+    """
+    scans, examined = [], []
+
+    def walk(node, fanout):
+        if isinstance(node, list):
+            for item in node:
+                fanout = walk(item, fanout)
+            return fanout
+        if not isinstance(node, dict):
+            return fanout
+        if "table_name" in node:
+            rows = float(node.get("rows", node.get("rows_examined_per_scan", 0)) or 0)
+            filtered = float(node.get("filtered", 100) or 100)
+            scans.append((node["table_name"], node.get("access_type", "?"), rows))
+            examined.append(fanout * rows)
+            for key in ("materialized", "subqueries"):
+                if key in node:
+                    walk(node[key], 1.0)
+            return fanout * rows * filtered / 100
+        for key, value in node.items():
+            if key in ("subqueries", "query_specifications", "materialized"):
+                # Run once, independently of the surrounding join
+                walk(value, 1.0)
+            elif isinstance(value, (dict, list)):
+                fanout = walk(value, fanout)
+        return fanout
+
+    walk(plan, 1.0)
+    return sum(examined), scans
+
+
+class QueryGuard:
+    """
+    Pre-execution cost guard for generated SQL.
+
+    Before a query runs, EXPLAIN FORMAT=JSON estimates the rows it will examine.
+    Over-budget queries are rejected with QueryCostExceeded (callers can send
+    them back to the LLM for rewriting) or, in sample mode, run with their
+    largest table cut to a prefix of rows and the result marked as sampled.
+    Queries that do run carry a server-side statement time limit, and a Ctrl-C
+    while waiting kills the query on the server instead of leaving it running.
+    Large results can be streamed through a server-side cursor (see stream).
+    The cost check and time limit apply to MariaDB/MySQL only. With an
+    AnalyticsReplica, queries run there first and only fall back to the
+    database (and its guard) when the replica can't run them.
+    """
+
+    def __init__(self, mysql_engine, max_rows_examined=None, max_execution_seconds=None, action=None,
+                 sample_rows=None, replica=None):
+        """
+        Initialize the query guard
+
+        Args:
+            mysql_engine: SQLAlchemy engine the queries run against
+            max_rows_examined: Estimated rows examined above which a query is over budget
+                               (default: $QUERY_GUARD_MAX_ROWS or 50,000,000)
+            max_execution_seconds: Server-side statement time limit, 0 for none
+                                   (default: $QUERY_MAX_EXECUTION_SECONDS or 120)
+            action: What to do with an over-budget query: "reject" raises QueryCostExceeded,
+                    "sample" runs it on a subset (default: $QUERY_GUARD_ACTION or "reject")
+            sample_rows: Rows of the largest table kept in sample mode (default: $QUERY_GUARD_SAMPLE_ROWS or 100,000)
+            replica: Optional AnalyticsReplica to run queries on before the database
+        """
+        self.mysql_engine = mysql_engine
+        self.max_rows_examined = max_rows_examined if max_rows_examined is not None \
+            else float(environ.get("QUERY_GUARD_MAX_ROWS", "50000000"))
+        self.max_execution_seconds = max_execution_seconds if max_execution_seconds is not None \
+            else float(environ.get("QUERY_MAX_EXECUTION_SECONDS", "120"))
+        self.action = action if action is not None else environ.get("QUERY_GUARD_ACTION", "reject")
+        self.sample_rows = sample_rows if sample_rows is not None \
+            else int(environ.get("QUERY_GUARD_SAMPLE_ROWS", "100000"))
+        self.replica = replica
+
+        self.rejected = 0
+        self.sampled = 0
+        self.cancelled = 0
+        self.replica_fallbacks = 0
+
+    @property
+    def _is_mysql(self) -> bool:
+        return self.mysql_engine.dialect.name == "mysql"
+
+    def estimate(self, sql_query) -> tuple:
+        """(rows examined, scans) for a query, from EXPLAIN FORMAT=JSON; see estimate_rows_examined."""
+        with self.mysql_engine.connect() as conn:
+            plan = conn.execute(text(f"EXPLAIN FORMAT=JSON {sql_query}")).scalar()
+        return estimate_rows_examined(json.loads(plan))
+
+    def check(self, sql_query) -> tuple:
+        """
+        Estimate a query's cost and raise QueryCostExceeded if it's over budget
+
+        Returns:
+            Tuple of (rows examined, scans); (0, []) when the database can't be checked
+        """
+        if not self._is_mysql:
+            return 0, []
+        rows_examined, scans = self.estimate(sql_query)
+        if rows_examined > self.max_rows_examined:
+            raise QueryCostExceeded(sql_query, rows_examined, self.max_rows_examined, scans)
+        return rows_examined, scans
+
+    def with_time_limit(self, sql_query) -> str:
+        """The query wrapped in the server's statement time limit syntax."""
+        if not self._is_mysql or not self.max_execution_seconds:
+            return sql_query
+        if getattr(self.mysql_engine.dialect, "is_mariadb", True):
+            return f"SET STATEMENT max_statement_time={self.max_execution_seconds:g} FOR {sql_query}"
+        # MySQL only takes the limit as an optimizer hint on the SELECT
+        return re.sub(r"^\s*select\b", f"SELECT /*+ MAX_EXECUTION_TIME({int(self.max_execution_seconds * 1000)}) */",
+                      sql_query, count=1, flags=re.I)
+
+    def sampled_query(self, sql_query, scans):
+        """
+        The query with its largest scanned base table replaced by its first sample_rows rows
+
+        Returns:
+            The rewritten query, or None when no scanned base table appears in it
+        """
+        tree = sqlglot.parse_one(sql_query, read="mysql")
+        ctes = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+        tables = [table for table in tree.find_all(exp.Table) if table.name not in ctes]
+        # Largest first; <derived2>/<subquery2> and CTE scans are materialized results, not tables to cut
+        for name, _, _ in sorted(scans, key=lambda scan: -scan[2]):
+            if name.startswith("<") or name in ctes:
+                continue
+            # EXPLAIN names tables by their alias when they have one
+            matches = [table for table in tables if name in (table.alias, table.name)]
+            if not matches:
+                continue
+            for table in matches:
+                alias = table.alias or table.name
+                subquery = sqlglot.parse_one(f"SELECT * FROM `{table.name}` LIMIT {int(self.sample_rows)}",
+                                             read="mysql").subquery(alias)
+                table.replace(subquery)
+            return tree.sql(dialect="mysql")
+        return None
+
+    def _prepare(self, sql_query) -> tuple:
+        """Check a query; returns (query to run, sampled), raising QueryCostExceeded in reject mode."""
+        try:
+            self.check(sql_query)
+        except QueryCostExceeded as e:
+            sampled_query = self.sampled_query(sql_query, e.scans) if self.action == "sample" else None
+            if sampled_query is None:
+                # Reject mode, or nothing to cut: running it unchanged would spend the full cost anyway
+                self.rejected += 1
+                raise
+            self.sampled += 1
+            return sampled_query, True
+        return sql_query, False
+
+    def read_sql(self, sql_query):
+        """
+        Check and run a query
+
+        Args:
+            sql_query: The SQL query to execute
+
+        Returns:
+            DataFrame, converted from the Arrow batches of stream(); df.attrs["sampled"] is True when
+            sample mode cut the input
+
+        Raises:
+            QueryCostExceeded: The query is over budget and the action is "reject"
+            KeyboardInterrupt: Ctrl-C while the query ran; the server query was killed first
+        """
+        return self.stream(sql_query, keep_frame=True).frame
+
+    def stream(self, sql_query, on_preview=None, on_chunk=None, keep_frame=False, chunk_rows=None):
+        """
+        Check and run a query, fetching its rows in chunks through a server-side cursor
+
+        The first PREVIEW_ROWS rows are fetched on their own so on_preview can show
+        them while the rest of the result is still arriving. Each chunk is turned
+        into an Arrow record batch (see record_batch) as it arrives; only the
+        current batch and StreamedResult's bounded buffer are held in memory.
+
+        Args:
+            sql_query: The SQL query to execute
+            on_preview: Optional callback with the StreamedResult once its first rows arrive
+            on_chunk: Optional callback with each chunk (pyarrow.RecordBatch) as it arrives
+            keep_frame: Keep every row so the full DataFrame is available as .frame
+            chunk_rows: Rows per fetch (default: $RESULT_STREAM_CHUNK_ROWS or 10,000)
+
+        Returns:
+            The finished StreamedResult; .sampled is True when sample mode cut the input
+
+        Raises:
+            QueryCostExceeded: The query is over budget and the action is "reject"
+            KeyboardInterrupt: Ctrl-C while the query ran; the server query was killed first
+        """
+        if self.replica is not None:
+            try:
+                # Local and read-only, so neither the cost check nor the server time limit applies
+                return self.replica.stream(sql_query, on_preview=on_preview, on_chunk=on_chunk,
+                                           keep_frame=keep_frame, chunk_rows=chunk_rows)
+            except ReplicaUnsupported:
+                self.replica_fallbacks += 1
+        sql_query, sampled = self._prepare(sql_query)
+        timed_query = self.with_time_limit(sql_query)
+        chunk_rows = chunk_rows or RESULT_STREAM_CHUNK_ROWS
+        result = StreamedResult(on_preview=on_preview, on_chunk=on_chunk, keep_frame=keep_frame)
+        result.sampled = sampled
+
+        def fetch(conn):
+            # stream_results makes pymysql use an unbuffered cursor, so rows stay on the server until fetched
+            cursor = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(text(timed_query))
+            columns = list(cursor.keys())
+            size = PREVIEW_ROWS
+            while rows := cursor.fetchmany(size):
+                result.add(record_batch(rows, columns, result.schema))
+                size = chunk_rows
+            return result.finish(columns)
+
+        return self._execute(fetch)
+
+    def _execute(self, fetch):
+        if current_thread() is not main_thread() or not self._is_mysql:
+            # Only the main thread sees Ctrl-C, so elsewhere there's nothing to cancel on
+            with self.mysql_engine.connect() as conn:
+                return fetch(conn)
+
+        with self.mysql_engine.connect() as conn:
+            connection_id = conn.execute(text("SELECT CONNECTION_ID()")).scalar()
+            outcome = {}
+
+            def run():
+                try:
+                    outcome["value"] = fetch(conn)
+                except BaseException as e:
+                    outcome["error"] = e
+
+            # The query runs on a worker so the main thread stays interruptible while it waits
+            worker = Thread(target=run, name="QueryGuard", daemon=True)
+            worker.start()
+            try:
+                while worker.is_alive():
+                    worker.join(0.1)
+            except KeyboardInterrupt:
+                self.cancel(connection_id)
+                worker.join()
+                raise
+            if "error" in outcome:
+                raise outcome["error"]
+            return outcome["value"]
+
+    def cancel(self, connection_id):
+        """Kill the running statement of a server connection (from a separate connection)."""
+        self.cancelled += 1
+        with self.mysql_engine.connect() as conn:
+            conn.execute(text(f"KILL QUERY {int(connection_id)}"))
+
+    def summary(self) -> str:
+        """One-line summary for the timing output."""
+        summary = f"Query guard: {self.rejected} rejected / {self.sampled} sampled / {self.cancelled} cancelled"
+        if self.replica is not None:
+            summary += f" | {self.replica.summary()} / {self.replica_fallbacks} on the database"
+        return summary
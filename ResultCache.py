@@ -0,0 +1,333 @@
+from hashlib import sha256
+from os import environ, listdir, makedirs, path, remove, replace, utime
+from threading import Lock, Thread
+from time import time
+import json
+import re
+
+from pandas import read_parquet
+from pyarrow.parquet import ParquetFile, ParquetWriter
+from sqlalchemy import text
+
+from QueryGuard import QueryGuard
+from ResultStream import RESULT_STREAM_CHUNK_ROWS, StreamedResult
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+# Column that moves forward whenever a table's rows change. Tables without one
+# are tracked by row count alone.
+WATERMARK_COLUMNS = {
+    "orders": "update_date",
+    "workflows": "update_date",
+    "workflow_steps": "workflow_step_date",
+    "products": None,
+}
+
+_QUOTED = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`)")
+_TABLE_REF = re.compile(
+    r"\b(?:from|join)\s+((?:`[^`]+`|[\w.]+)(?:\s+(?:as\s+)?\w+)?(?:\s*,\s*(?:`[^`]+`|[\w.]+)(?:\s+(?:as\s+)?\w+)?)*)"
+)
+
+
+def canonicalize_sql(sql_query: str) -> str:
+    """
+    Normalize SQL text so formatting-only differences share a cache entry.
+
+    Comments and a trailing semicolon are removed, whitespace is collapsed and
+    everything outside quoted literals/identifiers is lowercased.
+    """
+    parts = _QUOTED.split(sql_query)
+    for i in range(0, len(parts), 2):
+        unquoted = re.sub(r"--[^\n]*|#[^\n]*|/\*.*?\*/", " ", parts[i], flags=re.S)
+        parts[i] = re.sub(r"\s+", " ", unquoted.lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def referenced_tables(canonical_sql: str) -> list:
+    """Return the sorted table names referenced in FROM/JOIN clauses of canonicalized SQL."""
+    tables = set()
+    for match in _TABLE_REF.finditer(canonical_sql):
+        for ref in match.group(1).split(","):
+            name = ref.strip().split()[0].strip("`")
+            tables.add(name.split(".")[-1].lower())
+    return sorted(tables)
+
+
+class _ParquetSink:
+    """Appends result record batches to a Parquet file as they arrive, giving up quietly on type drift."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.writer = None
+        self.failed = False
+
+    def write(self, batch):
+        if self.failed:
+            return
+        try:
+            if self.writer is None:
+                self.writer = ParquetWriter(self.file_path, batch.schema, compression="zstd")
+            elif batch.schema != self.writer.schema:
+                # Fails when a later batch's types drift (e.g. a column that was all NULL in the first)
+                batch = batch.cast(self.writer.schema)
+            self.writer.write_batch(batch)
+        except Exception:
+            self.failed = True
+
+    def close(self, schema) -> bool:
+        """Finish the file; returns False (and removes it) if any batch couldn't be written."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        elif not self.failed:
+            try:
+                ParquetWriter(self.file_path, schema, compression="zstd").close()
+            except Exception:
+                self.failed = True
+        if self.failed:
+            self.abort()
+        return not self.failed
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if path.exists(self.file_path):
+            remove(self.file_path)
+
+
+class ResultCache:
+    """
+    Disk cache for executed query results.
+
+    Results are stored as Parquet files keyed on canonicalized SQL. Each entry
+    records a watermark (row count and latest change timestamp) for every table
+    the query reads; an entry is served only while those watermarks are
+    unchanged, so results stay fresh without a blanket TTL. The watermark probe
+    (COUNT(*) and MAX of an unindexed date column) scans each table, so it runs
+    on the request path only the first time a table is seen; after that the
+    last probe is used and refreshed in the background once it is older than
+    probe_seconds, so a result can be up to that stale. Total size on disk
+    is bounded, evicting the least recently read entries first. stream() reads
+    and writes entries chunk by chunk, for results too large to hold in memory.
+    """
+
+    def __init__(self, mysql_engine, cache_dir=None, max_bytes=None, probe_seconds=None, query_guard=None,
+                 watermarks=None):
+        """
+        Initialize the result cache
+
+        Args:
+            mysql_engine: SQLAlchemy engine the queries run against
+            cache_dir: Optional directory for cached results. Defaults to $AURORA_CACHE_DIR/results
+            max_bytes: Size bound for cached results (default: $RESULT_CACHE_MAX_BYTES or 512 MB)
+            probe_seconds: How long a table watermark probe is used before it is refreshed in the
+                           background (default: $RESULT_CACHE_PROBE_SECONDS or 300)
+            query_guard: Optional QueryGuard that cache misses run through. If None, one is created on mysql_engine
+            watermarks: Optional function from a list of tables to their watermarks, replacing the database
+                        probe (e.g. AnalyticsReplica.watermarks)
+        """
+        self.mysql_engine = mysql_engine
+        self.cache_dir = cache_dir if cache_dir is not None else path.join(CACHE_DIR, "results")
+        makedirs(self.cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes if max_bytes is not None \
+            else int(environ.get("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.probe_seconds = probe_seconds if probe_seconds is not None \
+            else float(environ.get("RESULT_CACHE_PROBE_SECONDS", "300"))
+
+        self.query_guard = query_guard if query_guard is not None else QueryGuard(mysql_engine)
+        self.watermarks = watermarks if watermarks is not None else self._watermarks
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._probes = {}
+        self._probing = False
+
+    def _key(self, canonical_sql: str) -> str:
+        url = self.mysql_engine.url
+        return sha256(f"{url.host}/{url.database}:{canonical_sql}".encode("utf-8")).hexdigest()
+
+    def _watermarks(self, tables: list) -> dict:
+        """Last probed watermarks; unseen tables are probed now, stale ones re-probed in the background."""
+        unseen = [t for t in tables if t not in self._probes]
+        if unseen:
+            self._probe(unseen)
+        now = time()
+        stale = [t for t in tables if now - self._probes[t][0] > self.probe_seconds]
+        if stale and not self._probing:
+            self._probing = True
+            Thread(target=self._probe_in_background, args=(stale,), name="ResultCache", daemon=True).start()
+        return {table: self._probes[table][1] for table in tables}
+
+    def _probe(self, tables: list):
+        """Probe row counts and latest changes of tables in a single round trip."""
+        now = time()
+        probes = []
+        for table in tables:
+            column = WATERMARK_COLUMNS.get(table)
+            latest = f"CAST(MAX(`{column}`) AS CHAR)" if column else "NULL"
+            probes.append(f"SELECT '{table}' AS table_name, COUNT(*) AS row_count, {latest} AS latest "
+                          f"FROM `{table}`")
+        with self.mysql_engine.connect() as conn:
+            for row in conn.execute(text(" UNION ALL ".join(probes))):
+                self._probes[row[0]] = (now, [int(row[1]), row[2]])
+
+    def _probe_in_background(self, tables):
+        try:
+            self._probe(tables)
+        except Exception:
+            # Keep serving the last probe; the next stale lookup retries
+            pass
+        finally:
+            self._probing = False
+
+    def read_sql(self, sql_query: str):
+        """
+        Run a query, serving the result from disk while its tables are unchanged
+
+        Args:
+            sql_query: The SQL query to execute
+
+        Returns:
+            Tuple of (DataFrame, cache_hit)
+        """
+        canonical = canonicalize_sql(sql_query)
+        tables = referenced_tables(canonical)
+        if not tables or any(t not in WATERMARK_COLUMNS for t in tables):
+            # Can't prove freshness for unknown tables, so always go to the database
+            self.misses += 1
+            return self.query_guard.read_sql(sql_query), False
+
+        with self._lock:
+            watermarks = self.watermarks(tables)
+
+        key = self._key(canonical)
+        data_path = path.join(self.cache_dir, f"{key}.parquet")
+        meta_path = path.join(self.cache_dir, f"{key}.json")
+
+        if self._is_fresh(data_path, meta_path, watermarks):
+            try:
+                df = read_parquet(data_path)
+                utime(data_path)
+                self.hits += 1
+                return df, True
+            except Exception:
+                pass
+
+        self.misses += 1
+        df = self.query_guard.read_sql(sql_query)
+        if df.attrs.get("sampled"):
+            # A sampled result isn't the query's answer, so it isn't cached
+            return df, False
+        try:
+            df.to_parquet(data_path + ".tmp", index=False, compression="zstd")
+            replace(data_path + ".tmp", data_path)
+            self._write_meta(meta_path, canonical, watermarks)
+        except Exception:
+            # Unserializable column types just aren't cached
+            for stale_path in (data_path + ".tmp", data_path, meta_path):
+                if path.exists(stale_path):
+                    remove(stale_path)
+        return df, False
+
+    def stream(self, sql_query: str, on_preview=None, keep_frame=False):
+        """
+        Run a query like read_sql, but read it (from disk or the database) one chunk at a time
+
+        Misses are fetched through QueryGuard.stream and written to the cache as
+        the chunks arrive, so neither path holds more than a chunk plus the
+        StreamedResult's bounded buffer.
+
+        Args:
+            sql_query: The SQL query to execute
+            on_preview: Optional callback with the StreamedResult once its first rows arrive
+            keep_frame: Keep every row so the full DataFrame is available as .frame
+
+        Returns:
+            Tuple of (StreamedResult, cache_hit)
+        """
+        canonical = canonicalize_sql(sql_query)
+        tables = referenced_tables(canonical)
+        if not tables or any(t not in WATERMARK_COLUMNS for t in tables):
+            self.misses += 1
+            return self.query_guard.stream(sql_query, on_preview, keep_frame=keep_frame), False
+
+        with self._lock:
+            watermarks = self.watermarks(tables)
+
+        key = self._key(canonical)
+        data_path = path.join(self.cache_dir, f"{key}.parquet")
+        meta_path = path.join(self.cache_dir, f"{key}.json")
+
+        if self._is_fresh(data_path, meta_path, watermarks):
+            try:
+                parquet_file = ParquetFile(data_path)
+                result = StreamedResult(on_preview=on_preview, keep_frame=keep_frame)
+                for batch in parquet_file.iter_batches(batch_size=RESULT_STREAM_CHUNK_ROWS):
+                    result.add(batch)
+                result.finish(parquet_file.schema_arrow.names)
+                utime(data_path)
+                self.hits += 1
+                return result, True
+            except Exception:
+                pass
+
+        self.misses += 1
+        sink = _ParquetSink(data_path + ".tmp")
+        try:
+            result = self.query_guard.stream(sql_query, on_preview, on_chunk=sink.write, keep_frame=keep_frame)
+        except BaseException:
+            sink.abort()
+            raise
+        if result.sampled:
+            # A sampled result isn't the query's answer, so it isn't cached
+            sink.abort()
+        elif sink.close(result.schema):
+            replace(data_path + ".tmp", data_path)
+            self._write_meta(meta_path, canonical, watermarks)
+        return result, False
+
+    @staticmethod
+    def _is_fresh(data_path, meta_path, watermarks) -> bool:
+        if not (path.exists(data_path) and path.exists(meta_path)):
+            return False
+        try:
+            with open(meta_path) as meta_file:
+                return json.load(meta_file)["watermarks"] == watermarks
+        except Exception:
+            return False
+
+    def _write_meta(self, meta_path, canonical, watermarks):
+        with open(meta_path, "w") as meta_file:
+            json.dump({"sql_query": canonical, "watermarks": watermarks, "created_at": time()}, meta_file)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in listdir(self.cache_dir):
+                if name.endswith(".parquet"):
+                    data_path = path.join(self.cache_dir, name)
+                    entries.append((path.getmtime(data_path), path.getsize(data_path), data_path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, data_path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                for stale_path in (data_path, data_path[:-len(".parquet")] + ".json"):
+                    if path.exists(stale_path):
+                        remove(stale_path)
+                total -= size
+
+    def clear(self):
+        """Drop every cached result, e.g. after a schema change."""
+        with self._lock:
+            for name in listdir(self.cache_dir):
+                remove(path.join(self.cache_dir, name))
+            self._probes = {}
+
+    def summary(self) -> str:
+        """One-line hit/miss summary for the timing output."""
+        return f"Result cache: {self.hits} hits / {self.misses} misses"
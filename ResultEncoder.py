@@ -0,0 +1,214 @@
+from os import environ
+
+from langchain_core.prompts import PromptTemplate
+from pandas.api.types import is_numeric_dtype
+
+from ResultStream import StreamedResult, type_name
+
+
+RESULT_TOKEN_BUDGET = int(environ.get("RESULT_TOKEN_BUDGET", "2000"))
+RESULT_MAP_REDUCE_ROWS = int(environ.get("RESULT_MAP_REDUCE_ROWS", "20000"))
+RESULT_MAP_REDUCE_CHUNKS = int(environ.get("RESULT_MAP_REDUCE_CHUNKS", "8"))
+
+
+chunk_summary_prompt = """
+### Input:
+This is one slice ({part} of {parts}) of a larger query result, summarized as schema, statistics and example rows:
+{results}
+
+### Instructions:
+Summarize the notable facts in this slice in at most 5 short bullet points: totals, leaders, laggards, ties and outliers. Use exact numbers from the data.
+"""
+
+chunk_summary_prompt_template = PromptTemplate(template=chunk_summary_prompt,
+                                               input_variables=["part", "parts", "results"])
+
+reduce_summary_prompt = """
+### Input:
+These are summaries of the {parts} slices of one query result:
+{summaries}
+
+### Instructions:
+Combine them into one summary of the whole result in short bullet points, under {words} words: totals, leaders, laggards, ties and outliers. Use exact numbers from the summaries.
+"""
+
+reduce_summary_prompt_template = PromptTemplate(template=reduce_summary_prompt,
+                                                input_variables=["parts", "summaries", "words"])
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text and tables)."""
+    return len(text) // 4 + 1
+
+
+def encode_results(df, token_budget=None, map_reduce_llm=None) -> str:
+    """
+    Render a query result for an answer prompt within a token budget.
+
+    Results that fit are passed through as the full markdown table, exactly as
+    before. Larger ones are encoded as schema, row count, per-column statistics,
+    the top and bottom rows and tie information, shrinking the number of rows
+    shown until the text fits. When map_reduce_llm is given and the result has
+    more than $RESULT_MAP_REDUCE_ROWS rows, slices are summarized by the LLM in
+    parallel and the partial summaries are appended; the statistics then get
+    half the budget and the summaries the rest, reduced by one more LLM call
+    (or truncated) when they don't fit.
+
+    A StreamedResult that kept all its rows is encoded like a DataFrame. One
+    whose rows were dropped is encoded from the statistics it computed on its
+    Arrow batches and its first/last rows instead, without the map-reduce step.
+
+    Args:
+        df: Query result DataFrame or StreamedResult
+        token_budget: Approximate token limit (default: $RESULT_TOKEN_BUDGET or 2000)
+        map_reduce_llm: Optional chat model for the map-reduce path on very large results
+
+    Returns:
+        Text for the {results} slot of an answer prompt
+    """
+    token_budget = token_budget if token_budget is not None else RESULT_TOKEN_BUDGET
+
+    if isinstance(df, StreamedResult):
+        if not df.complete:
+            return _summarize_stream(df, token_budget)
+        df = df.frame
+
+    if len(df) == 0:
+        return "The query returned no rows."
+
+    # Every markdown cell costs at least a token, so tables with more cells than the budget are never rendered
+    if df.size <= token_budget:
+        full = df.to_markdown()
+        if estimate_tokens(full) <= token_budget:
+            return full
+
+    if map_reduce_llm is None or len(df) <= RESULT_MAP_REDUCE_ROWS:
+        return _summarize(df, token_budget)
+
+    encoded = _summarize(df, token_budget // 2)
+    heading = "\n\nSummaries of slices of the full result:\n"
+    summaries = _map_reduce(df, token_budget, token_budget - estimate_tokens(encoded + heading), map_reduce_llm)
+    return encoded + heading + summaries if summaries else encoded
+
+
+def _summarize(df, token_budget: int) -> str:
+    numeric = [column for column in df.columns if is_numeric_dtype(df[column]) and df[column].dtype != bool]
+    other = [column for column in df.columns if column not in numeric]
+
+    header = [f"Result has {len(df)} rows and {len(df.columns)} columns.",
+              "Columns: " + ", ".join(f"{column} ({df[column].dtype})" for column in df.columns)]
+
+    sections = []
+    if numeric:
+        stats = df[numeric].describe().T
+        stats["nulls"] = df[numeric].isna().sum()
+        sections.append("Numeric column statistics:\n" + stats.to_markdown(floatfmt=".6g"))
+    if other:
+        lines = []
+        for column in other:
+            counts = df[column].value_counts(dropna=False)
+            top = ", ".join(f"{value} ({count})" for value, count in counts.head(5).items())
+            lines.append(f"- {column}: {counts.size} distinct; most frequent: {top}")
+        sections.append("Text column statistics:\n" + "\n".join(lines))
+
+    rank_column = _rank_column(df, numeric)
+    if rank_column is not None:
+        values = df[rank_column]
+        tied = values[values.duplicated(keep=False)]
+        sections.append(_rank_sentence(rank_column, values.iloc[0], int((values == values.iloc[0]).sum()),
+                                       values.iloc[-1], int((values == values.iloc[-1]).sum()), tied.nunique()))
+
+    return _with_rows("\n\n".join(header + sections), token_budget, len(df), df, df)
+
+
+def _summarize_stream(result, token_budget: int) -> str:
+    """Like _summarize, from a StreamedResult's running statistics and first/last rows."""
+    stats = result.stats
+    header = [f"Result has {result.rows} rows and {len(result.columns)} columns.",
+              "Columns: " + ", ".join(f"{field.name} ({type_name(field.type)})" for field in result.schema)]
+
+    sections = []
+    numeric = stats.describe()
+    if len(numeric):
+        sections.append(f"Numeric column statistics (quartiles estimated from {min(result.rows, stats.sample_rows)} "
+                        f"sampled rows):\n" + numeric.to_markdown(floatfmt=".6g"))
+    if stats.text:
+        lines = []
+        for i in stats.text:
+            top = ", ".join(f"{value} ({count})" for value, count in stats.top_values(i))
+            lines.append(f"- {stats.names[i]}: {stats.distinct(i)} distinct; most frequent: {top}")
+        sections.append("Text column statistics:\n" + "\n".join(lines))
+
+    rank = stats.rank()
+    if rank is not None:
+        sections.append(_rank_sentence(*rank))
+
+    return _with_rows("\n\n".join(header + sections), token_budget, result.rows, result.head, result.tail)
+
+
+def _rank_sentence(column, first, first_ties, last, last_ties, shared) -> str:
+    return (f"Rows are ranked by {column}. {first_ties} rows tie for the first value ({first}), {last_ties} tie for "
+            f"the last value ({last}), and {shared} values are shared by more than one row.")
+
+
+def _with_rows(text: str, token_budget: int, rows_total: int, head, tail) -> str:
+    """Append as many top/bottom rows as the budget allows; head/tail hold at least the first/last 20 rows."""
+    for rows in (20, 10, 5, 3, 1):
+        if 2 * rows >= rows_total:
+            shown = f"All rows:\n{head.head(rows_total).to_markdown()}"
+        else:
+            shown = (f"First {rows} rows:\n{head.head(rows).to_markdown()}\n\n"
+                     f"Last {rows} rows:\n{tail.tail(rows).to_markdown()}")
+        candidate = text + "\n\n" + shown
+        if estimate_tokens(candidate) <= token_budget:
+            return candidate
+    return text + "\n\n" + f"First row:\n{head.head(1).to_markdown()}"
+
+
+def _rank_column(df, numeric):
+    """The first numeric column the rows are sorted by, if any."""
+    for column in numeric:
+        values = df[column].dropna()
+        if len(values) > 1 and (values.is_monotonic_decreasing or values.is_monotonic_increasing) \
+                and values.nunique() > 1:
+            return column
+    return None
+
+
+def _truncate(text: str, token_budget: int) -> str:
+    """Cut text to the budget at a line break."""
+    if estimate_tokens(text) <= token_budget:
+        return text
+    cut = text[:max(0, (token_budget - 4) * 4)]
+    cut = cut[:cut.rfind("\n")] if "\n" in cut else cut
+    return cut + "\n[truncated]" if cut else ""
+
+
+def _map_reduce(df, token_budget: int, output_budget: int, llm) -> str:
+    """Slice summaries from the LLM, reduced to output_budget tokens (empty when nothing fits)."""
+    if output_budget <= 0:
+        return ""
+    parts = max(2, RESULT_MAP_REDUCE_CHUNKS)
+    size = -(-len(df) // parts)
+    slices = [df.iloc[start:start + size] for start in range(0, len(df), size)]
+    prompts = [
+        chunk_summary_prompt_template.format(part=i, parts=len(slices),
+                                             results=_summarize(piece, token_budget // 2))
+        for i, piece in enumerate(slices, 1)
+    ]
+    responses = llm.batch(prompts, config={"max_concurrency": len(prompts)}, return_exceptions=True)
+    summaries = []
+    for i, response in enumerate(responses, 1):
+        if not isinstance(response, Exception):
+            content = response.content if hasattr(response, "content") else str(response)
+            summaries.append(f"Slice {i} of {len(slices)}:\n{content.strip()}")
+    combined = "\n\n".join(summaries)
+    if estimate_tokens(combined) > output_budget and summaries:
+        try:
+            # Reduce step: one more call merges the partial summaries into one that fits
+            response = llm.invoke(reduce_summary_prompt_template.format(
+                parts=len(slices), summaries=combined, words=max(10, output_budget * 3 // 4)))
+            combined = (response.content if hasattr(response, "content") else str(response)).strip()
+        except Exception:
+            pass
+    return _truncate(combined, output_budget)
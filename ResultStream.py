@@ -0,0 +1,491 @@
+from os import environ
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pandas import DataFrame, RangeIndex
+
+
+RESULT_STREAM_CHUNK_ROWS = int(environ.get("RESULT_STREAM_CHUNK_ROWS", "10000"))
+RESULT_STREAM_BUFFER_ROWS = int(environ.get("RESULT_STREAM_BUFFER_ROWS", "20000"))
+RESULT_STREAM_SAMPLE_ROWS = int(environ.get("RESULT_STREAM_SAMPLE_ROWS", "10000"))
+# Text columns with at most this share of distinct values in the first batch are dictionary encoded
+RESULT_DICTIONARY_RATIO = float(environ.get("RESULT_DICTIONARY_RATIO", "0.5"))
+PREVIEW_ROWS = 20
+# Text columns track at most this many distinct values; rarer ones are pruned once it's exceeded
+DISTINCT_LIMIT = 10000
+
+
+def record_batch(rows, columns, schema=None) -> pa.RecordBatch:
+    """
+    Transpose DB-API rows into an Arrow record batch
+
+    Column types are inferred from the values, with DECIMAL results converted
+    to doubles (as pandas' coerce_float does) and columns that mix types stored
+    as text. Text columns whose share of distinct values is at most
+    $RESULT_DICTIONARY_RATIO are dictionary encoded, so repeated names are
+    stored once per batch instead of once per row.
+
+    Args:
+        rows: Sequence of row tuples
+        columns: Column names
+        schema: Schema of the result's earlier batches; later batches are built to match it
+
+    Returns:
+        pyarrow.RecordBatch
+    """
+    arrays = [_column_array(list(values), schema.field(i).type if schema is not None else None)
+              for i, values in enumerate(zip(*rows))]
+    return pa.RecordBatch.from_arrays(arrays, names=list(columns))
+
+
+def decimals_to_float(batch) -> pa.RecordBatch:
+    """The batch with its DECIMAL columns converted to doubles, matching record_batch."""
+    if not any(pa.types.is_decimal(field.type) for field in batch.schema):
+        return batch
+    arrays = [pc.cast(column, pa.float64()) if pa.types.is_decimal(column.type) else column
+              for column in batch.columns]
+    return pa.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+
+def _column_array(values, known_type=None) -> pa.Array:
+    if known_type is not None and pa.types.is_null(known_type):
+        # All NULL so far, so nothing is known yet
+        known_type = None
+    value_type = known_type.value_type if known_type is not None and pa.types.is_dictionary(known_type) \
+        else known_type
+    array = None
+    if value_type is not None:
+        try:
+            array = pa.array(values, type=value_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+    if array is None:
+        try:
+            array = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            array = pa.array([None if value is None else str(value) for value in values], type=pa.string())
+        if pa.types.is_decimal(array.type):
+            array = pc.cast(array, pa.float64())
+
+    if known_type is not None:
+        if pa.types.is_dictionary(known_type) and not pa.types.is_dictionary(array.type):
+            array = array.dictionary_encode()
+        if array.type != known_type:
+            try:
+                array = array.cast(known_type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                pass
+    elif pa.types.is_string(array.type) and len(array):
+        encoded = array.dictionary_encode()
+        if len(encoded.dictionary) <= RESULT_DICTIONARY_RATIO * len(array):
+            array = encoded
+    return array
+
+
+def _widen(field, other) -> pa.Field:
+    """The field, with a type that holds both its values and other's (e.g. null -> int64 -> double)."""
+    if field.type == other.type:
+        return field
+    return pa.unify_schemas([pa.schema([field]), pa.schema([other.with_name(field.name)])],
+                            promote_options="permissive").field(0)
+
+
+def _is_numeric(arrow_type) -> bool:
+    return pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type)
+
+
+def type_name(arrow_type) -> str:
+    """Short name of a column type for prompts (dictionary columns are named by their value type)."""
+    return str(arrow_type.value_type if pa.types.is_dictionary(arrow_type) else arrow_type)
+
+
+class _NumericColumn:
+    """Running count, mean, variance, range and sort order of one numeric column."""
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.first = None
+        self.last = None
+        self.increasing = True
+        self.decreasing = True
+        # Runs of equal values, for tie counts while the column stays sorted
+        self.first_run = None
+        self.run_value = None
+        self.run_length = 0
+        self.shared = 0
+
+    def update(self, values):
+        missing = np.isnan(values)
+        self.nulls += int(missing.sum())
+        values = values[~missing]
+        if not len(values):
+            return
+
+        # Chan et al. pairwise update, so the variance is exact without keeping the values
+        count, mean = len(values), float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        if self.first is None:
+            self.first = values[0]
+        steps = np.diff(values if self.last is None else np.concatenate(([self.last], values)))
+        self.increasing = self.increasing and bool((steps >= 0).all())
+        self.decreasing = self.decreasing and bool((steps <= 0).all())
+        self.last = values[-1]
+        if self.increasing or self.decreasing:
+            self._track_runs(values)
+
+    def _track_runs(self, values):
+        starts = np.flatnonzero(np.diff(values) != 0) + 1
+        lengths = np.diff(np.concatenate(([0], starts, [len(values)])))
+        run_values = values[np.concatenate(([0], starts))]
+        if self.run_length and run_values[0] == self.run_value:
+            lengths[0] += self.run_length
+        elif self.run_length:
+            lengths = np.concatenate(([self.run_length], lengths))
+        closed = lengths[:-1]
+        if self.first_run is None and len(closed):
+            self.first_run = int(closed[0])
+        self.shared += int((closed > 1).sum())
+        self.run_value, self.run_length = run_values[-1], int(lengths[-1])
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else np.nan
+
+
+class ResultStats:
+    """
+    Summary statistics of a query result, updated one record batch at a time.
+
+    Numeric columns keep exact counts, means, standard deviations and ranges,
+    quartiles estimated from a uniform reservoir sample of rows, and whether
+    the rows are sorted by them (with tie counts). Text columns keep value
+    counts, bounded to DISTINCT_LIMIT distinct values. Statistics are computed
+    on the Arrow columns directly; dictionary columns are counted by index.
+    """
+
+    def __init__(self, sample_rows=None, seed=0):
+        """
+        Initialize empty statistics
+
+        Args:
+            sample_rows: Reservoir size for quartile estimates (default: $RESULT_STREAM_SAMPLE_ROWS or 10,000)
+            seed: Seed for the reservoir sampler
+        """
+        self.sample_rows = sample_rows if sample_rows is not None else RESULT_STREAM_SAMPLE_ROWS
+        self.names = []
+        # Keyed by column position, since joins can return duplicate names
+        self.numeric = {}
+        self.text = {}
+        self.text_nulls = {}
+        self.approximate = set()
+        self.sample = None
+        self.sampled_from = 0
+        # Columns that were all NULL in the first batch, whose kind a later batch may reveal (see promote)
+        self._untyped = set()
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, batch):
+        """
+        Fold a record batch into the statistics. Column kinds are fixed by the first batch,
+        except all-NULL columns, which promote() can turn numeric.
+        """
+        if self.sample is None:
+            self.names = batch.schema.names
+            self._untyped = {i for i, field in enumerate(batch.schema) if pa.types.is_null(field.type)}
+            self.numeric = {i: _NumericColumn() for i, field in enumerate(batch.schema)
+                            if _is_numeric(field.type)}
+            self.text = {i: None for i in range(batch.num_columns) if i not in self.numeric}
+            self.text_nulls = {i: 0 for i in self.text}
+            self.sample = np.full((self.sample_rows, len(self.numeric)), np.nan)
+
+        values = np.column_stack([_to_float(batch.column(i)) for i in self.numeric]) if self.numeric \
+            else np.empty((batch.num_rows, 0))
+        for j, stats in enumerate(self.numeric.values()):
+            stats.update(values[:, j])
+        self._add_to_sample(values)
+
+        for i in self.text:
+            column = batch.column(i)
+            self.text_nulls[i] += column.null_count
+            counts = _value_counts(column)
+            if self.text[i] is not None:
+                counts = pa.concat_tables([self.text[i], counts], promote_options="permissive") \
+                    .group_by("value").aggregate([("count", "sum")]).rename_columns(["value", "count"])
+            if counts.num_rows > 2 * DISTINCT_LIMIT:
+                counts = _most_common(counts, DISTINCT_LIMIT)
+                self.approximate.add(i)
+            self.text[i] = counts
+
+    def promote(self, schema):
+        """
+        Treat columns that were all NULL so far as numeric once a widened schema says they are
+
+        Args:
+            schema: The widened schema of the result (see StreamedResult._conform)
+        """
+        promoted = [i for i in sorted(self._untyped) if _is_numeric(schema.field(i).type)]
+        if self.sample is None or not promoted:
+            return
+        positions = list(self.numeric)
+        for i in promoted:
+            stats = _NumericColumn()
+            # Every row seen so far was NULL in this column
+            stats.nulls = self.text_nulls.pop(i)
+            self.text.pop(i)
+            self.approximate.discard(i)
+            self._untyped.discard(i)
+            self.numeric[i] = stats
+        self.numeric = {i: self.numeric[i] for i in sorted(self.numeric)}
+        sample = np.full((self.sample_rows, len(self.numeric)), np.nan)
+        order = list(self.numeric)
+        for j, i in enumerate(positions):
+            sample[:, order.index(i)] = self.sample[:, j]
+        self.sample = sample
+
+    def _add_to_sample(self, values):
+        # Algorithm R, vectorized over the batch
+        filled = max(0, min(len(values), self.sample_rows - self.sampled_from))
+        self.sample[self.sampled_from:self.sampled_from + filled] = values[:filled]
+        rest = np.arange(self.sampled_from + filled, self.sampled_from + len(values))
+        if len(rest):
+            slots = self._rng.integers(0, rest + 1)
+            keep = slots < self.sample_rows
+            self.sample[slots[keep]] = values[filled:][keep]
+        self.sampled_from += len(values)
+
+    def describe(self) -> DataFrame:
+        """Per numeric column statistics, laid out like DataFrame.describe().T plus a nulls column."""
+        sample = self.sample[:min(self.sampled_from, self.sample_rows)] if self.sample is not None else None
+        rows = []
+        for j, stats in enumerate(self.numeric.values()):
+            column_sample = sample[:, j][~np.isnan(sample[:, j])]
+            quartiles = np.percentile(column_sample, [25, 50, 75]) if len(column_sample) else [np.nan] * 3
+            rows.append({"count": stats.count, "mean": stats.mean if stats.count else np.nan, "std": stats.std,
+                         "min": stats.min if stats.count else np.nan, "25%": quartiles[0], "50%": quartiles[1],
+                         "75%": quartiles[2], "max": stats.max if stats.count else np.nan, "nulls": stats.nulls})
+        return DataFrame(rows, index=[self.names[i] for i in self.numeric])
+
+    def top_values(self, i, count=5) -> list:
+        """The most frequent values of text column i as (value, count), nulls included."""
+        counts = self.text[i]
+        top = list(zip(*_most_common(counts, count).columns)) if counts is not None else []
+        top = [(value.as_py(), frequency.as_py()) for value, frequency in top]
+        if self.text_nulls[i]:
+            top = sorted(top + [(np.nan, self.text_nulls[i])], key=lambda item: -item[1])
+        return top[:count]
+
+    def distinct(self, i) -> str:
+        """Distinct value count of text column i, as text ("at least N" once values were pruned)."""
+        count = (self.text[i].num_rows if self.text[i] is not None else 0) + (1 if self.text_nulls[i] else 0)
+        return f"at least {count}" if i in self.approximate else str(count)
+
+    def rank(self):
+        """
+        The first numeric column the rows are sorted by, if any
+
+        Returns:
+            Tuple of (column, first value, rows tying it, last value, rows tying it, values shared by
+            more than one row), or None
+        """
+        for i, stats in self.numeric.items():
+            if stats.count > 1 and (stats.increasing or stats.decreasing) and stats.min != stats.max:
+                first_ties = stats.first_run if stats.first_run is not None else stats.run_length
+                # Values were folded as floats; show whole numbers the way the column holds them
+                first, last = (int(value) if float(value).is_integer() else float(value)
+                               for value in (stats.first, stats.last))
+                return (self.names[i], first, first_ties, last, stats.run_length,
+                        stats.shared + (1 if stats.run_length > 1 else 0))
+        return None
+
+
+def _to_float(column) -> np.ndarray:
+    return pc.cast(column, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def _value_counts(column) -> pa.Table:
+    """Counts of the non-null values of an Arrow column, as a table of (value, count)."""
+    if pa.types.is_dictionary(column.type):
+        indices = pc.drop_null(column.indices).to_numpy(zero_copy_only=False)
+        counts = np.bincount(indices, minlength=len(column.dictionary))
+        present = np.flatnonzero(counts)
+        return pa.table({"value": column.dictionary.take(present), "count": pa.array(counts[present], pa.int64())})
+    counts = pc.value_counts(column)
+    valid = counts.field("values").is_valid()
+    return pa.table({"value": counts.field("values").filter(valid), "count": counts.field("counts").filter(valid)})
+
+
+def _most_common(counts, limit) -> pa.Table:
+    return counts.take(pc.select_k_unstable(counts, limit, [("count", "descending")]))
+
+
+class StreamedResult:
+    """
+    A query result consumed one Arrow record batch at a time.
+
+    Keeps the first and last PREVIEW_ROWS rows, ResultStats updated per batch
+    and, while the result is small, the batches themselves. Once more than
+    buffer_rows rows have arrived the buffered batches are dropped (unless the
+    caller asked for the full frame), so memory stays bounded by the batch
+    size plus the buffer however many rows the query returns. Rows stay in
+    Arrow form throughout; pandas DataFrames are made only when .head, .tail
+    or .frame are read.
+    """
+
+    def __init__(self, on_preview=None, on_chunk=None, keep_frame=False, buffer_rows=None):
+        """
+        Initialize an empty result
+
+        Args:
+            on_preview: Optional callback, called with this result once the first PREVIEW_ROWS rows
+                        (or all rows, if fewer) have arrived
+            on_chunk: Optional callback, called with every record batch as it arrives (e.g. to write it to a cache)
+            keep_frame: Keep every row, so the full result is available as .table/.frame. Statistics are
+                        skipped, since a complete result is summarized from its rows
+            buffer_rows: Rows kept before the buffer is dropped (default: $RESULT_STREAM_BUFFER_ROWS or 20,000)
+        """
+        self.on_preview = on_preview
+        self.on_chunk = on_chunk
+        self.keep_frame = keep_frame
+        self.buffer_rows = max(buffer_rows if buffer_rows is not None else RESULT_STREAM_BUFFER_ROWS,
+                               2 * PREVIEW_ROWS)
+
+        self.schema = None
+        self.columns = []
+        self.rows = 0
+        self.stats = ResultStats()
+        self.sampled = False
+        # The full result, once finished, when it fit in the buffer (or keep_frame was set)
+        self.table = None
+        self.peak_bytes = 0
+
+        self._head = []
+        self._tail = []
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._previewed = False
+        self._frame = None
+
+    @property
+    def complete(self) -> bool:
+        """True when every row is held in .table."""
+        return self.table is not None
+
+    @property
+    def head(self) -> DataFrame:
+        """The first PREVIEW_ROWS rows."""
+        return self._to_frame(self._head, 0)
+
+    @property
+    def tail(self) -> DataFrame:
+        """The last PREVIEW_ROWS rows, indexed by their row number in the result."""
+        return self._to_frame(self._tail, self.rows - sum(batch.num_rows for batch in self._tail))
+
+    @property
+    def frame(self):
+        """The full result as a DataFrame (converted on first use), or None if it wasn't kept."""
+        if self.table is not None and self._frame is None:
+            self._frame = self.table.to_pandas()
+            self._frame.attrs["sampled"] = self.sampled
+        return self._frame
+
+    def _to_frame(self, batches, start) -> DataFrame:
+        if not batches:
+            return DataFrame(columns=self.columns)
+        df = pa.Table.from_batches(batches, self.schema).to_pandas()
+        df.index = RangeIndex(start, start + len(df))
+        return df
+
+    def add(self, batch):
+        """Take the next record batch of rows."""
+        if not batch.num_rows:
+            return
+        if self.schema is None:
+            self.schema = batch.schema
+            self.columns = batch.schema.names
+        elif batch.schema != self.schema:
+            batch = self._conform(batch)
+        self.rows += batch.num_rows
+
+        # Slices share the batch's buffers, so the first/last rows cost no copies
+        head_rows = sum(part.num_rows for part in self._head)
+        if head_rows < PREVIEW_ROWS:
+            self._head.append(batch.slice(0, PREVIEW_ROWS - head_rows))
+        self._tail = self._tail_after(batch)
+        if not self.keep_frame:
+            self.stats.update(batch)
+
+        batch_bytes = batch.nbytes
+        if self._buffer is not None:
+            self._buffer.append(batch)
+            self._buffered_bytes += batch_bytes
+            if self.rows > self.buffer_rows and not self.keep_frame:
+                self._buffer, self._buffered_bytes = None, 0
+        self.peak_bytes = max(self.peak_bytes, self._buffered_bytes + batch_bytes)
+
+        if self.on_chunk is not None:
+            self.on_chunk(batch)
+        if not self._previewed and head_rows + batch.num_rows >= PREVIEW_ROWS:
+            self._preview()
+
+    def _conform(self, batch):
+        try:
+            return batch.cast(self.schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            # A column that was all NULL (or all integers) so far: widen the schema and the rows kept
+            self.schema = pa.schema([_widen(field, other) for field, other in zip(self.schema, batch.schema)])
+            self._head = [part.cast(self.schema) for part in self._head]
+            self._tail = [part.cast(self.schema) for part in self._tail]
+            if self._buffer is not None:
+                self._buffer = [part.cast(self.schema) for part in self._buffer]
+            self.stats.promote(self.schema)
+            return batch.cast(self.schema)
+
+    def _tail_after(self, batch) -> list:
+        if batch.num_rows >= PREVIEW_ROWS:
+            return [batch.slice(batch.num_rows - PREVIEW_ROWS)]
+        tail, needed = [batch], PREVIEW_ROWS - batch.num_rows
+        for part in reversed(self._tail):
+            if needed <= 0:
+                break
+            tail.insert(0, part.slice(max(0, part.num_rows - needed)))
+            needed -= part.num_rows
+        return tail
+
+    def finish(self, columns=None):
+        """
+        Mark the result complete
+
+        Args:
+            columns: The result's column names, for results that returned no rows
+
+        Returns:
+            This result
+        """
+        if self.schema is None and columns is not None:
+            self.columns = list(columns)
+            self.schema = pa.schema([(column, pa.null()) for column in self.columns])
+        if self._buffer is not None:
+            self.table = pa.Table.from_batches(self._buffer, self.schema)
+            self._buffer = None
+        if not self._previewed:
+            self._preview()
+        return self
+
+    def _preview(self):
+        self._previewed = True
+        if self.on_preview is not None:
+            self.on_preview(self)
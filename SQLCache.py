@@ -0,0 +1,230 @@
+from hashlib import sha256
+from os import environ, makedirs, path
+from threading import Lock
+from time import time
+import re
+import sqlite3
+
+import numpy as np
+
+from AuroraEmbeddings import embed_texts
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+# Paraphrase hits remembered for invalidate()
+MATCH_LIMIT = 1024
+
+
+class SQLCache:
+    """
+    Persistent question -> SQL cache that sits in front of the SQL generation LLM.
+
+    Entries are keyed by a normalized form of the question plus a hash of the
+    schema/system prompt used to generate the SQL, so editing a prompt never
+    serves SQL written against the old one. Reworded questions are matched by
+    embedding similarity against the entries for the same schema hash.
+    """
+
+    def __init__(self, cache_path=None, similarity_threshold=None, max_entries=None, ttl_seconds=None,
+                 embed=embed_texts):
+        """
+        Initialize the cache
+
+        Args:
+            cache_path: Optional sqlite file path. Defaults to $AURORA_CACHE_DIR/sql_cache.sqlite
+            similarity_threshold: Cosine similarity needed for a paraphrase hit (default: $SQL_CACHE_SIMILARITY or 0.92)
+            max_entries: Entries kept before least-recently-used eviction (default: $SQL_CACHE_MAX_ENTRIES or 5000)
+            ttl_seconds: Entry lifetime in seconds (default: $SQL_CACHE_TTL_SECONDS or 7 days)
+            embed: Function mapping a list of strings to unit-length vectors. None disables paraphrase matching
+        """
+        if cache_path is None:
+            makedirs(CACHE_DIR, exist_ok=True)
+            cache_path = path.join(CACHE_DIR, "sql_cache.sqlite")
+
+        self.similarity_threshold = similarity_threshold if similarity_threshold is not None \
+            else float(environ.get("SQL_CACHE_SIMILARITY", "0.92"))
+        self.max_entries = max_entries if max_entries is not None \
+            else int(environ.get("SQL_CACHE_MAX_ENTRIES", "5000"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None \
+            else float(environ.get("SQL_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+        self.embed = embed
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sql_cache (
+                cache_key TEXT PRIMARY KEY,
+                schema_hash TEXT NOT NULL,
+                question TEXT NOT NULL,
+                sql_query TEXT NOT NULL,
+                embedding BLOB,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_sql_cache_schema ON sql_cache (schema_hash, last_used)")
+        self._conn.commit()
+
+        # Per schema hash: (cache keys, embedding matrix), rebuilt lazily after writes
+        self._vectors = {}
+        self._pending_embedding = {}
+        # Question key -> key of the entry a paraphrase hit served, so invalidate() drops the entry that failed
+        self._matched = {}
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Lowercase, drop punctuation and collapse whitespace so trivial rewordings share a key."""
+        question = re.sub(r"[^\w\s]", " ", question.lower())
+        return " ".join(question.split())
+
+    @staticmethod
+    def schema_hash(*prompt_parts: str) -> str:
+        """Hash the schema/system prompt text that SQL is generated against."""
+        return sha256("\n".join(prompt_parts).encode("utf-8")).hexdigest()[:16]
+
+    def _key(self, question: str, schema_hash: str) -> str:
+        return sha256(f"{schema_hash}:{self.normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def embed_question(self, question: str):
+        """
+        Embed a question the way the cache matches paraphrases, remembering the last one so
+        get(), put() and other lookups (see KPISnapshots.lookup) share a single gateway call
+
+        Returns:
+            Unit-length vector, or None when paraphrase matching is off or the gateway failed
+        """
+        if self.embed is None:
+            return None
+        normalized = self.normalize_question(question)
+        # Read once: another thread may swap in its own question between the check and the read
+        pending = self._pending_embedding
+        if normalized in pending:
+            return pending[normalized]
+        try:
+            vector = self.embed([normalized])[0]
+        except Exception:
+            # Embedding gateway unavailable: fall back to exact matching only
+            vector = None
+        self._pending_embedding = {normalized: vector}
+        return vector
+
+    def _load_vectors(self, schema_hash: str):
+        if schema_hash not in self._vectors:
+            rows = self._conn.execute(
+                "SELECT cache_key, embedding FROM sql_cache WHERE schema_hash = ? AND embedding IS NOT NULL "
+                "AND created_at >= ?",
+                (schema_hash, time() - self.ttl_seconds)
+            ).fetchall()
+            keys = [row[0] for row in rows]
+            matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows else None
+            self._vectors[schema_hash] = (keys, matrix)
+        return self._vectors[schema_hash]
+
+    def get(self, question: str, schema_hash: str):
+        """
+        Look up SQL for a question
+
+        Args:
+            question: The natural language question
+            schema_hash: Hash of the schema/system prompt, see SQLCache.schema_hash
+
+        Returns:
+            The cached SQL query, or None on a miss
+        """
+        now = time()
+        key = self._key(question, schema_hash)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sql_query FROM sql_cache WHERE cache_key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+
+        if row is None:
+            # Embed outside the lock so concurrent lookups don't queue behind the gateway
+            vector = self.embed_question(question)
+            if vector is not None:
+                with self._lock:
+                    keys, matrix = self._load_vectors(schema_hash)
+                    if matrix is not None and matrix.shape[1] == vector.shape[0]:
+                        similarities = matrix @ vector
+                        best = int(np.argmax(similarities))
+                        if similarities[best] >= self.similarity_threshold:
+                            key = keys[best]
+                            row = self._conn.execute(
+                                "SELECT sql_query FROM sql_cache WHERE cache_key = ? AND created_at >= ?",
+                                (key, now - self.ttl_seconds)
+                            ).fetchone()
+                            if row is not None:
+                                self.semantic_hits += 1
+                                own_key = self._key(question, schema_hash)
+                                self._matched.pop(own_key, None)
+                                if len(self._matched) >= MATCH_LIMIT:
+                                    self._matched.pop(next(iter(self._matched)))
+                                self._matched[own_key] = key
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute("UPDATE sql_cache SET last_used = ? WHERE cache_key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, question: str, schema_hash: str, sql_query: str):
+        """
+        Store SQL for a question. Call this only once the SQL has executed successfully.
+
+        Args:
+            question: The natural language question
+            schema_hash: Hash of the schema/system prompt, see SQLCache.schema_hash
+            sql_query: The generated SQL query
+        """
+        now = time()
+        vector = self.embed_question(question)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sql_cache (cache_key, schema_hash, question, sql_query, embedding, "
+                "created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(question, schema_hash), schema_hash, question, sql_query,
+                 vector.astype(np.float32).tobytes() if vector is not None else None, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+            self._vectors.pop(schema_hash, None)
+
+    def invalidate(self, question: str, schema_hash: str):
+        """
+        Drop the entry served for a question, e.g. when its cached SQL failed to execute. After a
+        paraphrase hit that is the matched entry, not one stored under this question's wording.
+        """
+        with self._lock:
+            own_key = self._key(question, schema_hash)
+            keys = {own_key, self._matched.pop(own_key, own_key)}
+            self._conn.executemany("DELETE FROM sql_cache WHERE cache_key = ?", [(key,) for key in keys])
+            self._conn.commit()
+            self._vectors.pop(schema_hash, None)
+
+    def clear(self):
+        """Drop every entry, e.g. after a schema change."""
+        with self._lock:
+            self._conn.execute("DELETE FROM sql_cache")
+            self._conn.commit()
+            self._vectors = {}
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM sql_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM sql_cache WHERE cache_key IN (SELECT cache_key FROM sql_cache "
+            "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def summary(self) -> str:
+        """One-line hit/miss summary for the timing output."""
+        return f"SQL cache: {self.hits} hits ({self.semantic_hits} paraphrase) / {self.misses} misses"
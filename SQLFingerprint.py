@@ -0,0 +1,210 @@
+from decimal import Decimal, InvalidOperation
+from hashlib import sha256
+from os import environ
+from threading import Lock
+
+import sqlglot
+from sqlglot import exp
+from pandas import concat, read_sql
+from sqlalchemy import bindparam, text
+
+from ResultCache import canonicalize_sql
+from EngineRegistry import get_engine
+
+
+def canonical_sql(sql_query: str) -> str:
+    """
+    Parse a query and re-render it without formatting, alias and ordering noise.
+
+    Keyword/identifier case, identifier quoting, whitespace and literal formatting
+    come from the renderer; table aliases become t1, t2, ... in order of
+    appearance (and are dropped for single-table queries); outer select-list
+    items are all aliased c1, c2, ...; JOIN and INNER JOIN are the same; AND/OR
+    operands, equality operands, select-list items and GROUP BY items are
+    sorted. ORDER BY is kept as written since it changes the answer. SQL that
+    doesn't parse falls back to textual canonicalization.
+    """
+    try:
+        tree = sqlglot.parse_one(sql_query, read="mysql")
+    except sqlglot.errors.SqlglotError:
+        return canonicalize_sql(sql_query)
+    if tree is None:
+        return canonicalize_sql(sql_query)
+
+    _normalize_table_aliases(tree)
+    tree = tree.transform(_sort_commutative, copy=False)
+    if isinstance(tree, exp.Select):
+        # Only the outer select: inner aliases can be referenced from enclosing queries
+        _normalize_select_aliases(tree)
+    for join in tree.find_all(exp.Join):
+        if (join.args.get("kind") or "").upper() == "INNER":
+            join.set("kind", None)
+    for identifier in tree.find_all(exp.Identifier):
+        identifier.set("quoted", False)
+    for select in tree.find_all(exp.Select):
+        group = select.args.get("group")
+        if group is not None:
+            group.set("expressions", sorted(group.expressions, key=lambda e: e.sql(dialect="mysql")))
+    for literal in tree.find_all(exp.Literal):
+        if not literal.is_string:
+            try:
+                literal.set("this", format(Decimal(literal.this).normalize(), "f"))
+            except InvalidOperation:
+                pass
+
+    return tree.sql(dialect="mysql", normalize=True)
+
+
+def sql_fingerprint(sql_query: str) -> str:
+    """SHA-256 of canonical_sql, used as the duplicate key for discovered KPIs."""
+    return sha256(canonical_sql(sql_query).encode("utf-8")).hexdigest()
+
+
+def _normalize_table_aliases(tree):
+    tables = [table for table in tree.find_all(exp.Table, bfs=False) if table.name]
+    single_table = len(tables) == 1
+    qualifiers = {}
+    for i, table in enumerate(tables, 1):
+        old_alias = table.alias_or_name.lower()
+        if single_table:
+            qualifiers[old_alias] = None
+            table.set("alias", None)
+        else:
+            qualifiers[old_alias] = f"t{i}"
+            table.set("alias", exp.TableAlias(this=exp.to_identifier(f"t{i}")))
+
+    for column in tree.find_all(exp.Column):
+        qualifier = column.table.lower()
+        if qualifier in qualifiers:
+            new_qualifier = qualifiers[qualifier]
+            column.set("table", exp.to_identifier(new_qualifier) if new_qualifier else None)
+
+
+def _normalize_select_aliases(select):
+    items = sorted(select.expressions, key=lambda e: e.unalias().sql(dialect="mysql"))
+    renames = {}
+    for i, item in enumerate(items):
+        if isinstance(item, exp.Alias):
+            renames[item.alias.lower()] = f"c{i + 1}"
+            item.set("alias", exp.to_identifier(f"c{i + 1}"))
+        elif not isinstance(item, exp.Star):
+            items[i] = exp.alias_(item, f"c{i + 1}", copy=False)
+    select.set("expressions", items)
+
+    # References to select-list aliases in HAVING/ORDER BY/GROUP BY are bare columns
+    for key in ("having", "order", "group"):
+        clause = select.args.get(key)
+        if clause is None:
+            continue
+        for column in clause.find_all(exp.Column):
+            if not column.table and column.name.lower() in renames:
+                column.set("this", exp.to_identifier(renames[column.name.lower()]))
+
+
+def _sort_commutative(node):
+    if isinstance(node, (exp.And, exp.Or)) and not isinstance(node.parent, type(node)):
+        operands = sorted(node.flatten(), key=lambda e: e.sql(dialect="mysql"))
+        combine = exp.and_ if isinstance(node, exp.And) else exp.or_
+        return combine(*operands, copy=False)
+    if isinstance(node, exp.EQ):
+        left, right = sorted([node.this, node.expression], key=lambda e: e.sql(dialect="mysql"))
+        return exp.EQ(this=left, expression=right)
+    return node
+
+
+_migrated = set()
+_migrate_lock = Lock()
+
+
+def ensure_fingerprint_column(mysql_engine):
+    """
+    Make sure aurora_discovered_kpis has an indexed unique sql_fingerprint column.
+
+    On first use this adds the column, backfills fingerprints for existing rows
+    (later duplicates of an already-fingerprinted query are left NULL) and then
+    adds the unique key. Checked once per engine per process. Non-MariaDB
+    databases (the benchmark fixture) are expected to have the column already.
+    """
+    key = str(mysql_engine.url)
+    with _migrate_lock:
+        if key in _migrated or mysql_engine.dialect.name != "mysql":
+            return
+        with mysql_engine.connect() as conn:
+            exists = conn.execute(text(
+                "SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = DATABASE() "
+                "AND table_name = 'aurora_discovered_kpis' AND column_name = 'sql_fingerprint'"
+            )).scalar()
+            if not exists:
+                conn.execute(text("ALTER TABLE aurora_discovered_kpis ADD COLUMN sql_fingerprint CHAR(64) NULL"))
+                conn.commit()
+                backfill_fingerprints(mysql_engine)
+                conn.execute(text("ALTER TABLE aurora_discovered_kpis "
+                                  "ADD UNIQUE KEY ux_aurora_discovered_kpis_sql_fingerprint (sql_fingerprint)"))
+                conn.commit()
+        _migrated.add(key)
+
+
+def backfill_fingerprints(mysql_engine) -> int:
+    """
+    Fingerprint existing aurora_discovered_kpis rows that don't have one yet.
+
+    Returns:
+        Number of rows fingerprinted
+    """
+    filled = 0
+    with mysql_engine.connect() as conn:
+        seen = {row[0] for row in conn.execute(text(
+            "SELECT sql_fingerprint FROM aurora_discovered_kpis WHERE sql_fingerprint IS NOT NULL"))}
+        queries = [row[0] for row in conn.execute(text(
+            "SELECT DISTINCT sql_query FROM aurora_discovered_kpis WHERE sql_fingerprint IS NULL"))]
+        for sql_query in queries:
+            fingerprint = sql_fingerprint(sql_query)
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            filled += conn.execute(text(
+                "UPDATE aurora_discovered_kpis SET sql_fingerprint = :fingerprint "
+                "WHERE sql_query = :sql_query AND sql_fingerprint IS NULL LIMIT 1"
+            ), {"fingerprint": fingerprint, "sql_query": sql_query}).rowcount
+        conn.commit()
+    return filled
+
+
+def new_discovered_kpis(mysql_engine, seen, columns, chunk_size=500):
+    """
+    Rows of aurora_discovered_kpis whose sql_fingerprint isn't in seen.
+
+    New rows are found from the fingerprints alone (an index-only scan of the
+    unique key), so a sync with nothing new never reads question or answer text.
+    With an empty seen set every row is read, including rows without a fingerprint.
+
+    Args:
+        mysql_engine: SQLAlchemy engine holding aurora_discovered_kpis
+        seen: Fingerprints already synced
+        columns: Columns to read; sql_fingerprint is always included
+        chunk_size: New fingerprints fetched per query
+
+    Returns:
+        DataFrame of the new rows
+    """
+    ensure_fingerprint_column(mysql_engine)
+    select = f"SELECT {', '.join(columns)}, sql_fingerprint FROM aurora_discovered_kpis"
+    with mysql_engine.connect() as conn:
+        if not seen:
+            return read_sql(text(select), conn)
+        new = [row[0] for row in conn.execute(text(
+            "SELECT sql_fingerprint FROM aurora_discovered_kpis WHERE sql_fingerprint IS NOT NULL"))
+            if row[0] not in seen]
+        query = text(f"{select} WHERE sql_fingerprint IN :fingerprints") \
+            .bindparams(bindparam("fingerprints", expanding=True))
+        return concat([read_sql(query, conn, params={"fingerprints": new[start:start + chunk_size]})
+                       for start in range(0, len(new), chunk_size)] or
+                      [read_sql(text(f"{select} WHERE 1 = 0"), conn)], ignore_index=True)
+
+
+# One-off migration/backfill for an existing database
+if __name__ == "__main__":
+    SQL_READ_DB = environ.get("SQL_READ_DB", "aurora")
+    engine = get_engine(database=SQL_READ_DB)
+    ensure_fingerprint_column(engine)
+    print(f"Fingerprinted {backfill_fingerprints(engine)} additional rows.")
@@ -0,0 +1,303 @@
+from difflib import get_close_matches
+from os import environ
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.scope import Scope, traverse_scope
+
+
+# Validated queries remembered per schema
+RESULT_LIMIT = 1024
+
+# Statements and clauses that write, lock or leave the SELECT world
+_WRITES = (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter, exp.TruncateTable,
+           exp.Command, exp.Into, exp.Lock)
+
+
+class SQLValidationError(Exception):
+    """Generated SQL failed static validation (see SQLValidator) and regenerating didn't fix it."""
+
+    def __init__(self, sql_query, errors):
+        self.sql_query = sql_query
+        self.errors = errors
+        super().__init__("Invalid SQL: " + "; ".join(errors))
+
+
+class SQLValidator:
+    """
+    Static checks for generated SQL against the live schema, before it reaches the database.
+
+    The query is parsed with sqlglot (MySQL dialect) and walked scope by scope:
+    it must be a single read-only SELECT; every table must exist; every
+    qualified column must use an alias defined in its FROM/JOIN clauses (or an
+    enclosing query's, for correlated subqueries) and exist in that table; every
+    unqualified column must exist in exactly one of the query's tables; GROUP BY
+    expressions must be in the select list and selected columns must be grouped
+    or aggregated. Errors name the fix (the defined aliases, the closest column,
+    the table that does have it), so they can go straight back to the SQL LLM
+    (see regenerate).
+    """
+
+    def __init__(self, schema_service, max_retries=None):
+        """
+        Initialize the validator
+
+        Args:
+            schema_service: SchemaService describing the database the queries run against
+            max_retries: Regenerations allowed per query in regenerate (default: $SQL_VALIDATOR_MAX_RETRIES or 1)
+        """
+        self.schema_service = schema_service
+        self.max_retries = max_retries if max_retries is not None \
+            else int(environ.get("SQL_VALIDATOR_MAX_RETRIES", "1"))
+
+        self.checked = 0
+        self.invalid = 0
+        self.retries = 0
+        self.failed = 0
+
+        self._schema_hash = None
+        self._columns = {}
+        # Query -> errors for the current schema; parsing is most of the cost, and cached SQL repeats
+        self._results = {}
+
+    @property
+    def columns(self) -> dict:
+        """Lowercased table name -> set of lowercased column names, rebuilt when the schema changes."""
+        if self._schema_hash != self.schema_service.schema_hash:
+            self._columns = {table.lower(): {column[0].lower() for column in entry["columns"]}
+                             for table, entry in self.schema_service.tables.items()}
+            self._schema_hash = self.schema_service.schema_hash
+            self._results = {}
+        return self._columns
+
+    def validate(self, sql_query) -> list:
+        """
+        Check a query
+
+        Args:
+            sql_query: The generated SQL
+
+        Returns:
+            List of error messages, empty when the query passes
+        """
+        self.checked += 1
+        # Reading columns first drops remembered results when the schema changed
+        self.columns
+        errors = self._results.get(sql_query)
+        if errors is None:
+            errors = self._validate(sql_query)
+            if len(self._results) >= RESULT_LIMIT:
+                self._results.pop(next(iter(self._results)))
+            self._results[sql_query] = errors
+        if errors:
+            self.invalid += 1
+        return errors
+
+    def _validate(self, sql_query) -> list:
+        try:
+            statements = [statement for statement in sqlglot.parse(sql_query, read="mysql") if statement is not None]
+        except SqlglotError as e:
+            return [f"Syntax error: {str(e).splitlines()[0]}"]
+        if len(statements) != 1:
+            return [f"Expected exactly one SQL statement, got {len(statements)}."]
+        tree = statements[0]
+        if not isinstance(tree, (exp.Select, exp.SetOperation, exp.Subquery)) or any(tree.find_all(*_WRITES)):
+            return ["Only read-only SELECT queries are allowed."]
+
+        errors = []
+        try:
+            scopes = traverse_scope(tree)
+        except SqlglotError as e:
+            return [f"Invalid query structure: {e}"]
+        for scope in scopes:
+            found = len(errors)
+            self._check_tables(scope, errors)
+            self._check_columns(scope, errors)
+            # Grouping can only be judged once the columns resolve
+            if len(errors) == found and isinstance(scope.expression, exp.Select) and scope.expression.args.get("group"):
+                self._check_group_by(scope.expression, errors)
+        # Repeated references produce the same message; keep each once
+        return list(dict.fromkeys(errors))
+
+    def _check_tables(self, scope, errors):
+        for alias, source in scope.sources.items():
+            if isinstance(source, exp.Table) and source.name.lower() not in self.columns:
+                errors.append(f"Unknown table `{source.name}`{self._suggest(source.name, self.columns)}.")
+
+    @staticmethod
+    def _aliases(select) -> set:
+        """Names given with AS in a select list, which ORDER BY, GROUP BY and HAVING may use."""
+        if not isinstance(select, exp.Select):
+            return set()
+        return {expression.alias.lower() for expression in select.expressions if isinstance(expression, exp.Alias)}
+
+    def _check_columns(self, scope, errors):
+        aliases = self._aliases(scope.expression)
+        for column in scope.columns:
+            # The root scope also lists columns of uncorrelated subqueries; their own scope checks those
+            select = column.find_ancestor(exp.Select)
+            if select is not None and select is not scope.expression:
+                continue
+            name = column.name.lower()
+            if column.table:
+                source = self._source(scope, column.table)
+                if source is None:
+                    errors.append(f"`{column.sql(dialect='mysql')}` uses the alias `{column.table}`, which isn't "
+                                  f"defined in its FROM/JOIN clauses ({self._defined_aliases(scope)}).")
+                elif not isinstance(column.this, exp.Star) and not self._has_column(source, name):
+                    errors.append(f"Unknown column `{column.sql(dialect='mysql')}`: "
+                                  f"{self._source_name(source)} has no column `{column.name}`"
+                                  f"{self._suggest(name, self._source_columns(source))}{self._elsewhere(name)}.")
+                continue
+
+            if isinstance(column.this, exp.Star):
+                continue
+            if name in aliases:
+                continue
+            # Correlated subqueries can see the tables of the queries around them; the innermost match wins
+            owners, known = [], set()
+            for outer in self._scopes_outward(scope):
+                sources = {alias: source for alias, (_, source) in outer.selected_sources.items()}
+                owners = [alias for alias, source in sources.items() if self._has_column(source, name)]
+                if owners:
+                    break
+                known.update(*(self._source_columns(source) for source in sources.values()))
+            if not owners:
+                errors.append(f"Unknown column `{column.name}` in the tables of this query "
+                              f"({self._defined_aliases(scope)}){self._suggest(name, known)}{self._elsewhere(name)}.")
+            elif len(owners) > 1 and all(self._checkable(sources[alias]) for alias in owners):
+                errors.append(f"Ambiguous column `{column.name}`: it is in {', '.join(sorted(owners))}; "
+                              f"qualify it with the table alias.")
+
+    def _check_group_by(self, select, errors):
+        group = select.args["group"].expressions
+        selects = [expression.unalias() for expression in select.expressions]
+        # Select-list position of each AS alias, so GROUP BY month can resolve to DATE_FORMAT(...) AS month
+        alias_positions = {expression.alias.lower(): index for index, expression in enumerate(select.expressions)
+                           if isinstance(expression, exp.Alias)}
+
+        def same(a, b):
+            if isinstance(a, exp.Column) and isinstance(b, exp.Column):
+                return a.name.lower() == b.name.lower() and (not a.table or not b.table or a.table == b.table)
+            return a == b
+
+        def position(expression):
+            """The select-list position a GROUP BY item refers to by ordinal or alias, else None."""
+            if isinstance(expression, exp.Literal) and not expression.is_string:
+                return int(expression.name) - 1 if expression.name.isdigit() \
+                    and 0 < int(expression.name) <= len(selects) else None
+            if isinstance(expression, exp.Column) and not expression.table:
+                return alias_positions.get(expression.name.lower())
+            return None
+
+        grouped_positions = set()
+        for expression in group:
+            if position(expression) is not None:
+                grouped_positions.add(position(expression))
+                continue
+            if isinstance(expression, exp.Literal) and not expression.is_string:
+                continue
+            if not any(same(expression, selected) for selected in selects):
+                errors.append(f"GROUP BY `{expression.sql(dialect='mysql')}` is not in the select list; "
+                              f"add it to the SELECT.")
+
+        grouped = [selects[position(e)] if position(e) is not None else e for e in group]
+        for index, selected in enumerate(selects):
+            if isinstance(selected, exp.Star) or index in grouped_positions or any(same(selected, g) for g in grouped):
+                continue
+            for column in selected.find_all(exp.Column):
+                # Columns in aggregates, window functions and subqueries don't need grouping
+                if column.find_ancestor(exp.AggFunc, exp.Window, exp.Select) is not select \
+                        or isinstance(column.this, exp.Star):
+                    continue
+                if not any(same(column, g) or any(same(column, c) for c in g.find_all(exp.Column))
+                           for g in grouped):
+                    errors.append(f"`{column.sql(dialect='mysql')}` is selected but neither in the GROUP BY nor "
+                                  f"aggregated; group by it or wrap it in an aggregate such as MAX().")
+
+    @staticmethod
+    def _scopes_outward(scope):
+        while scope is not None:
+            yield scope
+            scope = scope.parent
+
+    def _source(self, scope, alias):
+        for outer in self._scopes_outward(scope):
+            if alias in outer.sources:
+                return outer.sources[alias]
+        return None
+
+    def _checkable(self, source) -> bool:
+        if isinstance(source, Scope):
+            return not source.expression.is_star
+        return source.name.lower() in self.columns
+
+    def _source_columns(self, source) -> set:
+        if isinstance(source, Scope):
+            return {name.lower() for name in source.expression.named_selects}
+        return self.columns.get(source.name.lower(), set())
+
+    def _has_column(self, source, name) -> bool:
+        if isinstance(source, Scope):
+            # Derived tables selecting * can't be checked without expanding them
+            return source.expression.is_star or name in self._source_columns(source)
+        # Unknown tables are reported once by _check_tables
+        return source.name.lower() not in self.columns or name in self._source_columns(source)
+
+    @staticmethod
+    def _source_name(source) -> str:
+        return "the derived table" if isinstance(source, Scope) else f"table `{source.name}`"
+
+    @staticmethod
+    def _defined_aliases(scope) -> str:
+        defined = [f"`{alias}`" + (f" for {source.name}" if isinstance(source, exp.Table) and alias != source.name
+                                   else "") for alias, source in scope.sources.items()]
+        return "defined: " + ", ".join(defined) if defined else "no tables are defined"
+
+    @staticmethod
+    def _suggest(name, candidates) -> str:
+        match = get_close_matches(name.lower(), sorted(candidates), n=1, cutoff=0.6)
+        return f" (did you mean `{match[0]}`?)" if match else ""
+
+    def _elsewhere(self, name) -> str:
+        tables = sorted(table for table, columns in self.columns.items() if name in columns)
+        return f"; `{name}` is a column of {', '.join(tables)}" if tables else ""
+
+    def feedback(self, sql_query, errors) -> str:
+        """Instructions for fixing a query, to send back to the SQL LLM."""
+        problems = "\n".join(f"- {error}" for error in errors)
+        return (f"The query\n{sql_query}\nfailed validation against the schema before running:\n{problems}\n"
+                f"Rewrite it to answer the same question, fixing these problems and using only the tables and "
+                f"columns in the schema.")
+
+    def regenerate(self, sql_query, retry) -> str:
+        """
+        Validate a generated query, asking for corrected ones until it passes or max_retries runs out
+
+        Args:
+            sql_query: The generated SQL
+            retry: Function from feedback text (see feedback) to a regenerated query; one LLM call
+
+        Returns:
+            The first query that passes
+
+        Raises:
+            SQLValidationError: The last query still fails validation
+        """
+        errors = self.validate(sql_query)
+        attempts = 0
+        while errors and attempts < self.max_retries:
+            attempts += 1
+            self.retries += 1
+            sql_query = retry(self.feedback(sql_query, errors))
+            errors = self.validate(sql_query)
+        if errors:
+            self.failed += 1
+            raise SQLValidationError(sql_query, errors)
+        return sql_query
+
+    def summary(self) -> str:
+        """One-line summary for the timing output."""
+        return (f"SQL validator: {self.checked} checked / {self.invalid} invalid / {self.retries} regenerated / "
+                f"{self.failed} failed")
@@ -0,0 +1,199 @@
+from hashlib import sha256
+from os import environ, makedirs, path, replace
+from random import random, shuffle
+from threading import Lock, Thread
+from time import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from SchemaService import get_schema_service
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+# Columns whose values a sample should cover; those missing from the table are skipped
+DEFAULT_STRATA = ["team_name", "is_automated_step", "effective_parent_workflow_status"]
+DEFAULT_TIME_COLUMN = "workflow_step_date"
+
+_NUMERIC_TYPES = ("int", "bigint", "smallint", "mediumint", "tinyint", "integer", "decimal", "numeric", "float",
+                  "double", "real")
+
+
+class SampleProvider:
+    """
+    Small representative sample of a table for prompts, cached on disk.
+
+    Candidate rows are drawn with index-range probes: random points between
+    the MIN and MAX of an indexed numeric column, each fetched with one
+    index seek, so no query sorts or scans the table (tables without such an
+    index fall back to a single reservoir-sampled scan). From the candidates,
+    rows are picked greedily so the sample covers as many values of the strata
+    columns (team, automated/manual, status, time bucket) as it can. The sample
+    is stored as Parquet under $AURORA_CACHE_DIR, keyed by the schema hash; a
+    stale copy is still served while a background thread replaces it, so only
+    the very first build waits on the database.
+    """
+
+    def __init__(self, mysql_engine, table="workflow_steps", rows=None, strata=None, time_column=None,
+                 candidates=None, refresh_seconds=None, schema_service=None, cache_dir=None):
+        """
+        Initialize the sample provider
+
+        Args:
+            mysql_engine: SQLAlchemy engine holding the table
+            table: Table to sample
+            rows: Rows in the sample (default: $SAMPLE_ROWS or 10)
+            strata: Columns whose values the sample should cover. Defaults to DEFAULT_STRATA
+            time_column: Date column bucketed by quarter as one more stratum. Defaults to DEFAULT_TIME_COLUMN
+            candidates: Rows probed to choose from (default: $SAMPLE_CANDIDATES or 20 per sample row)
+            refresh_seconds: Age after which the cached sample is replaced (default: $SAMPLE_REFRESH_SECONDS or 86400)
+            schema_service: Optional SchemaService. Defaults to the shared one for mysql_engine
+            cache_dir: Optional directory for the sample cache. Defaults to $AURORA_CACHE_DIR
+        """
+        self.mysql_engine = mysql_engine
+        self.table = table
+        self.rows = rows if rows is not None else int(environ.get("SAMPLE_ROWS", "10"))
+        self.candidates = candidates if candidates is not None \
+            else int(environ.get("SAMPLE_CANDIDATES", str(20 * self.rows)))
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None \
+            else float(environ.get("SAMPLE_REFRESH_SECONDS", "86400"))
+        self.schema_service = schema_service if schema_service is not None else get_schema_service(mysql_engine)
+
+        columns = [column[0] for column in self.schema_service.tables.get(table, {}).get("columns", [])]
+        self.strata = [column for column in (strata if strata is not None else DEFAULT_STRATA) if column in columns]
+        time_column = time_column if time_column is not None else DEFAULT_TIME_COLUMN
+        self.time_column = time_column if time_column in columns else None
+
+        cache_dir = cache_dir if cache_dir is not None else CACHE_DIR
+        makedirs(cache_dir, exist_ok=True)
+        database_key = sha256(mysql_engine.url.render_as_string(hide_password=True).encode("utf-8")).hexdigest()
+        self.cache_path = path.join(
+            cache_dir, f"sample_{database_key[:16]}_{table}_{str(self.schema_service.schema_hash)[:16]}.parquet")
+
+        self.builds = 0
+        self.method = None
+        self._lock = Lock()
+        self._refreshing = False
+        self._sample = None
+
+    def sample(self) -> pd.DataFrame:
+        """
+        The current sample
+
+        Returns:
+            DataFrame of up to rows rows. Built on first use if nothing is cached; a stale
+            cached sample is returned as is and refreshed in the background
+        """
+        if self._sample is None and path.exists(self.cache_path):
+            try:
+                self._sample = pd.read_parquet(self.cache_path)
+            except Exception:
+                self._sample = None
+        if self._sample is None:
+            self.refresh()
+        elif time() - path.getmtime(self.cache_path) > self.refresh_seconds and not self._refreshing:
+            self._refreshing = True
+            Thread(target=self._refresh_in_background, name="SampleProvider", daemon=True).start()
+        return self._sample
+
+    def markdown(self) -> str:
+        """The sample rendered for a prompt."""
+        return self.sample().to_markdown()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            # Keep serving the cached sample; the next call retries
+            pass
+        finally:
+            self._refreshing = False
+
+    def refresh(self) -> pd.DataFrame:
+        """Draw a new sample and replace the cached one."""
+        with self._lock:
+            key = self._index_column()
+            candidates = self._probe(key) if key is not None else self._reservoir()
+            self.method = "index-range" if key is not None else "reservoir"
+            sample = self._stratify(candidates).reset_index(drop=True)
+
+            temp_path = f"{self.cache_path}.tmp"
+            sample.to_parquet(temp_path, index=False)
+            replace(temp_path, self.cache_path)
+            self._sample = sample
+            self.builds += 1
+            return sample
+
+    def _index_column(self):
+        """An indexed numeric column to probe, preferring unique indexes (the primary key)."""
+        entry = self.schema_service.tables.get(self.table, {})
+        types = {column[0]: str(column[1]).lower() for column in entry.get("columns", [])}
+        indexes = sorted(entry.get("indexes", {}).items(),
+                         key=lambda item: (item[0] != "PRIMARY", not item[1]["unique"]))
+        for _, index in indexes:
+            column = index["columns"][0]
+            if types.get(column, "").split("(")[0].split()[0] in _NUMERIC_TYPES:
+                return column
+        return None
+
+    def _probe(self, key) -> pd.DataFrame:
+        quote = self.mysql_engine.dialect.identifier_preparer.quote
+        table, column = quote(self.table), quote(key)
+        rows, columns = [], []
+        with self.mysql_engine.connect() as conn:
+            low, high = conn.execute(text(f"SELECT MIN({column}), MAX({column}) FROM {table}")).one()
+            if low is None:
+                return pd.DataFrame()
+            probe = text(f"SELECT * FROM {table} WHERE {column} >= :start ORDER BY {column} LIMIT 1")
+            for _ in range(self.candidates):
+                result = conn.execute(probe, {"start": low + (high - low) * random()})
+                columns = list(result.keys())
+                row = result.fetchone()
+                if row is not None:
+                    rows.append(row)
+        # Gaps in the key make the row after a gap likelier; dropping repeats keeps it from dominating
+        return pd.DataFrame(rows, columns=columns).drop_duplicates(subset=[key])
+
+    def _reservoir(self) -> pd.DataFrame:
+        reservoir, seen, columns = [], 0, []
+        with self.mysql_engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(
+                text(f"SELECT * FROM {self.mysql_engine.dialect.identifier_preparer.quote(self.table)}"))
+            columns = list(result.keys())
+            for row in result:
+                seen += 1
+                if len(reservoir) < self.candidates:
+                    reservoir.append(row)
+                else:
+                    slot = int(random() * seen)
+                    if slot < self.candidates:
+                        reservoir[slot] = row
+        return pd.DataFrame(reservoir, columns=columns)
+
+    def _stratify(self, candidates) -> pd.DataFrame:
+        if len(candidates) <= self.rows:
+            return candidates
+        keys = candidates[self.strata].astype(str)
+        if self.time_column is not None:
+            keys = keys.assign(**{self.time_column: pd.to_datetime(
+                candidates[self.time_column], errors="coerce").dt.to_period("Q").astype(str)})
+        values = [set(zip(keys.columns, row)) for row in keys.itertuples(index=False)]
+
+        # Greedy cover: each pick adds the most stratum values not yet in the sample, ties broken at random
+        order = list(range(len(candidates)))
+        shuffle(order)
+        chosen, covered = [], set()
+        for _ in range(self.rows):
+            best = max(order, key=lambda i: len(values[i] - covered))
+            chosen.append(best)
+            covered |= values[best]
+            order.remove(best)
+        return candidates.iloc[sorted(chosen)]
+
+    def summary(self) -> str:
+        """One-line summary for the timing output."""
+        sample = self._sample if self._sample is not None else pd.DataFrame()
+        covered = ", ".join(f"{sample[column].nunique()} {column}" for column in self.strata if column in sample)
+        return (f"Sample: {len(sample)} rows of {self.table} ({self.method or 'cached'}; {covered}) / "
+                f"{self.builds} builds")
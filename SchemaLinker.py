@@ -0,0 +1,294 @@
+from collections import deque
+from os import environ
+from time import perf_counter
+from zlib import crc32
+import re
+
+import numpy as np
+
+
+# Join paths between the workflow tables
+RELATIONS = [
+    ("workflow_steps", "workflows", "workflow_id"),
+    ("workflows", "orders", "order_id"),
+    ("orders", "products", "product_id"),
+]
+
+# Status value lists, sent only when their column is kept
+ENUM_BLOCKS = {
+    ("workflows", "workflow_status"): """### Table workflows have field workflow_status:
+- INPROGRESS: In Progress
+- COMPLETE: Completed
+- PCNCL: Pending Cancel
+- CNCL: Cancelled""",
+    ("orders", "order_status"): """### Table orders have field order_status:
+- PENDING: Pending
+- INCMPLT: Incomplete
+- CNCL: Cancelled
+- PCNCL: Pending Cancel
+- CLSD: Completed/Closed""",
+}
+
+# Words a question might use for a table or column besides its name
+TABLE_DESCRIPTIONS = {
+    "workflow_steps": "steps tasks",
+    "workflows": "workflows processes",
+    "orders": "orders customers",
+    "products": "products services catalog",
+}
+COLUMN_DESCRIPTIONS = {
+    ("workflow_steps", "team_member"): "employee person people who staff",
+    ("workflow_steps", "is_automated_step"): "automated automation manual",
+    ("workflow_steps", "workflow_step_elapsed_duration_hours"): "elapsed duration hours how long took complete",
+    ("workflow_steps", "workflow_step_estimated_duration_days"): "estimated estimate expected planned",
+    ("workflow_steps", "workflow_step_due_date"): "due deadline late overdue",
+    ("workflow_steps", "workflow_step_name"): "step task name type",
+    ("workflows", "workflow_elapsed_duration_hours"): "elapsed duration hours how long took complete lead time "
+                                                      "put into service",
+    ("workflows", "workflow_status"): "status complete completed cancelled cancel in progress",
+    ("orders", "days_past_due"): "sla slas late overdue missed past due",
+    ("orders", "order_status"): "status pending incomplete cancelled closed",
+    ("orders", "region_name"): "region country geography",
+    ("orders", "customer_name"): "customer client",
+    ("orders", "team_manager_name"): "manager",
+    ("products", "is_active"): "active inactive",
+    ("products", "service_name"): "service short code",
+}
+
+TEMPORAL_WORDS = {"trend", "trending", "time", "month", "monthly", "week", "weekly", "day", "daily", "year", "yearly",
+                  "quarter", "date", "when", "recent", "last", "since", "season", "seasonal", "period", "over"}
+STOPWORDS = {"the", "a", "an", "of", "by", "is", "are", "was", "and", "or", "to", "in", "on", "for", "with", "how",
+             "what", "which", "who", "many", "much", "me", "my", "do", "does", "did", "show", "list", "give", "per",
+             "each", "all", "our", "their", "there", "this", "that", "from", "vs", "versus", "it", "be", "been", "has",
+             "have", "get", "most", "least", "top", "can", "i", "we", "you", "any", "broken", "down", "doing"}
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+_SUFFIXES = ("ations", "ation", "ating", "ated", "ates", "ings", "ing", "ures", "ure", "ions", "ion", "edly", "ed", "ly")
+
+
+def stem(word) -> str:
+    """Crude suffix stripping so word forms meet: automated/automation, completed/complete, cancelled/cancel."""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            word = word[:-len(suffix)]
+            break
+    else:
+        if word.endswith("es") and word[:-2].endswith(("ss", "x", "ch", "sh")):
+            word = word[:-2]
+        elif word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+            word = word[:-1]
+    if len(word) > 4 and word.endswith("e"):
+        word = word[:-1]
+    if len(word) > 4 and word[-1] == word[-2] and word[-1] not in "aeiou":
+        word = word[:-1]
+    return word
+
+
+def _tokens(text) -> list:
+    """Stemmed lowercase words, minus stopwords."""
+    return [stem(word) for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+def ngram_vectors(words, dim=2048) -> np.ndarray:
+    """Unit-length hashed character-trigram vectors, so related word forms (automated/automation) are close."""
+    vectors = np.zeros((len(words), dim), dtype=np.float32)
+    for row, word in enumerate(words):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            vectors[row, crc32(padded[i:i + 3].encode("utf-8")) % dim] += 1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class SchemaLinker:
+    """
+    Per-question schema pruning for SQL prompts.
+
+    Each column is indexed by the stemmed words of its name and description, and
+    each word by its character-trigram vector. A question's words are matched
+    against that vocabulary (same stem, or near enough to forgive a typo),
+    weighted by how few columns share the word; a column whose name words all
+    appear in the question matches outright. The best-scoring tables are kept, joined up
+    along RELATIONS, with only their matched columns, join keys, date columns
+    for time questions, and the status lists of kept columns. Linking is pure
+    in-process numpy, a few milliseconds; when nothing scores confidently the
+    full schema is used instead.
+    """
+
+    def __init__(self, schema_service, tables=None, relations=RELATIONS, enum_blocks=ENUM_BLOCKS,
+                 table_descriptions=TABLE_DESCRIPTIONS, column_descriptions=COLUMN_DESCRIPTIONS,
+                 min_confidence=None, column_threshold=None, match_threshold=0.8):
+        """
+        Initialize the schema linker and build its index
+
+        Args:
+            schema_service: SchemaService providing the tables and rendering them
+            tables: Tables that may be linked, in prompt order. Defaults to every table in the relations
+            relations: (table, table, join column) tuples
+            enum_blocks: Dictionary of (table, column) to the status value list sent with that column
+            table_descriptions: Dictionary of table to extra words for it
+            column_descriptions: Dictionary of (table, column) to extra words for it
+            min_confidence: Best table score below which the full schema is used
+                            (default: $SCHEMA_LINK_MIN_CONFIDENCE or 0.5)
+            column_threshold: Score at or above which a column of a kept table is kept
+                              (default: $SCHEMA_LINK_COLUMN_THRESHOLD or 0.3)
+            match_threshold: Trigram cosine similarity at which a question word matches a schema word
+                             it doesn't share a stem with
+        """
+        self.schema_service = schema_service
+        related = [table for relation in relations for table in relation[:2]]
+        self.tables = [table for table in (tables or list(dict.fromkeys(related))) if table in schema_service.tables]
+        self.relations = [relation for relation in relations
+                          if relation[0] in self.tables and relation[1] in self.tables]
+        self.enum_blocks = enum_blocks
+        self.min_confidence = min_confidence if min_confidence is not None \
+            else float(environ.get("SCHEMA_LINK_MIN_CONFIDENCE", "0.5"))
+        self.column_threshold = column_threshold if column_threshold is not None \
+            else float(environ.get("SCHEMA_LINK_COLUMN_THRESHOLD", "0.3"))
+        self.match_threshold = match_threshold
+
+        # (table, column) -> words, and (table, None) -> words for the table itself
+        self._words = {}
+        self._name_words = {}
+        self._datetime_columns = {}
+        for table in self.tables:
+            self._words[(table, None)] = set(_tokens(f"{table.replace('_', ' ')} {table_descriptions.get(table, '')}"))
+            for column, column_type, _, _ in schema_service.tables[table]["columns"]:
+                description = column_descriptions.get((table, column), "")
+                self._name_words[(table, column)] = set(_tokens(column.replace("_", " ")))
+                self._words[(table, column)] = self._name_words[(table, column)] | set(_tokens(description))
+                if "date" in column_type or "time" in column_type:
+                    self._datetime_columns.setdefault(table, []).append(column)
+
+        # Rarer words say more: a word shared by n columns (or tables) counts 1/n
+        column_counts, table_counts = {}, {}
+        for (table, column), words in self._words.items():
+            counts = table_counts if column is None else column_counts
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+        self._column_weight = {word: 1.0 / count for word, count in column_counts.items()}
+        self._table_weight = {word: 1.0 / count for word, count in table_counts.items()}
+
+        self._vocabulary = sorted(set(column_counts) | set(table_counts))
+        self._vocabulary_vectors = ngram_vectors(self._vocabulary)
+
+    def link(self, question) -> dict:
+        """
+        Select the schema relevant to a question
+
+        Args:
+            question: The natural language question
+
+        Returns:
+            Dictionary with the kept tables (prompt order), columns per table, enum block keys,
+            relations, confidence (best table score), full (True when falling back to the whole
+            schema), seconds, and text: the schema block for the prompt
+        """
+        start = perf_counter()
+        matches = self._match_words(question)
+
+        scores = {}
+        for key, words in self._words.items():
+            weights = self._table_weight if key[1] is None else self._column_weight
+            scores[key] = min(1.0, sum(matches[word] * weights[word] for word in words if word in matches))
+            if key[1] is not None and self._name_words[key] and self._name_words[key] <= matches.keys():
+                scores[key] = 1.0
+        table_scores = {table: max(score for (name, _), score in scores.items() if name == table)
+                        for table in self.tables}
+        confidence = max(table_scores.values(), default=0.0)
+
+        linked_tables = [table for table in self.tables if table_scores[table] >= self.min_confidence]
+        if not linked_tables:
+            return self._result(self._full(), confidence, True, start)
+        kept, relations = self._connect(linked_tables)
+
+        temporal = any(word in TEMPORAL_WORDS for word in _WORD.findall(question.lower()))
+        columns = {}
+        for table in kept:
+            matched = [column for (name, column), score in scores.items()
+                       if name == table and column is not None and score >= self.column_threshold]
+            keys = [relation[2] for relation in relations if table in relation[:2]]
+            if not matched and table in linked_tables:
+                # Kept for its name alone; nothing says which columns matter
+                columns[table] = None
+                continue
+            dates = self._datetime_columns.get(table, []) if temporal else []
+            columns[table] = [column for column, _, _, _ in self.schema_service.tables[table]["columns"]
+                              if column in matched or column in keys or column in dates]
+        enums = [key for key in self.enum_blocks
+                 if key[0] in kept and (columns[key[0]] is None or key[1] in columns[key[0]])]
+        return self._result({"tables": kept, "columns": columns, "enums": enums, "relations": relations},
+                            confidence, False, start)
+
+    def _match_words(self, question) -> dict:
+        """Schema word -> best similarity of any question word to it, for similarities over match_threshold."""
+        words = list(dict.fromkeys(_tokens(question)))
+        if not words:
+            return {}
+        similarities = ngram_vectors(words) @ self._vocabulary_vectors.T
+        best = similarities.max(axis=0)
+        return {self._vocabulary[i]: float(best[i]) for i in np.flatnonzero(best >= self.match_threshold)}
+
+    def _connect(self, kept) -> tuple:
+        """Add the tables on the join paths between kept tables, and return (tables, relations used)."""
+        neighbours = {}
+        for left, right, column in self.relations:
+            neighbours.setdefault(left, []).append((right, (left, right, column)))
+            neighbours.setdefault(right, []).append((left, (left, right, column)))
+
+        tables, relations = {kept[0]}, []
+        for target in kept[1:]:
+            # Breadth-first from everything joined so far to the next kept table
+            parents = {table: None for table in tables}
+            queue = deque(tables)
+            while queue and target not in parents:
+                table = queue.popleft()
+                for neighbour, relation in neighbours.get(table, []):
+                    if neighbour not in parents:
+                        parents[neighbour] = (table, relation)
+                        queue.append(neighbour)
+            node = target
+            while node in parents and parents[node] is not None:
+                previous, relation = parents[node]
+                tables.add(node)
+                if relation not in relations:
+                    relations.append(relation)
+                node = previous
+            tables.add(target)
+        return [table for table in self.tables if table in tables], relations
+
+    def _full(self) -> dict:
+        return {"tables": list(self.tables), "columns": {table: None for table in self.tables},
+                "enums": list(self.enum_blocks), "relations": list(self.relations)}
+
+    def _result(self, linked, confidence, full, start) -> dict:
+        linked.update(confidence=confidence, full=full, text=self.render(linked), seconds=perf_counter() - start)
+        return linked
+
+    def render(self, linked) -> str:
+        """The schema block for a prompt: CREATE TABLE statements, then status values and table relations."""
+        parts = [self.schema_service.render(linked["tables"], linked["columns"])]
+        if linked["enums"]:
+            parts.append("## Status field values are as follows:\n"
+                         + "\n\n".join(self.enum_blocks[key] for key in linked["enums"]))
+        if linked["relations"]:
+            parts.append("## Table relations:\n" + "\n".join(
+                f"- `{left}` and `{right}` are related by `{column}`" for left, right, column in linked["relations"]))
+        return "\n\n".join(parts)
+
+    def full_schema(self) -> str:
+        """The unpruned schema block, e.g. for hashing the prompt into the SQL cache key."""
+        return self.render(self._full())
+
+    def summary(self, linked) -> str:
+        """One-line description of a link result for the timing output."""
+        if linked["full"]:
+            return f"Schema linking: full schema (confidence {linked['confidence']:.2f}, {linked['seconds'] * 1000:.1f}ms)"
+        kept_columns = sum(len(columns) if columns is not None else len(self.schema_service.tables[table]["columns"])
+                           for table, columns in linked["columns"].items())
+        total_columns = sum(len(self.schema_service.tables[table]["columns"]) for table in self.tables)
+        return (f"Schema linking: {len(linked['tables'])}/{len(self.tables)} tables, "
+                f"{kept_columns}/{total_columns} columns ({linked['seconds'] * 1000:.1f}ms)")
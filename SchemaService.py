@@ -0,0 +1,185 @@
+from hashlib import sha256
+from os import environ, makedirs, path, replace
+from threading import Lock
+import json
+
+from sqlalchemy import inspect, text
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+# One server-side aggregate over the catalog, so change detection is a single small round trip
+_MYSQL_FINGERPRINT = """
+SELECT MD5(CONCAT(
+    (SELECT COALESCE(GROUP_CONCAT(CONCAT_WS(':', table_name, column_name, column_type, is_nullable,
+                                           COALESCE(column_default, 'NULL'))
+                                  ORDER BY table_name, ordinal_position SEPARATOR ','), '')
+     FROM information_schema.columns WHERE table_schema = DATABASE()),
+    '|',
+    (SELECT COALESCE(GROUP_CONCAT(CONCAT_WS(':', table_name, index_name, non_unique, column_name)
+                                  ORDER BY table_name, index_name, seq_in_index SEPARATOR ','), '')
+     FROM information_schema.statistics WHERE table_schema = DATABASE())
+))
+"""
+
+_MYSQL_COLUMNS = """
+SELECT table_name, column_name, column_type, is_nullable, column_default
+FROM information_schema.columns WHERE table_schema = DATABASE()
+ORDER BY table_name, ordinal_position
+"""
+
+_MYSQL_INDEXES = """
+SELECT table_name, index_name, non_unique, column_name
+FROM information_schema.statistics WHERE table_schema = DATABASE()
+ORDER BY table_name, index_name, seq_in_index
+"""
+
+
+class SchemaService:
+    """
+    Live database schema for prompts, introspected once and cached on disk.
+
+    The compact schema (columns with types, nullability and defaults, plus
+    indexes, per table) is stored as JSON under $AURORA_CACHE_DIR, together with
+    a hash of the catalog. On startup only that hash is recomputed (a single
+    aggregate query against information_schema); the full introspection runs
+    again only when it differs. Prompts render their CREATE TABLE text from here,
+    so every entry point describes the same, current tables.
+    """
+
+    def __init__(self, mysql_engine, cache_dir=None):
+        """
+        Initialize the schema service and load the schema
+
+        Args:
+            mysql_engine: SQLAlchemy engine for the database to describe
+            cache_dir: Optional directory for the schema cache. Defaults to $AURORA_CACHE_DIR
+        """
+        self.mysql_engine = mysql_engine
+        self.cache_dir = cache_dir if cache_dir is not None else CACHE_DIR
+        makedirs(self.cache_dir, exist_ok=True)
+        database_key = sha256(mysql_engine.url.render_as_string(hide_password=True).encode("utf-8")).hexdigest()
+        self.cache_path = path.join(self.cache_dir, f"schema_{database_key[:16]}.json")
+
+        self.schema_hash = None
+        self.tables = {}
+        # True when the schema differs from the last cached copy (or there was none), so
+        # callers know to clear caches that depend on it (see invalidate)
+        self.changed = False
+        self._lock = Lock()
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """
+        Re-check the catalog hash and re-introspect if it changed
+
+        Returns:
+            True if the schema changed since the cached copy
+        """
+        with self._lock:
+            cached = None
+            if path.exists(self.cache_path):
+                with open(self.cache_path) as cache_file:
+                    cached = json.load(cache_file)
+
+            if self.mysql_engine.dialect.name == "mysql":
+                with self.mysql_engine.connect() as conn:
+                    schema_hash = conn.execute(text(_MYSQL_FINGERPRINT)).scalar()
+                if cached is not None and cached["schema_hash"] == schema_hash:
+                    tables = cached["tables"]
+                else:
+                    tables = self._introspect_mysql()
+            else:
+                # Other databases (the benchmark fixture) have no cheap catalog hash; introspect and hash that
+                tables = self._introspect_generic()
+                schema_hash = sha256(json.dumps(tables, sort_keys=True).encode("utf-8")).hexdigest()
+
+            self.changed = cached is None or cached["schema_hash"] != schema_hash
+            self.schema_hash = schema_hash
+            self.tables = tables
+            if self.changed:
+                temp_path = f"{self.cache_path}.tmp"
+                with open(temp_path, "w") as cache_file:
+                    json.dump({"schema_hash": schema_hash, "tables": tables}, cache_file)
+                replace(temp_path, self.cache_path)
+            return self.changed
+
+    def _introspect_mysql(self) -> dict:
+        tables = {}
+        with self.mysql_engine.connect() as conn:
+            for table, column, column_type, nullable, default in conn.execute(text(_MYSQL_COLUMNS)):
+                tables.setdefault(table, {"columns": [], "indexes": {}})["columns"].append(
+                    [column, column_type, nullable == "YES", default])
+            for table, index, non_unique, column in conn.execute(text(_MYSQL_INDEXES)):
+                if table in tables:
+                    entry = tables[table]["indexes"].setdefault(index, {"unique": not non_unique, "columns": []})
+                    entry["columns"].append(column)
+        return tables
+
+    def _introspect_generic(self) -> dict:
+        inspector = inspect(self.mysql_engine)
+        tables = {}
+        for table in inspector.get_table_names():
+            columns = [[column["name"], str(column["type"]).lower(), bool(column["nullable"]), column["default"]]
+                       for column in inspector.get_columns(table)]
+            indexes = {index["name"]: {"unique": bool(index["unique"]), "columns": index["column_names"]}
+                       for index in inspector.get_indexes(table)}
+            tables[table] = {"columns": columns, "indexes": indexes}
+        return tables
+
+    def invalidate(self, *caches):
+        """Clear each cache (anything with a clear() method, e.g. ResultCache) if the schema changed."""
+        if self.changed:
+            for cache in caches:
+                cache.clear()
+
+    def render(self, tables=None, columns=None) -> str:
+        """
+        Render tables as MariaDB CREATE TABLE statements for a prompt
+
+        Args:
+            tables: Table names to include, in order. Defaults to every table
+            columns: Optional dictionary of table name to the columns to keep (see SchemaLinker);
+                     tables not in it keep every column
+
+        Returns:
+            The CREATE TABLE statements, separated by blank lines. Unknown tables are skipped
+        """
+        names = tables if tables is not None else sorted(self.tables)
+        columns = columns or {}
+        return "\n\n".join(self._render_table(name, self.tables[name], columns.get(name))
+                           for name in names if name in self.tables)
+
+    @staticmethod
+    def _render_table(name, table, keep=None) -> str:
+        lines = []
+        for column, column_type, nullable, default in table["columns"]:
+            if keep is not None and column not in keep:
+                continue
+            if default is None or str(default).upper() == "NULL":
+                suffix = "DEFAULT NULL" if nullable else "NOT NULL"
+            else:
+                suffix = f"{'' if nullable else 'NOT NULL '}DEFAULT {default}"
+            lines.append(f"  `{column}` {column_type} {suffix}")
+        for index, entry in table["indexes"].items():
+            if keep is not None and not set(entry["columns"]) <= set(keep):
+                continue
+            columns = ", ".join(f"`{column}`" for column in entry["columns"])
+            if index == "PRIMARY":
+                lines.append(f"  PRIMARY KEY ({columns})")
+            else:
+                lines.append(f"  {'UNIQUE KEY' if entry['unique'] else 'KEY'} `{index}` ({columns})")
+        return f"CREATE TABLE `{name}` (\n" + ",\n".join(lines) + "\n)"
+
+
+_services = {}
+_services_lock = Lock()
+
+
+def get_schema_service(mysql_engine) -> SchemaService:
+    """Return the process-wide SchemaService for an engine, so the catalog is checked once per process."""
+    with _services_lock:
+        key = mysql_engine.url.render_as_string(hide_password=True)
+        if key not in _services:
+            _services[key] = SchemaService(mysql_engine)
+        return _services[key]
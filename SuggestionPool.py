@@ -0,0 +1,240 @@
+from datetime import datetime, timedelta
+from hashlib import sha256
+from os import environ, makedirs, path, replace
+from random import random, randrange
+from threading import Event, Lock, Thread
+import json
+
+import pandas as pd
+from sqlalchemy import text
+
+from EngineRegistry import get_engine
+from SQLCache import SQLCache
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+WEIGHTINGS = ("uniform", "popularity", "recency")
+
+# Half-life of a prompt_logs ask under "recency" weighting
+RECENCY_HALF_LIFE_DAYS = 7.0
+
+
+def alias_table(weights) -> tuple:
+    """
+    Vose's alias method: O(n) setup for O(1) weighted draws
+
+    Args:
+        weights: Non-negative weights, at least one positive
+
+    Returns:
+        (probabilities, aliases); draw i uniformly, keep it with probability probabilities[i], else take aliases[i]
+    """
+    count = len(weights)
+    total = float(sum(weights))
+    scaled = [weight * count / total for weight in weights]
+    probabilities, aliases = [1.0] * count, list(range(count))
+    small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+    large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probabilities[less], aliases[less] = scaled[less], more
+        scaled[more] -= 1.0 - scaled[less]
+        (small if scaled[more] < 1.0 else large).append(more)
+    # Whatever is left is 1.0 up to rounding
+    return probabilities, aliases
+
+
+class SuggestionPool:
+    """
+    In-memory pool of discovered KPI questions for the "You can ask..." prompt.
+
+    The questions are read from aurora_discovered_kpis on a background thread
+    (reservoir-sampled down to pool_size when the table is larger) and kept in
+    memory, so suggest() is O(1) and the REPL prompt never waits on the
+    database. The thread re-checks a cheap watermark every refresh_seconds and
+    only reloads when it moved. The last pool is also kept on disk under
+    $AURORA_CACHE_DIR, so suggestions are there from the first prompt of a new
+    session. Draws can optionally be weighted by how often (popularity) or how
+    recently (recency) each question was asked, from prompt_logs, using an
+    alias table.
+    """
+
+    def __init__(self, mysql_engine, log_engine=None, weighting=None, pool_size=None, refresh_seconds=None,
+                 window_days=None, cache_dir=None):
+        """
+        Initialize the pool and start the refresh thread
+
+        Args:
+            mysql_engine: SQLAlchemy engine holding aurora_discovered_kpis
+            log_engine: Optional engine (or DSN, opened on the refresh thread) holding prompt_logs,
+                        needed for popularity/recency weighting. Defaults to mysql_engine
+            weighting: "uniform", "popularity" or "recency" (default: $SUGGESTION_WEIGHTING or uniform)
+            pool_size: Most questions kept in memory (default: $SUGGESTION_POOL_SIZE or 1000)
+            refresh_seconds: Seconds between watermark checks (default: $SUGGESTION_REFRESH_SECONDS or 300)
+            window_days: Days of prompt_logs counted for weighting (default: $SUGGESTION_WINDOW_DAYS or 30)
+            cache_dir: Optional directory for the pool cache. Defaults to $AURORA_CACHE_DIR
+        """
+        self.mysql_engine = mysql_engine
+        self._log_engine = log_engine if log_engine is not None else mysql_engine
+        self.weighting = weighting if weighting is not None else environ.get("SUGGESTION_WEIGHTING", "uniform")
+        if self.weighting not in WEIGHTINGS:
+            raise ValueError(f"weighting must be one of {', '.join(WEIGHTINGS)}, not {self.weighting!r}")
+        self.pool_size = pool_size if pool_size is not None else int(environ.get("SUGGESTION_POOL_SIZE", "1000"))
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None \
+            else float(environ.get("SUGGESTION_REFRESH_SECONDS", "300"))
+        self.window_days = window_days if window_days is not None \
+            else float(environ.get("SUGGESTION_WINDOW_DAYS", "30"))
+
+        cache_dir = cache_dir if cache_dir is not None else CACHE_DIR
+        makedirs(cache_dir, exist_ok=True)
+        database_key = sha256(mysql_engine.url.render_as_string(hide_password=True).encode("utf-8")).hexdigest()
+        self.cache_path = path.join(cache_dir, f"suggestions_{database_key[:16]}.json")
+
+        self.served = 0
+        self.reloads = 0
+        self.refresh_errors = 0
+
+        self._lock = Lock()
+        # Swapped as one tuple so suggest() never sees a half-built pool
+        self._pool = ([], None, None)
+        self._watermark = None
+        self._load_cache()
+
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="SuggestionPool", daemon=True)
+        self._thread.start()
+
+    def _load_cache(self):
+        if not path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path) as cache_file:
+                cached = json.load(cache_file)
+            if cached["weighting"] == self.weighting:
+                self._set_pool(cached["questions"], cached["weights"])
+                self._watermark = cached["watermark"]
+        except Exception:
+            # A damaged cache only costs the first few suggestions
+            pass
+
+    def _set_pool(self, questions, weights):
+        if questions and weights is not None and len(set(weights)) > 1:
+            probabilities, aliases = alias_table(weights)
+        else:
+            probabilities, aliases = None, None
+        self._pool = (questions, probabilities, aliases)
+
+    def suggest(self):
+        """
+        Draw a question from memory. Never touches the database
+
+        Returns:
+            A discovered KPI question, or None while the pool is empty
+        """
+        questions, probabilities, aliases = self._pool
+        if not questions:
+            return None
+        self.served += 1
+        index = randrange(len(questions))
+        if probabilities is not None and random() >= probabilities[index]:
+            index = aliases[index]
+        return questions[index]
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the current pool; the next tick tries again
+                self.refresh_errors += 1
+            if self._stop.wait(self.refresh_seconds):
+                return
+
+    def _current_watermark(self) -> list:
+        with self.mysql_engine.connect() as conn:
+            watermark = [conn.execute(text("SELECT COUNT(*) FROM aurora_discovered_kpis")).scalar()]
+        if self.weighting != "uniform":
+            with self._logs().connect() as conn:
+                watermark += conn.execute(text(
+                    "SELECT COUNT(*), CAST(MAX(created_at) AS CHAR) FROM prompt_logs")).one()
+        return [None if value is None else str(value) for value in watermark]
+
+    def _logs(self):
+        if isinstance(self._log_engine, str):
+            self._log_engine = get_engine(self._log_engine)
+        return self._log_engine
+
+    def refresh(self) -> bool:
+        """
+        Reload the pool if aurora_discovered_kpis (or, when weighted, prompt_logs) changed
+
+        Returns:
+            True if the pool was reloaded
+        """
+        with self._lock:
+            watermark = self._current_watermark()
+            if watermark == self._watermark:
+                return False
+
+            questions = self._sample_questions()
+            weights = self._weights(questions) if self.weighting != "uniform" else None
+            self._set_pool(questions, weights)
+            self._watermark = watermark
+            self.reloads += 1
+
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, "w") as cache_file:
+                json.dump({"weighting": self.weighting, "watermark": watermark, "questions": questions,
+                           "weights": weights}, cache_file)
+            replace(temp_path, self.cache_path)
+            return True
+
+    def _sample_questions(self) -> list:
+        # Reservoir sampling over a streamed scan: one pass, pool_size rows in memory, no sort
+        reservoir, seen, unique = [], 0, set()
+        with self.mysql_engine.connect() as conn:
+            rows = conn.execution_options(stream_results=True).execute(
+                text("SELECT question FROM aurora_discovered_kpis WHERE question IS NOT NULL"))
+            for (question,) in rows:
+                key = SQLCache.normalize_question(question)
+                if not key or key in unique:
+                    continue
+                unique.add(key)
+                seen += 1
+                if len(reservoir) < self.pool_size:
+                    reservoir.append(question)
+                else:
+                    slot = randrange(seen)
+                    if slot < self.pool_size:
+                        reservoir[slot] = question
+        return reservoir
+
+    def _weights(self, questions) -> list:
+        with self._logs().connect() as conn:
+            asks = pd.DataFrame(conn.execute(text(
+                "SELECT user_prompt, COUNT(*) AS asks, MAX(created_at) AS last_asked FROM prompt_logs "
+                "WHERE created_at >= :since GROUP BY user_prompt"),
+                {"since": datetime.now() - timedelta(days=self.window_days)}).all(),
+                columns=["user_prompt", "asks", "last_asked"])
+        if len(asks) == 0:
+            return [1.0] * len(questions)
+
+        asks = asks.dropna(subset=["user_prompt"])
+        asks["question"] = asks.user_prompt.map(SQLCache.normalize_question)
+        if self.weighting == "recency":
+            age_days = (pd.Timestamp.now() - pd.to_datetime(asks.last_asked)).dt.total_seconds() / 86400.0
+            asks["asks"] = asks.asks * 0.5 ** (age_days.clip(lower=0) / RECENCY_HALF_LIFE_DAYS)
+        counts = asks.groupby("question").asks.sum().to_dict()
+        # Never-asked questions keep a base weight so new KPIs still get suggested
+        return [1.0 + float(counts.get(SQLCache.normalize_question(question), 0.0)) for question in questions]
+
+    def close(self):
+        """Stop the refresh thread."""
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def summary(self) -> str:
+        """One-line summary for the timing output."""
+        return (f"Suggestions: {len(self._pool[0])} pooled ({self.weighting}) / {self.served} served / "
+                f"{self.reloads} reloads / {self.refresh_errors} refresh errors")
@@ -0,0 +1,185 @@
+from collections import defaultdict
+from os import environ
+from threading import Lock
+import re
+
+from litellm import token_counter, cost_per_token
+from sqlalchemy import text
+
+
+DEFAULT_MODEL = "openai/llama3.1:8b"
+
+
+def count_tokens(prompt_text: str, model: str = DEFAULT_MODEL) -> int:
+    """Count tokens with the model's tokenizer, falling back to about 4 characters per token."""
+    if not prompt_text:
+        return 0
+    try:
+        return token_counter(model=model, text=prompt_text)
+    except Exception:
+        return len(prompt_text) // 4 + 1
+
+
+def prompt_sections(template, **values) -> dict:
+    """
+    Split a prompt into named sections: the template's own text, split at its
+    headings (see heading_sections), plus each value filled into it (e.g. schema,
+    data, old_questions, results).
+
+    Args:
+        template: PromptTemplate, or the raw template string
+        **values: The values the template is formatted with
+
+    Returns:
+        Dictionary of section name to section text
+    """
+    template_text = template if isinstance(template, str) else template.template
+    sections = heading_sections(re.sub(r"\{\w+\}", "", template_text))
+    sections.update({name: str(value) for name, value in values.items()})
+    return sections
+
+
+def heading_sections(prompt_text: str) -> dict:
+    """
+    Split a fixed prompt (e.g. a system prompt with inlined DDL) into sections at its
+    markdown headings and "Schema:" line, so rules, schema and enum lists are counted separately.
+    """
+    sections = {}
+    name = "preamble"
+    for line in prompt_text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith("#") or stripped == "Schema:":
+            name = stripped.lstrip("#").strip().rstrip(":").lower() or name
+        sections[name] = sections.get(name, "") + line
+    return sections
+
+
+def merge_usage(usages, scale=1.0) -> dict:
+    """Sum several usage dicts from TokenLedger.record, optionally scaled (e.g. 1/n to amortize a batch call)."""
+    merged = {"prompt_tokens": 0, "completion_tokens": 0, "sections": defaultdict(int)}
+    for usage in usages:
+        merged["prompt_tokens"] += usage["prompt_tokens"]
+        merged["completion_tokens"] += usage["completion_tokens"]
+        for name, tokens in usage["sections"].items():
+            merged["sections"][name] += tokens
+    return {
+        "prompt_tokens": round(merged["prompt_tokens"] * scale),
+        "completion_tokens": round(merged["completion_tokens"] * scale),
+        "sections": {name: round(tokens * scale) for name, tokens in merged["sections"].items()},
+    }
+
+
+class TokenLedger:
+    """
+    Per-stage prompt/completion token accounting for LLM calls.
+
+    Each call is recorded with its prompt broken down by section, so the report
+    shows which part of a prompt (schema, sample rows, previous questions,
+    results, ...) a stage's tokens go to, alongside tokens/sec and cost.
+    """
+
+    def __init__(self, prompt_cost_per_1k=None, completion_cost_per_1k=None):
+        """
+        Initialize the ledger
+
+        Args:
+            prompt_cost_per_1k: Cost per 1000 prompt tokens. Defaults to $TOKEN_COST_PROMPT_PER_1K,
+                                else LiteLLM's price for the model, else 0 (local models)
+            completion_cost_per_1k: Cost per 1000 completion tokens. Defaults to $TOKEN_COST_COMPLETION_PER_1K,
+                                    else LiteLLM's price for the model, else 0
+        """
+        if prompt_cost_per_1k is None and "TOKEN_COST_PROMPT_PER_1K" in environ:
+            prompt_cost_per_1k = float(environ["TOKEN_COST_PROMPT_PER_1K"])
+        if completion_cost_per_1k is None and "TOKEN_COST_COMPLETION_PER_1K" in environ:
+            completion_cost_per_1k = float(environ["TOKEN_COST_COMPLETION_PER_1K"])
+        self.prompt_cost_per_1k = prompt_cost_per_1k
+        self.completion_cost_per_1k = completion_cost_per_1k
+
+        self._stages = {}
+        self._lock = Lock()
+
+    def record(self, stage, sections, completion, seconds, model=DEFAULT_MODEL) -> dict:
+        """
+        Record one LLM call
+
+        Args:
+            stage: Pipeline stage, e.g. "question", "query" or "answer"
+            sections: Dictionary of prompt section name to text (see prompt_sections)
+            completion: The completion text (for structured output, the JSON of the parsed object)
+            seconds: Wall-clock time of the call
+            model: Model name used for tokenization and pricing
+
+        Returns:
+            Usage dict with prompt_tokens, completion_tokens and per-section prompt tokens,
+            suitable for persisting with the stage's log row
+        """
+        section_tokens = {name: count_tokens(section, model) for name, section in sections.items()}
+        usage = {
+            "prompt_tokens": sum(section_tokens.values()),
+            "completion_tokens": count_tokens(completion, model),
+            "sections": section_tokens,
+        }
+        cost = self._cost(model, usage["prompt_tokens"], usage["completion_tokens"])
+
+        with self._lock:
+            totals = self._stages.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                                     "seconds": 0.0, "cost": 0.0, "sections": defaultdict(int)})
+            totals["calls"] += 1
+            totals["prompt_tokens"] += usage["prompt_tokens"]
+            totals["completion_tokens"] += usage["completion_tokens"]
+            totals["seconds"] += seconds
+            totals["cost"] += cost
+            for name, tokens in section_tokens.items():
+                totals["sections"][name] += tokens
+        return usage
+
+    def _cost(self, model, prompt_tokens, completion_tokens) -> float:
+        try:
+            prompt_cost, completion_cost = cost_per_token(model=model, prompt_tokens=prompt_tokens,
+                                                          completion_tokens=completion_tokens)
+        except Exception:
+            prompt_cost, completion_cost = 0.0, 0.0
+        if self.prompt_cost_per_1k is not None:
+            prompt_cost = prompt_tokens / 1000 * self.prompt_cost_per_1k
+        if self.completion_cost_per_1k is not None:
+            completion_cost = completion_tokens / 1000 * self.completion_cost_per_1k
+        return prompt_cost + completion_cost
+
+    def report(self) -> str:
+        """Per-stage summary: tokens per call, largest prompt sections, tokens/sec and cost."""
+        with self._lock:
+            if not self._stages:
+                return "Token usage: no LLM calls recorded"
+            lines = ["Token usage by stage:"]
+            for stage, totals in self._stages.items():
+                calls = totals["calls"]
+                seconds = totals["seconds"]
+                tokens_per_second = (totals["prompt_tokens"] + totals["completion_tokens"]) / seconds if seconds else 0.0
+                completion_per_second = totals["completion_tokens"] / seconds if seconds else 0.0
+                largest = sorted(totals["sections"].items(), key=lambda item: item[1], reverse=True)[:4]
+                lines.append(
+                    f"- {stage}: {calls} calls, {totals['prompt_tokens'] / calls:.0f} prompt + "
+                    f"{totals['completion_tokens'] / calls:.0f} completion tokens/call, "
+                    f"{tokens_per_second:.0f} tokens/s ({completion_per_second:.1f} completion tokens/s), "
+                    f"cost {totals['cost']:.4f} ({totals['cost'] / calls:.5f}/call); prompt sections: "
+                    + ", ".join(f"{name} {tokens / calls:.0f}" for name, tokens in largest)
+                )
+            return "\n".join(lines)
+
+
+def ensure_token_usage_column(mysql_engine, table):
+    """
+    Add a nullable token_usage column (JSON text of per-stage usage) to a log table if it's missing.
+    Used as a LogWriter prepare hook, so it runs once per writer before the first insert.
+    Non-MariaDB databases (the benchmark fixture) are expected to have the column already.
+    """
+    if mysql_engine.dialect.name != "mysql":
+        return
+    with mysql_engine.connect() as conn:
+        exists = conn.execute(text(
+            "SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = DATABASE() "
+            "AND table_name = :table AND column_name = 'token_usage'"
+        ), {"table": table}).scalar()
+        if not exists:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN token_usage TEXT NULL"))
+            conn.commit()
@@ -0,0 +1,188 @@
+from os import environ, makedirs, path
+import argparse
+import random
+import sys
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, text
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from EngineRegistry import get_engine
+
+
+CACHE_DIR = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+REGIONS = ["EMEA", "NA East", "NA West", "LATAM", "APAC"]
+TEAMS = ["EMEA Onboarding", "Provisioning", "Number Porting", "Network Build", "Activation", "Billing Setup",
+         "Quality Assurance", "Customer Success"]
+STEP_NAMES = ["Validate order", "Reserve numbers", "Port request", "Configure trunk", "Provision route",
+              "Test call flow", "Activate service", "Notify customer", "Close order", "Billing handoff"]
+WORKFLOW_STATUSES = ["INPROGRESS", "COMPLETE", "PCNCL", "CNCL"]
+ORDER_STATUSES = ["PENDING", "INCMPLT", "CNCL", "PCNCL", "CLSD"]
+EPOCH = np.datetime64("2024-01-01T00:00:00")
+
+LOG_TABLES_DDL = [
+    """CREATE TABLE IF NOT EXISTS aurora_discovered_kpis (
+        question TEXT, sql_query TEXT, sql_fingerprint CHAR(64) UNIQUE, answer TEXT,
+        question_gen_time_seconds DOUBLE, query_gen_time_seconds DOUBLE, answer_gen_time_seconds DOUBLE,
+        token_usage TEXT)""",
+    """CREATE TABLE IF NOT EXISTS prompt_logs (
+        user_prompt TEXT, generated_query TEXT, num_results BIGINT, user_feedback BOOLEAN,
+        created_at DATETIME, results_returned_fl BOOLEAN, token_usage TEXT)""",
+    "CREATE TABLE IF NOT EXISTS bench_fixture_meta (steps BIGINT, seed BIGINT)",
+]
+
+
+def fixture_engine(dsn):
+    """
+    Shared engine for a fixture database. On SQLite this registers RAND() so the
+    repo's MariaDB-flavoured sampling queries (ORDER BY RAND()) run unchanged.
+    """
+    engine = get_engine(dsn)
+    if engine.dialect.name == "sqlite" and not getattr(engine, "_aurora_fixture", False):
+        event.listen(engine, "connect", lambda conn, record: conn.create_function("RAND", 0, random.random))
+        # Drop the connection made before the listener existed
+        engine.dispose()
+        engine._aurora_fixture = True
+    return engine
+
+
+def build_fixture(steps=10_000, dsn=None, seed=7, chunk_rows=500_000, fixture_dir=None):
+    """
+    Create (or reuse) a database with the products/orders/workflows/workflow_steps
+    schema at a given scale, plus empty aurora_discovered_kpis and prompt_logs tables.
+
+    Args:
+        steps: Number of workflow_steps rows (10k for smoke runs up to 50M for scale runs)
+        dsn: Target database. Defaults to a SQLite file under $AURORA_CACHE_DIR named for the scale
+        seed: Random seed, so the same scale always produces the same data
+        chunk_rows: Rows generated and inserted per chunk, which bounds memory at large scales
+        fixture_dir: Directory for the default SQLite file (default: $AURORA_CACHE_DIR)
+
+    Returns:
+        The DSN of the fixture database
+    """
+    if dsn is None:
+        fixture_dir = fixture_dir or CACHE_DIR
+        makedirs(fixture_dir, exist_ok=True)
+        dsn = f"sqlite:///{path.abspath(path.join(fixture_dir, f'bench_fixture_{steps}_{seed}.sqlite'))}"
+    engine = fixture_engine(dsn)
+
+    with engine.connect() as conn:
+        for ddl in LOG_TABLES_DDL:
+            conn.execute(text(ddl))
+        conn.commit()
+        existing = conn.execute(text("SELECT steps, seed FROM bench_fixture_meta")).fetchall()
+    if existing and tuple(existing[0]) == (steps, seed):
+        return dsn
+
+    rng = np.random.default_rng(seed)
+    workflows = max(1, steps // 16)
+    orders = max(1, workflows * 5 // 6)
+    products = 40
+
+    product_ids = np.arange(1, products + 1)
+    frames = {
+        "products": pd.DataFrame({
+            "index": product_ids - 1,
+            "product_id": product_ids,
+            "product_name": [f"Product {i}" for i in product_ids],
+            "service_name": [f"Service {i % 8}" for i in product_ids],
+            "group_product_name": [f"Group {i % 4}" for i in product_ids],
+            "parent_product_name": [f"Parent {i % 2}" for i in product_ids],
+            "is_active": (product_ids % 7 != 0).astype(np.int64),
+        }),
+    }
+
+    order_ids = np.arange(1, orders + 1)
+    order_created = EPOCH + rng.integers(0, 365 * 86400, orders).astype("timedelta64[s]")
+    frames["orders"] = pd.DataFrame({
+        "index": order_ids - 1,
+        "order_id": order_ids,
+        "product_id": rng.integers(1, products + 1, orders),
+        "region_name": rng.choice(REGIONS, orders),
+        "team_manager_name": rng.choice([f"Manager {i}" for i in range(12)], orders),
+        "team_name": rng.choice(TEAMS, orders),
+        "order_status": rng.choice(ORDER_STATUSES, orders, p=[0.2, 0.1, 0.05, 0.05, 0.6]),
+        "customer_name": rng.choice([f"Customer {i}" for i in range(500)], orders),
+        "days_past_due": np.maximum(rng.normal(-5, 10, orders), 0).round(1),
+        "desired_due_date": order_created + np.timedelta64(30, "D"),
+        "create_date": order_created,
+        "update_date": order_created + rng.integers(0, 60 * 86400, orders).astype("timedelta64[s]"),
+    })
+
+    workflow_ids = np.arange(1, workflows + 1)
+    workflow_orders = rng.integers(1, orders + 1, workflows)
+    workflow_inserted = order_created[workflow_orders - 1]
+    frames["workflows"] = pd.DataFrame({
+        "index": workflow_ids - 1,
+        "workflow_id": workflow_ids,
+        "order_id": workflow_orders.astype(np.float64),
+        "workflow_name": rng.choice([f"Workflow {name}" for name in ["Port", "New Line", "Move", "Disconnect"]],
+                                    workflows),
+        "workflow_description": "Generated benchmark workflow",
+        "workflow_status": rng.choice(WORKFLOW_STATUSES, workflows, p=[0.3, 0.6, 0.05, 0.05]),
+        "insert_date": workflow_inserted,
+        "update_date": workflow_inserted + rng.integers(0, 30 * 86400, workflows).astype("timedelta64[s]"),
+        "workflow_elapsed_duration_hours": rng.gamma(2.0, 40.0, workflows).round(2),
+    })
+
+    with engine.connect() as conn:
+        for table in ["products", "orders", "workflows", "workflow_steps", "bench_fixture_meta"]:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(text("CREATE TABLE bench_fixture_meta (steps BIGINT, seed BIGINT)"))
+        conn.commit()
+    for table, frame in frames.items():
+        frame.to_sql(table, engine, index=False, chunksize=50_000)
+
+    members = [f"Member {i}" for i in range(60)]
+    for start in range(0, steps, chunk_rows):
+        count = min(chunk_rows, steps - start)
+        step_ids = np.arange(start, start + count)
+        step_workflows = rng.integers(1, workflows + 1, count)
+        team_ids = rng.integers(0, len(TEAMS), count)
+        estimated_days = rng.gamma(1.5, 1.0, count).round(2)
+        step_dates = workflow_inserted[step_workflows - 1] + rng.integers(0, 20 * 86400, count).astype("timedelta64[s]")
+        elapsed = (estimated_days * 24 * rng.lognormal(0, 0.6, count)).round(2)
+        elapsed[rng.random(count) < 0.1] = np.nan
+        pd.DataFrame({
+            "index": step_ids,
+            "workflow_step_id": step_ids + 1,
+            "order_id": workflow_orders[step_workflows - 1].astype(np.float64),
+            "order_item_id": rng.integers(1, 5, count).astype(np.float64),
+            "workflow_id": step_workflows,
+            "workflow_step_name": rng.choice(STEP_NAMES, count),
+            "workflow_step_description": "Generated benchmark step",
+            "effective_parent_workflow_status": rng.choice(WORKFLOW_STATUSES, count),
+            "workflow_step_estimated_duration_days": estimated_days,
+            "team_name": np.asarray(TEAMS)[team_ids],
+            "team_id": team_ids,
+            "team_member": rng.choice(members, count),
+            "workflow_step_due_date": step_dates + (estimated_days * 86400).astype("timedelta64[s]"),
+            "is_automated_step": (rng.random(count) < 0.35).astype(np.int64),
+            "workflow_step_elapsed_duration_hours": elapsed,
+            "workflow_step_date": step_dates,
+        }).to_sql("workflow_steps", engine, index=False, if_exists="append", chunksize=50_000)
+
+    with engine.connect() as conn:
+        for table in ["products", "orders", "workflows", "workflow_steps"]:
+            conn.execute(text(f"CREATE INDEX ix_{table}_index ON {table} ({quote_index(engine)})"))
+        conn.execute(text("INSERT INTO bench_fixture_meta (steps, seed) VALUES (:steps, :seed)"),
+                     {"steps": steps, "seed": seed})
+        conn.commit()
+    return dsn
+
+
+def quote_index(engine) -> str:
+    """The `index` column name quoted for the engine's dialect."""
+    return engine.dialect.identifier_preparer.quote("index")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the benchmark fixture database")
+    parser.add_argument("--steps", type=int, default=10_000, help="workflow_steps rows, e.g. 10000 to 50000000")
+    parser.add_argument("--dsn", default=None, help="Target database (default: SQLite file under $AURORA_CACHE_DIR)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    print(f"Fixture ready: {build_fixture(args.steps, args.dsn, args.seed)}")
@@ -0,0 +1,314 @@
+from os import environ, makedirs, path
+from tempfile import mkdtemp
+from threading import Event, Lock, Thread
+from time import perf_counter, sleep
+import argparse
+import json
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from stub_llm_server import StubLLMServer
+from run_benchmarks import bench_questions, use_offline_environment
+
+
+# Questions in the style of the `questions` list in updated-via-tim.py: what an operations manager asks
+OPERATIONS_QUESTIONS = [
+    "Take a count of automated vs manual steps completed, broken down by product id. How many failed?",
+    "which workflow steps names take the longest to complete on average",
+    "trend of manual vs automated steps completed over the last month",
+    "How is my team (team name EMEA Onboarding) doing against their SLAs?",
+    "Which of my team members are completing the most/fewest tasks?",
+    "How long does it take to complete short code orders?",
+    "How is the performance trending over time?",
+    "How many tasks (by product?) are automated vs manual?",
+    "Which automations have high failure rates?",
+    "how long does it take to put a product into service? this might be duration of the overall workflow for a "
+    "given product possibly by region or country",
+]
+
+
+class _Uncached:
+    """Stands in for SQLCache and ResultCache when a run should measure every request end to end."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def get(self, question, schema_hash):
+        return None
+
+    def put(self, question, schema_hash, sql_query):
+        pass
+
+    def invalidate(self, question, schema_hash):
+        pass
+
+    def read_sql(self, sql_query):
+        from pandas import read_sql
+        from sqlalchemy import text
+        return read_sql(text(sql_query), self.engine), False
+
+    def summary(self) -> str:
+        return "cache off"
+
+
+def question_mix(engine, kpi_limit=200) -> list:
+    """
+    Questions the simulated users ask: previously discovered KPI questions from
+    aurora_discovered_kpis, plus operations-manager questions in the updated-via-tim.py style.
+    """
+    from sqlalchemy import text
+    try:
+        with engine.connect() as conn:
+            kpi_questions = [row[0] for row in conn.execute(
+                text(f"SELECT question FROM aurora_discovered_kpis LIMIT {int(kpi_limit)}")) if row[0]]
+    except Exception:
+        kpi_questions = []
+    return kpi_questions + OPERATIONS_QUESTIONS
+
+
+class PoolSampler:
+    """Samples a SQLAlchemy QueuePool's checked-out connections on a background thread."""
+
+    def __init__(self, engine, interval=0.01):
+        self.pool = engine.pool
+        self.interval = interval
+        self.capacity = self.pool.size() + max(getattr(self.pool, "_max_overflow", 0), 0)
+        self.samples = []
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="PoolSampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(self.pool.checkedout())
+            sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def stats(self) -> dict:
+        samples = np.asarray(self.samples or [0])
+        return {
+            "pool_capacity": self.capacity,
+            "pool_peak_checked_out": int(samples.max()),
+            "pool_mean_checked_out": float(samples.mean()),
+            "pool_saturated_share": float((samples >= self.capacity).mean()) if self.capacity else 0.0,
+        }
+
+
+def run_level(explorer, writer, stub, users, duration, think_seconds, questions, seed) -> dict:
+    """
+    Drive one concurrency level: `users` threads, each asking a question, logging it the
+    way the REPL does, then thinking for an exponentially distributed pause, until `duration` passes.
+
+    Returns:
+        Dictionary of latency percentiles, throughput, error rate, gateway queueing delay and pool saturation
+    """
+    records = []
+    records_lock = Lock()
+    deadline = perf_counter() + duration
+
+    def user(user_id):
+        rng = random.Random(seed * 1000 + user_id)
+        # Stagger start so users don't arrive in lockstep
+        sleep(rng.uniform(0, think_seconds))
+        while perf_counter() < deadline:
+            question = rng.choice(questions)
+            start = perf_counter()
+            try:
+                result = explorer.explore_question(question, 0.0, show_output=False)
+                writer.write({"user_prompt": question, "generated_query": result.get("sql_query"),
+                              "num_results": len(result["dataframe"]) if "dataframe" in result else 0,
+                              "user_feedback": None, "created_at": None,
+                              "results_returned_fl": "dataframe" in result, "token_usage": None})
+                error = result["error"] if not result["success"] else None
+            except Exception as e:
+                result, error = {}, str(e)
+            with records_lock:
+                records.append({"latency": perf_counter() - start, "error": error,
+                                "query_exec_seconds": result.get("query_exec_seconds")})
+            if think_seconds > 0:
+                sleep(rng.expovariate(1.0 / think_seconds))
+
+    stub.take_queue_stats()
+    wall_start = perf_counter()
+    with PoolSampler(explorer.mysql_engine) as sampler:
+        threads = [Thread(target=user, args=(i,), name=f"user-{i}") for i in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall_seconds = perf_counter() - wall_start
+    queue_waits, peak_in_flight = stub.take_queue_stats()
+
+    latencies = np.asarray([record["latency"] for record in records] or [0.0])
+    errors = [record["error"] for record in records if record["error"]]
+    exec_times = np.asarray([record["query_exec_seconds"] for record in records
+                             if record["query_exec_seconds"] is not None] or [0.0])
+    waits = np.asarray(queue_waits or [0.0])
+    return {
+        "users": users,
+        "requests": len(records),
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+        "throughput_per_s": len(records) / wall_seconds if wall_seconds > 0 else 0.0,
+        "error_rate": len(errors) / len(records) if records else 0.0,
+        "errors": sorted(set(errors))[:5],
+        "gateway_queue_p50": float(np.percentile(waits, 50)),
+        "gateway_queue_p95": float(np.percentile(waits, 95)),
+        "gateway_peak_in_flight": peak_in_flight,
+        "query_exec_p95": float(np.percentile(exec_times, 95)),
+        **sampler.stats(),
+    }
+
+
+def find_knee(levels, slo_p95, max_error_rate=0.01, min_gain=0.1):
+    """
+    The first concurrency level past which adding users stops paying: throughput grows by
+    less than min_gain over the previous level, p95 latency breaks the SLO, or errors exceed max_error_rate.
+
+    Returns:
+        (users at the knee, reason), or (None, None) if every level scaled
+    """
+    for previous, level in zip([None] + levels[:-1], levels):
+        if level["error_rate"] > max_error_rate:
+            return level["users"], f"error rate {level['error_rate']:.1%}"
+        if level["p95"] > slo_p95:
+            return level["users"], f"p95 {level['p95']:.2f}s over the {slo_p95:.2f}s SLO"
+        if previous and level["throughput_per_s"] < previous["throughput_per_s"] * (1 + min_gain):
+            return previous["users"], (f"throughput flat ({previous['throughput_per_s']:.1f} -> "
+                                       f"{level['throughput_per_s']:.1f}/s) from {previous['users']} to "
+                                       f"{level['users']} users")
+    return None, None
+
+
+def run(args) -> dict:
+    """Ramp through the concurrency levels and return {"meta": ..., "levels": [...], "knee": ...}."""
+    work_dir = mkdtemp(prefix="aurora_load_")
+    fixture_dir = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+    stub = StubLLMServer(ttft_median=args.ttft_median, ttft_sigma=args.ttft_sigma,
+                         tokens_per_second=args.tokens_per_second, seed=args.seed,
+                         max_concurrency=args.gateway_concurrency).start()
+    use_offline_environment(stub, work_dir)
+
+    from rich.console import Console
+    from fixture_db import build_fixture, fixture_engine
+    from KPIExplorer import KPIExplorer
+    from SQLCache import SQLCache
+    from ResultCache import ResultCache
+    from LogWriter import LogWriter, PROMPT_LOG_COLUMNS
+
+    console = Console()
+    console.print(f"Building fixture ({args.steps} workflow steps)...")
+    engine = fixture_engine(build_fixture(args.steps, args.fixture_dsn, args.seed, fixture_dir=fixture_dir))
+    questions = question_mix(fixture_engine(args.kpi_dsn) if args.kpi_dsn else engine)
+    questions += bench_questions(args.extra_questions)
+    console.print(f"Question mix: {len(questions)} questions, pool capacity "
+                  f"{engine.pool.size()} + {max(getattr(engine.pool, '_max_overflow', 0), 0)} overflow, "
+                  f"gateway concurrency {args.gateway_concurrency or 'unlimited'}")
+
+    # One explorer and one log writer shared by every user, as in a single multi-user process
+    explorer = KPIExplorer(mysql_engine=engine, console=Console(quiet=True))
+    for llm in (explorer.sql_llm_base, explorer.answer_llm_base, explorer.explorer_llm_base):
+        llm.api_base = stub.url
+    writer = LogWriter(engine, "prompt_logs", PROMPT_LOG_COLUMNS, spill_path=path.join(work_dir, "spill.jsonl"))
+
+    levels = []
+    for users in args.users:
+        # Fresh caches per level, so every level starts equally cold
+        level_dir = path.join(work_dir, f"users_{users}")
+        makedirs(level_dir, exist_ok=True)
+        if args.cache == "off":
+            explorer.sql_cache = explorer.result_cache = _Uncached(engine)
+        else:
+            explorer.sql_cache = SQLCache(cache_path=path.join(level_dir, "sql_cache.sqlite"))
+            explorer.result_cache = ResultCache(engine, cache_dir=path.join(level_dir, "results"))
+        level = run_level(explorer, writer, stub, users, args.duration, args.think_seconds, questions, args.seed)
+        levels.append(level)
+        console.print(f"{users:>4} users: {level['requests']} requests, p95 {level['p95']:.2f}s, "
+                      f"{level['throughput_per_s']:.1f}/s, errors {level['error_rate']:.1%}")
+    writer.close()
+    stub.stop()
+
+    knee_users, knee_reason = find_knee(levels, args.slo_p95, args.max_error_rate)
+    return {
+        "meta": {"steps": args.steps, "duration": args.duration, "think_seconds": args.think_seconds,
+                 "gateway_concurrency": args.gateway_concurrency, "cache": args.cache,
+                 "ttft_median": stub.ttft_median, "tokens_per_second": stub.tokens_per_second,
+                 "slo_p95": args.slo_p95, "max_error_rate": args.max_error_rate, "questions": len(questions), "seed": args.seed},
+        "levels": levels,
+        "knee": {"users": knee_users, "reason": knee_reason},
+    }
+
+
+def print_results(results):
+    from rich.console import Console
+    from rich.table import Table
+
+    meta = results["meta"]
+    table = Table(title=f"Load test ({meta['steps']} workflow steps, p95 SLO {meta['slo_p95']:.2f}s)")
+    for column in ["users", "requests", "p50", "p95", "p99", "throughput/s", "errors", "gateway queue p95",
+                   "gateway in flight", "pool peak", "pool saturated", "SLO"]:
+        table.add_column(column, justify="right")
+    for level in results["levels"]:
+        table.add_row(
+            str(level["users"]), str(level["requests"]), f"{level['p50']:.2f}s", f"{level['p95']:.2f}s",
+            f"{level['p99']:.2f}s", f"{level['throughput_per_s']:.1f}", f"{level['error_rate']:.1%}",
+            f"{level['gateway_queue_p95'] * 1000:.0f}ms", str(level["gateway_peak_in_flight"]),
+            f"{level['pool_peak_checked_out']}/{level['pool_capacity']}", f"{level['pool_saturated_share']:.0%}",
+            "[green]ok[/green]" if level["p95"] <= meta["slo_p95"] and level["error_rate"] <= meta["max_error_rate"]
+            else "[red]miss[/red]",
+        )
+    console = Console()
+    console.print(table)
+    for level in results["levels"]:
+        for error in level["errors"]:
+            console.print(f"[yellow]{level['users']} users: {error}[/yellow]")
+    knee = results["knee"]
+    if knee["users"] is None:
+        console.print("No knee found: throughput kept scaling within the SLO at every level")
+    else:
+        console.print(f"[bold]Knee at {knee['users']} users[/bold]: {knee['reason']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent multi-user load test with a stub LLM and fixture database")
+    parser.add_argument("--users", type=lambda value: [int(n) for n in value.split(",")], default=[1, 2, 4, 8, 16, 32],
+                        help="Comma-separated concurrency levels to ramp through")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per concurrency level")
+    parser.add_argument("--think-seconds", type=float, default=1.0, help="Mean pause between a user's questions")
+    parser.add_argument("--steps", type=int, default=10_000, help="Fixture workflow_steps rows")
+    parser.add_argument("--fixture-dsn", default=None, help="Build the fixture in this database instead of SQLite")
+    parser.add_argument("--kpi-dsn", default=None,
+                        help="Read the question mix from this database's aurora_discovered_kpis (default: the fixture)")
+    parser.add_argument("--extra-questions", type=int, default=0, help="Add this many generated questions to the mix")
+    parser.add_argument("--cache", choices=["fresh", "off"], default="fresh",
+                        help="fresh: SQL/result caches start empty at each level; off: no caching")
+    parser.add_argument("--gateway-concurrency", type=int, default=4,
+                        help="Chat requests the stub gateway serves at once (0 for unlimited)")
+    parser.add_argument("--ttft-median", type=float, default=None, help="Stub median time to first token (s)")
+    parser.add_argument("--ttft-sigma", type=float, default=None, help="Stub lognormal sigma of time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=None, help="Stub mean decoding speed")
+    parser.add_argument("--slo-p95", type=float, default=5.0, help="p95 end-to-end latency objective (s)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Error rate that counts as falling over")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=None, help="Write results JSON here")
+    args = parser.parse_args()
+    args.gateway_concurrency = args.gateway_concurrency or None
+
+    results = run(args)
+    print_results(results)
+    if args.output:
+        makedirs(path.dirname(path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
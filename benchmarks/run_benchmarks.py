@@ -0,0 +1,237 @@
+from os import environ, makedirs, path
+from tempfile import mkdtemp
+from time import perf_counter
+import argparse
+import json
+import sys
+
+import numpy as np
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from stub_llm_server import StubLLMServer, CANNED_SQL, QUESTION_TOPICS
+
+
+def measure(fn, iterations, warmup=1) -> dict:
+    """
+    Time fn() over a number of iterations
+
+    Returns:
+        Dictionary with count, p50/p95/p99/mean latency in seconds and throughput (calls per second)
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = perf_counter()
+    for _ in range(iterations):
+        call_start = perf_counter()
+        fn()
+        latencies.append(perf_counter() - call_start)
+    return summarize(latencies, perf_counter() - start)
+
+
+def summarize(latencies, wall_seconds, units=None) -> dict:
+    """Percentiles of per-call latencies; throughput counts units (default: calls) per wall-clock second."""
+    values = np.asarray(latencies)
+    units = units if units is not None else len(values)
+    return {
+        "count": int(len(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+        "throughput_per_s": units / wall_seconds if wall_seconds > 0 else 0.0,
+    }
+
+
+def bench_questions(count) -> list:
+    dimensions = ["team", "month", "region", "product", "step name"]
+    return [f"How does {topic} vary by {dimensions[i % len(dimensions)]}?"
+            for i, topic in enumerate((QUESTION_TOPICS * (count // len(QUESTION_TOPICS) + 1))[:count])]
+
+
+def use_offline_environment(stub, work_dir):
+    """Point the repo's modules at the stub LLM and throwaway caches. Call before importing them."""
+    environ["LITELLM_API_BASE"] = stub.url
+    environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    environ["AURORA_CACHE_DIR"] = work_dir
+    environ.setdefault("PIPELINE_TRACE_EXPORT", "off")
+
+
+def run(args) -> dict:
+    """Run every stage benchmark and return {"meta": ..., "stages": {stage: stats}}."""
+    work_dir = mkdtemp(prefix="aurora_bench_")
+    # Fixtures are expensive at scale, so they live in the real cache dir and are reused across runs
+    fixture_dir = environ.get("AURORA_CACHE_DIR", ".aurora_cache")
+
+    stub = StubLLMServer(ttft_median=args.ttft_median, ttft_sigma=args.ttft_sigma,
+                         tokens_per_second=args.tokens_per_second, responses_path=args.responses,
+                         record=args.record, seed=args.seed).start()
+    use_offline_environment(stub, work_dir)
+
+    from rich.console import Console
+    from sqlalchemy import text
+    from pandas import read_sql
+    from fixture_db import build_fixture, fixture_engine
+    from KPIExplorer import KPIExplorer
+    from SQLCache import SQLCache
+    from ResultCache import ResultCache
+    from ResultEncoder import encode_results
+    from QueryGuard import QueryGuard
+    from LogWriter import LogWriter, PROMPT_LOG_COLUMNS
+    from SQLFingerprint import sql_fingerprint
+    from NoveltyFilter import NoveltyFilter
+
+    console = Console()
+    console.print(f"Building fixture ({args.steps} workflow steps)...")
+    dsn = build_fixture(args.steps, args.fixture_dsn, args.seed, fixture_dir=fixture_dir)
+    engine = fixture_engine(dsn)
+    with engine.connect() as conn:
+        conn.execute(text("DELETE FROM aurora_discovered_kpis"))
+        conn.execute(text("DELETE FROM prompt_logs"))
+        conn.commit()
+
+    stages = {}
+
+    # End-to-end explore_question: a cold pass, then the same questions again with warm SQL/result caches
+    explorer = KPIExplorer(mysql_engine=engine, console=Console(quiet=True),
+                           sql_cache=SQLCache(cache_path=path.join(work_dir, "sql_cache.sqlite")),
+                           result_cache=ResultCache(engine, cache_dir=path.join(work_dir, "results")))
+    for llm in (explorer.sql_llm_base, explorer.answer_llm_base, explorer.explorer_llm_base):
+        llm.api_base = stub.url
+    questions = bench_questions(args.questions)
+    for phase in ("cold", "warm"):
+        latencies = []
+        start = perf_counter()
+        for question in questions:
+            call_start = perf_counter()
+            result = explorer.explore_question(question, 0.0, show_output=False)
+            latencies.append(perf_counter() - call_start)
+            if not result["success"]:
+                console.print(f"[yellow]explore_question failed: {result['error']}[/yellow]")
+        stages[f"explore_question_{phase}"] = summarize(latencies, perf_counter() - start)
+
+    # Result encoding at increasing result sizes
+    for rows in sorted({min(size, args.steps) for size in (100, 10_000, 200_000)}):
+        df = read_sql(text(f"SELECT * FROM workflow_steps LIMIT {rows}"), engine)
+        stages[f"encode_results_{rows}_rows"] = measure(lambda: encode_results(df), args.iterations)
+
+    # Result fetch: pandas read_sql against the Arrow record batch path, at the largest result size
+    fetch_sql = f"SELECT * FROM workflow_steps LIMIT {rows}"
+    query_guard = QueryGuard(engine)
+    stages[f"fetch_pandas_{rows}_rows"] = measure(lambda: read_sql(text(fetch_sql), engine), args.iterations)
+    stages[f"fetch_arrow_{rows}_rows"] = measure(lambda: query_guard.read_sql(fetch_sql), args.iterations)
+
+    # Logging: enqueue latency on the caller's path, and rows/s through the background writer
+    writer = LogWriter(engine, "prompt_logs", PROMPT_LOG_COLUMNS, spill_path=path.join(work_dir, "spill.jsonl"))
+    rows = args.iterations * 50
+    row = {"user_prompt": questions[0], "generated_query": CANNED_SQL[0], "num_results": 10, "user_feedback": False,
+           "created_at": None, "results_returned_fl": True, "token_usage": None}
+    latencies = []
+    start = perf_counter()
+    for _ in range(rows):
+        call_start = perf_counter()
+        writer.write(row)
+        latencies.append(perf_counter() - call_start)
+    stages["log_write"] = summarize(latencies, perf_counter() - start)
+    writer.flush()
+
+    def write_batch():
+        for _ in range(50):
+            writer.write(row)
+        writer.flush()
+    stages["log_flush_50_rows"] = measure(write_batch, args.iterations)
+    stages["log_flush_50_rows"]["throughput_per_s"] *= 50
+    writer.close()
+
+    # Dedupe: SQL fingerprints and the question novelty gate
+    stages["sql_fingerprint"] = measure(lambda: [sql_fingerprint(sql) for sql in CANNED_SQL], args.iterations)
+    stages["sql_fingerprint"]["throughput_per_s"] *= len(CANNED_SQL)
+    novelty_filter = NoveltyFilter(engine, index_dir=path.join(work_dir, "novelty"))
+    novelty_filter.sync()
+    novelty_filter.add(questions)
+    candidates = [{"question": question, "gen_time": 0.0} for question in bench_questions(args.questions * 2)]
+    stages["novelty_filter"] = measure(lambda: novelty_filter.filter(candidates), args.iterations)
+
+    stub.stop()
+    return {
+        "meta": {"steps": args.steps, "questions": args.questions, "iterations": args.iterations,
+                 "ttft_median": stub.ttft_median, "ttft_sigma": stub.ttft_sigma,
+                 "tokens_per_second": stub.tokens_per_second, "seed": args.seed, "llm_requests": stub.requests},
+        "stages": stages,
+    }
+
+
+def compare(results, baseline, tolerance) -> list:
+    """
+    Stages that regressed against a baseline: p50 latency above baseline * (1 + tolerance)
+    or throughput below baseline / (1 + tolerance).
+
+    Returns:
+        List of (stage, metric, baseline value, current value)
+    """
+    regressions = []
+    for stage, stats in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base is None:
+            continue
+        if stats["p50"] > base["p50"] * (1 + tolerance):
+            regressions.append((stage, "p50", base["p50"], stats["p50"]))
+        if stats["throughput_per_s"] < base["throughput_per_s"] / (1 + tolerance):
+            regressions.append((stage, "throughput_per_s", base["throughput_per_s"], stats["throughput_per_s"]))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    from rich.console import Console
+    from rich.table import Table
+
+    table = Table(title=f"Stage benchmarks ({results['meta']['steps']} workflow steps)")
+    for column in ["stage", "count", "p50", "p95", "p99", "throughput/s"] + (["p50 vs baseline"] if baseline else []):
+        table.add_column(column, justify="left" if column == "stage" else "right")
+    for stage, stats in results["stages"].items():
+        cells = [stage, str(stats["count"]), f"{stats['p50'] * 1000:.2f}ms", f"{stats['p95'] * 1000:.2f}ms",
+                 f"{stats['p99'] * 1000:.2f}ms", f"{stats['throughput_per_s']:.1f}"]
+        if baseline:
+            base = baseline.get("stages", {}).get(stage)
+            cells.append(f"{stats['p50'] / base['p50']:.2f}x" if base and base["p50"] else "-")
+        table.add_row(*cells)
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline stage benchmarks with a stub LLM and fixture database")
+    parser.add_argument("--steps", type=int, default=10_000, help="Fixture workflow_steps rows (10000 to 50000000)")
+    parser.add_argument("--fixture-dsn", default=None, help="Build the fixture in this database instead of SQLite")
+    parser.add_argument("--questions", type=int, default=8, help="Questions per explore_question pass")
+    parser.add_argument("--iterations", type=int, default=20, help="Iterations per micro-benchmark")
+    parser.add_argument("--ttft-median", type=float, default=None, help="Stub median time to first token (s)")
+    parser.add_argument("--ttft-sigma", type=float, default=None, help="Stub lognormal sigma of time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=None, help="Stub mean decoding speed")
+    parser.add_argument("--responses", default=None, help="JSONL of canned stub responses to replay")
+    parser.add_argument("--record", action="store_true", help="Record newly generated stub responses to --responses")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default=None, help="Write results JSON here")
+    parser.add_argument("--baseline", default=None, help="Compare against this results JSON")
+    parser.add_argument("--save-baseline", default=None, help="Also write results JSON here as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = None
+    if args.baseline and path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+
+    for output in filter(None, [args.output, args.save_baseline]):
+        makedirs(path.dirname(path.abspath(output)), exist_ok=True)
+        with open(output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for stage, metric, base_value, value in regressions:
+            print(f"REGRESSION {stage} {metric}: {base_value:.6g} -> {value:.6g}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
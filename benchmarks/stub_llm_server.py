@@ -0,0 +1,334 @@
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import environ, path
+from threading import BoundedSemaphore, Lock, Thread
+from time import sleep, time
+import argparse
+import json
+import random
+import re
+
+import numpy as np
+
+
+# Canned SQL the stub hands out for Query-shaped requests; portable between MariaDB and the SQLite fixture
+CANNED_SQL = [
+    "SELECT team_name, COUNT(*) AS steps FROM workflow_steps GROUP BY team_name ORDER BY steps DESC",
+    "SELECT is_automated_step, COUNT(*) AS steps, AVG(workflow_step_elapsed_duration_hours) AS avg_hours "
+    "FROM workflow_steps GROUP BY is_automated_step",
+    "SELECT workflow_step_name, AVG(workflow_step_elapsed_duration_hours) AS avg_hours FROM workflow_steps "
+    "GROUP BY workflow_step_name ORDER BY avg_hours DESC",
+    "SELECT team_member, COUNT(*) AS completed FROM workflow_steps WHERE workflow_step_elapsed_duration_hours "
+    "IS NOT NULL GROUP BY team_member ORDER BY completed DESC",
+    "SELECT o.region_name, COUNT(*) AS late_orders FROM orders o WHERE o.days_past_due > 0 "
+    "GROUP BY o.region_name ORDER BY late_orders DESC",
+    "SELECT p.product_name, AVG(w.workflow_elapsed_duration_hours) AS avg_hours FROM workflows w "
+    "JOIN orders o ON o.order_id = w.order_id JOIN products p ON p.product_id = o.product_id "
+    "GROUP BY p.product_name ORDER BY avg_hours DESC",
+    "SELECT workflow_status, COUNT(*) AS workflows FROM workflows GROUP BY workflow_status",
+    "SELECT team_name, SUM(CASE WHEN workflow_step_elapsed_duration_hours > "
+    "workflow_step_estimated_duration_days * 24 THEN 1 ELSE 0 END) AS over_estimate, COUNT(*) AS steps "
+    "FROM workflow_steps GROUP BY team_name",
+]
+
+QUESTION_TOPICS = ["team throughput", "automated vs manual steps", "SLA risk", "estimated vs actual durations",
+                   "monthly trends", "team member workload", "workflow status mix", "slowest step names",
+                   "regional backlog", "product lead times", "late orders by customer", "cancellation rates"]
+
+WORDS = ("the team completed most steps within estimate while automated steps finished faster than manual "
+         "ones and late orders cluster in two regions with longer workflow durations").split()
+
+
+class StubLLMServer:
+    """
+    OpenAI-compatible stand-in for the LiteLLM gateway, for offline benchmarks.
+
+    Serves /chat/completions (plain, streamed, JSON-schema and tool-call
+    structured output) and /embeddings. Latency is drawn per request: time to
+    first token from a lognormal distribution and decoding speed from a normal
+    tokens/sec distribution, both seeded so runs are reproducible. Responses
+    can be recorded to and replayed from a JSONL file keyed by a hash of the
+    request, so a benchmark sees identical outputs across runs.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, ttft_median=None, ttft_sigma=None, tokens_per_second=None,
+                 tokens_per_second_jitter=None, responses_path=None, record=False, embedding_dim=256, seed=7,
+                 max_concurrency=None):
+        """
+        Initialize the server (call start() to serve)
+
+        Args:
+            host: Interface to bind
+            port: Port to bind; 0 picks a free port
+            ttft_median: Median time to first token in seconds (default: $STUB_LLM_TTFT_MEDIAN or 0.05)
+            ttft_sigma: Lognormal sigma of time to first token (default: $STUB_LLM_TTFT_SIGMA or 0.5)
+            tokens_per_second: Mean decoding speed (default: $STUB_LLM_TOKENS_PER_SECOND or 400)
+            tokens_per_second_jitter: Standard deviation of decoding speed, as a fraction of the mean
+                                      (default: $STUB_LLM_TOKENS_PER_SECOND_JITTER or 0.2)
+            responses_path: Optional JSONL file of canned responses to replay
+            record: Append responses generated for unseen requests to responses_path
+            embedding_dim: Dimension of the deterministic embedding vectors
+            seed: Seed for latency draws and generated responses
+            max_concurrency: Chat requests served at once, like a single model server; the rest
+                             queue, and their wait is recorded (default: unlimited)
+        """
+        self.ttft_median = ttft_median if ttft_median is not None \
+            else float(environ.get("STUB_LLM_TTFT_MEDIAN", "0.05"))
+        self.ttft_sigma = ttft_sigma if ttft_sigma is not None else float(environ.get("STUB_LLM_TTFT_SIGMA", "0.5"))
+        self.tokens_per_second = tokens_per_second if tokens_per_second is not None \
+            else float(environ.get("STUB_LLM_TOKENS_PER_SECOND", "400"))
+        self.tokens_per_second_jitter = tokens_per_second_jitter if tokens_per_second_jitter is not None \
+            else float(environ.get("STUB_LLM_TOKENS_PER_SECOND_JITTER", "0.2"))
+        self.responses_path = responses_path
+        self.record = record
+        self.embedding_dim = embedding_dim
+        self.seed = seed
+
+        self._rng = random.Random(seed)
+        self._lock = Lock()
+        self._canned = {}
+        if responses_path and path.exists(responses_path):
+            with open(responses_path) as responses_file:
+                for line in responses_file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._canned[entry["key"]] = entry["response"]
+
+        self.requests = 0
+        self.max_concurrency = max_concurrency
+        self._slots = BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._queue_waits = []
+        self._in_flight = 0
+        self.peak_in_flight = 0
+        self._httpd = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve on a background thread; returns self so it can be chained."""
+        self._thread = Thread(target=self._httpd.serve_forever, name="StubLLMServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stop()
+        return False
+
+    def take_queue_stats(self) -> tuple:
+        """Return and reset (queue wait seconds per chat request, peak concurrent chat requests)."""
+        with self._lock:
+            waits, self._queue_waits = self._queue_waits, []
+            peak, self.peak_in_flight = self.peak_in_flight, self._in_flight
+        return waits, peak
+
+    def draw_latency(self):
+        """Draw (time to first token, seconds per token) for one request."""
+        with self._lock:
+            ttft = self._rng.lognormvariate(np.log(self.ttft_median), self.ttft_sigma) if self.ttft_median > 0 else 0.0
+            rate = self._rng.gauss(self.tokens_per_second, self.tokens_per_second * self.tokens_per_second_jitter)
+        return ttft, 1.0 / max(rate, 1.0)
+
+    def completion(self, request) -> dict:
+        """The assistant message for a chat request: {"content": ...} or {"tool_calls": [...]}."""
+        key = _request_key(request)
+        with self._lock:
+            self.requests += 1
+            if key in self._canned:
+                return self._canned[key]
+
+        rng = random.Random(int(key[:12], 16) ^ self.seed)
+        prompt = " ".join(_message_text(message) for message in request.get("messages", []))
+        response_format = request.get("response_format") or {}
+        if request.get("tools"):
+            function = request["tools"][0]["function"]
+            arguments = _fill_schema(function.get("parameters", {}), prompt, rng)
+            message = {"tool_calls": [{"id": f"call_{key[:16]}", "type": "function",
+                                       "function": {"name": function["name"], "arguments": json.dumps(arguments)}}]}
+        elif response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"].get("schema", {})
+            message = {"content": json.dumps(_fill_schema(schema, prompt, rng))}
+        else:
+            message = {"content": _sentence(rng, rng.randint(30, 80))}
+
+        with self._lock:
+            self._canned[key] = message
+            if self.record and self.responses_path:
+                with open(self.responses_path, "a") as responses_file:
+                    responses_file.write(json.dumps({"key": key, "response": message}) + "\n")
+        return message
+
+    def embed(self, text) -> list:
+        """Deterministic unit vector per text, so caches and novelty checks behave repeatably."""
+        seed = int(sha256(text.encode("utf-8")).hexdigest()[:16], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.embedding_dim)
+        return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def _request_key(request) -> str:
+    relevant = {name: request.get(name) for name in ("messages", "tools", "response_format")}
+    return sha256(json.dumps(relevant, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _message_text(message) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def _sentence(rng, words) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _fill_schema(schema, prompt, rng) -> dict:
+    """Generate a plausible object for the repo's structured-output models (Query, Answer, questions)."""
+    values = {}
+    for name, spec in schema.get("properties", {}).items():
+        if spec.get("type") == "array":
+            count = re.search(r"exactly \**(\d+)\**", prompt)
+            values[name] = [f"What does {topic} look like across teams this quarter?"
+                            for topic in rng.sample(QUESTION_TOPICS, min(int(count.group(1)) if count else 5,
+                                                                         len(QUESTION_TOPICS)))]
+        elif "sql" in name:
+            values[name] = rng.choice(CANNED_SQL)
+        elif "question" in name:
+            values[name] = f"How does {rng.choice(QUESTION_TOPICS)} vary by {rng.choice(['team', 'month', 'region'])}?"
+        else:
+            values[name] = _sentence(rng, rng.randint(20, 60))
+    return values
+
+
+def _handler_for(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            route = self.path.rstrip("/").split("/")[-1]
+            if route == "completions":
+                self._chat(request)
+            elif route == "embeddings":
+                inputs = request.get("input", [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self._json({"object": "list", "model": request.get("model"),
+                            "data": [{"object": "embedding", "index": i, "embedding": server.embed(str(text))}
+                                     for i, text in enumerate(inputs)],
+                            "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+            else:
+                self.send_error(404)
+
+        def _chat(self, request):
+            queued_ts = time()
+            if server._slots is not None:
+                server._slots.acquire()
+            with server._lock:
+                server._queue_waits.append(time() - queued_ts)
+                server._in_flight += 1
+                server.peak_in_flight = max(server.peak_in_flight, server._in_flight)
+            try:
+                self._serve_chat(request)
+            finally:
+                with server._lock:
+                    server._in_flight -= 1
+                if server._slots is not None:
+                    server._slots.release()
+
+        def _serve_chat(self, request):
+            message = server.completion(request)
+            ttft, seconds_per_token = server.draw_latency()
+            completion_text = message.get("content") or message["tool_calls"][0]["function"]["arguments"]
+            tokens = max(1, len(completion_text) // 4)
+            prompt_tokens = sum(len(_message_text(m)) for m in request.get("messages", [])) // 4
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                     "total_tokens": prompt_tokens + tokens}
+            created = int(time())
+            model = request.get("model", "stub")
+
+            if not request.get("stream"):
+                sleep(ttft + tokens * seconds_per_token)
+                self._json({"id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": model,
+                            "choices": [{"index": 0, "finish_reason": "tool_calls" if "tool_calls" in message
+                                         else "stop", "message": {"role": "assistant", **message}}],
+                            "usage": usage})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            sleep(ttft)
+            pieces = re.findall(r".{1,4}", completion_text, flags=re.S)
+            for i, piece in enumerate(pieces):
+                if "tool_calls" in message:
+                    function = {"arguments": piece}
+                    if i == 0:
+                        function["name"] = message["tool_calls"][0]["function"]["name"]
+                    delta = {"tool_calls": [{"index": 0, "function": function,
+                                             **({"id": message["tool_calls"][0]["id"], "type": "function"}
+                                                if i == 0 else {})}]}
+                else:
+                    delta = {"content": piece}
+                if i == 0:
+                    delta["role"] = "assistant"
+                self._event({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created,
+                             "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                sleep(seconds_per_token)
+            self._event({"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def _event(self, payload):
+            self.wfile.write(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        def _json(self, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft-median", type=float, default=None)
+    parser.add_argument("--ttft-sigma", type=float, default=None)
+    parser.add_argument("--tokens-per-second", type=float, default=None)
+    parser.add_argument("--responses", default=None, help="JSONL file of canned responses to replay")
+    parser.add_argument("--record", action="store_true", help="Append newly generated responses to --responses")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Chat requests served at once")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    stub = StubLLMServer(args.host, args.port, args.ttft_median, args.ttft_sigma, args.tokens_per_second,
+                         responses_path=args.responses, record=args.record, seed=args.seed,
+                         max_concurrency=args.max_concurrency)
+    print(f"Stub LLM serving on {stub.url}")
+    try:
+        stub._httpd.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
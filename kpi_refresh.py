@@ -0,0 +1,105 @@
+from langchain_litellm import ChatLiteLLM
+from langchain_core.prompts import PromptTemplate
+from pydantic import BaseModel, Field
+from rich.console import Console
+from time import time, sleep
+from os import environ
+import argparse
+from EngineRegistry import get_engine
+from ResultCache import ResultCache
+from QueryGuard import QueryGuard
+from AnalyticsReplica import get_replica
+from KPISnapshots import KPISnapshots
+from TokenAccounting import TokenLedger, prompt_sections
+from PipelineTracing import get_tracer
+
+
+# Re-runs the stored KPI queries on a schedule. No SQL is generated; the answer
+# LLM is called only for KPIs whose result changed since the last refresh.
+
+class Answer(BaseModel):
+    answer: str = Field(description="The answer to the question")
+
+
+parser = argparse.ArgumentParser(description="Refresh the materialized results of the discovered KPIs")
+parser.add_argument("--once", action="store_true", help="Refresh the KPIs that are due once, then exit")
+args = parser.parse_args()
+
+SQL_READ_DB = environ.get("SQL_READ_DB", "aurora")
+mysql_engine = get_engine(database=SQL_READ_DB)
+
+console = Console()
+token_ledger = TokenLedger()
+tracer = get_tracer()
+
+replica = get_replica(mysql_engine)
+if replica is not None:
+    result_cache = ResultCache(mysql_engine, query_guard=QueryGuard(mysql_engine, replica=replica),
+                               watermarks=replica.watermarks)
+else:
+    result_cache = ResultCache(mysql_engine)
+
+answer_llm_base = ChatLiteLLM(
+    api_base="http://localhost:8000",
+    api_key=environ.get("LITELLM_API_KEY", "test"),
+    model="openai/llama3.1:8b",
+    temperature=0.2
+)
+answer_llm_so = answer_llm_base.with_structured_output(Answer)
+
+answer_prompt = """### Input:
+The question: {question}
+
+The database query:
+{query}
+
+The database results:
+{results}
+
+What changed since the previous refresh:
+{change}
+
+Note:
+Give a brief answer to the question with this provided info, mentioning the most important changes."""
+
+answer_prompt_template = PromptTemplate(template=answer_prompt,
+                                        input_variables=["question", "query", "results", "change"])
+
+
+def answer(question, sql_query, encoded_results, change):
+    this_ts = time()
+    response = answer_llm_so.invoke(answer_prompt_template.format(
+        question=question, query=sql_query, results=encoded_results, change=change))
+    usage = token_ledger.record(
+        "answer", prompt_sections(answer_prompt_template, question=question, query=sql_query,
+                                  results=encoded_results, change=change),
+        response.model_dump_json(), time() - this_ts, answer_llm_base.model)
+    tracer.record_span("answer_generation", this_ts, model=answer_llm_base.model,
+                       prompt_tokens=usage['prompt_tokens'], completion_tokens=usage['completion_tokens'])
+    return response.answer
+
+
+snapshots = KPISnapshots(mysql_engine, result_cache=result_cache, answer=answer)
+
+try:
+    while True:
+        this_ts = time()
+        if replica is not None:
+            replica.maybe_sync()
+        new_kpis = snapshots.sync()
+        for outcome in snapshots.refresh():
+            if outcome['error']:
+                console.print(f"[red]{outcome['question']}: {outcome['error']}[/red]")
+            elif outcome['changed']:
+                answered = ", re-answered" if outcome['answered'] else ""
+                console.print(f"[bold]{outcome['question']}[/bold] -> v{outcome['version']}{answered}")
+        tracer.record_span("kpi_refresh", this_ts, new_kpis=new_kpis)
+        console.print(f"[dim]{snapshots.summary()} | {result_cache.summary()} ({time() - this_ts:.2f}s)[/dim]")
+        if args.once:
+            break
+        sleep(max(1.0, snapshots.next_due_seconds()))
+except KeyboardInterrupt:
+    pass
+
+console.print(token_ledger.report())
+console.print(tracer.report())
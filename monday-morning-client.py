@@ -5,15 +5,26 @@ from langchain_core.messages import SystemMessage
 from langchain_core.messages import HumanMessage
 from pydantic import BaseModel
 from pydantic import Field
-from sqlalchemy import create_engine
-from sqlalchemy import text
-from pandas import read_sql
 from rich.console import Console
 from time import time
 from os import environ
 from AuroraLogging import AuroraLogging
 from KPIExplorer import KPIExplorer
 from SQLErrorHandling import SQLErrorHandler
+from EngineRegistry import get_engine, build_dsn
+from SQLCache import SQLCache
+from ResultCache import ResultCache
+from AnswerStreaming import stream_answer, streaming_enabled
+from ResultEncoder import encode_results
+from TokenAccounting import TokenLedger, prompt_sections, heading_sections
+from PipelineTracing import get_tracer
+from SchemaService import get_schema_service
+from SchemaLinker import SchemaLinker
+from QueryGuard import QueryCostExceeded
+from KPISnapshots import KPISnapshots, describe_diff
+from SQLValidator import SQLValidator
+from SuggestionPool import SuggestionPool
+import json
 
 class Query(BaseModel):
     sql_query: str = Field(description="A syntactically correct SQL query")
@@ -23,15 +34,16 @@ class Answer(BaseModel):
     answer: str = Field(description="The answer to the question")
 
 
-SQL_HOST = environ.get("SQL_HOST", "localhost")
-SQL_USER = environ.get("SQL_USER", "zero")
-SQL_PASS = environ.get("SQL_PASS", "zero")
 SQL_READ_DB = environ.get("SQL_READ_DB", "aurora")
-mysql_engine = create_engine(f"mysql+pymysql://" + SQL_USER + ":zero@" + SQL_HOST + "/" + SQL_READ_DB)
+mysql_engine = get_engine(database=SQL_READ_DB)
 
 
 console = Console()
 
+schema_service = get_schema_service(mysql_engine)
+# Narrows the SQL prompt's schema (tables, columns, status values, relations) to each question
+schema_linker = SchemaLinker(schema_service, tables=["products", "orders", "workflows", "workflow_steps"])
+
 
 # sql_llm_base = ChatOllama(model="sqlcoder:15b", temperature=0.1)
 #sql_llm_base = ChatOllama(model="llama3.1:8b", temperature=0.0)
@@ -78,85 +90,7 @@ You are an expert SQL query generator specializing in MariaDB. Your task is to a
 - Do not attempt to generate SQl queries that utilize column names not found in the specified schemas.
 
 Schema:
-CREATE TABLE `products` (
-  `index` bigint(20) DEFAULT NULL,
-  `product_id` bigint(20) DEFAULT NULL,
-  `product_name` text DEFAULT NULL,
-  `service_name` text DEFAULT NULL,
-  `group_product_name` text DEFAULT NULL,
-  `parent_product_name` text DEFAULT NULL,
-  `is_active` bigint(20) DEFAULT NULL,
-  KEY `ix_products_index` (`index`)
-)
-
-CREATE TABLE `orders` (
-  `index` bigint(20) DEFAULT NULL,
-  `order_id` bigint(20) DEFAULT NULL,
-  `product_id` bigint(20) DEFAULT NULL,
-  `region_name` text DEFAULT NULL,
-  `team_manager_name` text DEFAULT NULL,
-  `team_name` text DEFAULT NULL,
-  `order_status` text DEFAULT NULL,
-  `customer_name` text DEFAULT NULL,
-  `days_past_due` double DEFAULT NULL,
-  `desired_due_date` datetime DEFAULT NULL,
-  `create_date` datetime DEFAULT NULL,
-  `update_date` datetime DEFAULT NULL,
-  KEY `ix_orders_index` (`index`)
-)
-
-CREATE TABLE `workflows` (
-  `index` bigint(20) DEFAULT NULL,
-  `workflow_id` bigint(20) DEFAULT NULL,
-  `order_id` double DEFAULT NULL,
-  `workflow_name` text DEFAULT NULL,
-  `workflow_description` text DEFAULT NULL,
-  `workflow_status` text DEFAULT NULL,
-  `insert_date` datetime DEFAULT NULL,
-  `update_date` datetime DEFAULT NULL,
-  `workflow_elapsed_duration_hours` double DEFAULT NULL,
-  KEY `ix_workflows_index` (`index`)
-)
-
-CREATE TABLE `workflow_steps` (
-  `index` bigint(20) DEFAULT NULL,
-  `workflow_step_id` bigint(20) DEFAULT NULL,
-  `order_id` double DEFAULT NULL,
-  `order_item_id` double DEFAULT NULL,
-  `workflow_id` bigint(20) DEFAULT NULL,
-  `workflow_step_name` text DEFAULT NULL,
-  `workflow_step_description` text DEFAULT NULL,
-  `effective_parent_workflow_status` text DEFAULT NULL,
-  `workflow_step_estimated_duration_days` double DEFAULT NULL,
-  `team_name` text DEFAULT NULL,
-  `team_id` bigint(20) DEFAULT NULL,
-  `team_member` text DEFAULT NULL,
-  `workflow_step_due_date` datetime DEFAULT NULL,
-  `is_automated_step` bigint(20) DEFAULT NULL,
-  `workflow_step_elapsed_duration_hours` double DEFAULT NULL,
-  `workflow_step_date` datetime DEFAULT NULL,
-  KEY `ix_workflow_steps_index` (`index`)
-)
-
-## Status field values are as follows:
-### Table workflows have field workflow_status:
-- INPROGRESS: In Progress
-- COMPLETE: Completed
-- PCNCL: Pending Cancel
-- CNCL: Cancelled
-
-### Table orders have field order_status:
-- PENDING: Pending
-- INCMPLT: Incomplete
-- CNCL: Cancelled
-- PCNCL: Pending Cancel
-- CLSD: Completed/Closed
-
-
-## Table relations:
-- `workflow_steps` and `workflows` are related by `workflow_id`
-- `workflows` and `orders` are related by `order_id`
-- `orders` and `products` are related by `product_id`
+{schema}
 
 ## Response format:
 Respond only with this exact structure—no additional text, explanations, or chit-chat:
@@ -190,21 +124,29 @@ Give a brief answer to the question with this provided info, don't leave out any
 answer_prompt_template = PromptTemplate(template=answer_prompt, input_variables=["question", "query", "results"])
 
 
+sql_cache = SQLCache()
+# Keyed on the full schema: the linked subset is a function of the question and the full schema
+sql_schema_hash = SQLCache.schema_hash(sql_system_prompt.format(schema=schema_linker.full_schema()), question_prompt)
+result_cache = ResultCache(mysql_engine)
+schema_service.invalidate(result_cache)
+sql_validator = SQLValidator(schema_service)
+# Questions matching a discovered KPI are answered from its latest refreshed snapshot (see kpi_refresh.py)
+kpi_snapshots = KPISnapshots(mysql_engine, result_cache=result_cache)
+# Suggestions come from memory; the pool refreshes itself in the background
+suggestion_pool = SuggestionPool(mysql_engine, log_engine=build_dsn(environ.get("SQL_WRITE_DB", "aurora_logging")))
+token_ledger = TokenLedger()
+tracer = get_tracer()
+
+
 PromptErrors = SQLErrorHandler()
+# Built on the first 'explore' and reused, so its setup queries run once per session
+explorer = None
 # Remove the questions array and replace with interactive loop
 while True:
     # Get user input
-    try:
-        suggestion_df = read_sql(
-            text("SELECT question FROM aurora_discovered_kpis ORDER BY RAND() LIMIT 1"),
-            mysql_engine
-        )
-        if len(suggestion_df) > 0:
-            suggested_question = suggestion_df.iloc[0]['question']
-            console.print(f"\nYou can ask a question like: '{suggested_question}'\n")
-    except Exception as e:
-        # If there's an error fetching suggestions, just continue
-        pass
+    suggested_question = suggestion_pool.suggest()
+    if suggested_question is not None:
+        console.print(f"\nYou can ask a question like: '{suggested_question}'\n")
 
     question = console.input("\n[bold cyan]Enter your question (or 'exit' to quit, 'explore' for KPI exploration): [/bold cyan]")
 
@@ -215,12 +157,22 @@ while True:
     # Check if user wants to exit
     if question.lower() in ['exit', 'quit', 'q']:
         console.print("[yellow]Exiting...[/yellow]")
+        console.print(f"[dim]{suggestion_pool.summary()}[/dim]")
+        console.print(f"[dim]{tracer.report()}[/dim]")
         break
 
+    this_ts = time()
+    # Exact matches answer without an embedding; on a miss the question is embedded once (memoized by
+    # sql_cache) for both paraphrase lookups and sql_cache.put
+    snapshot = kpi_snapshots.lookup(question, embed_question=sql_cache.embed_question) \
+        if question.lower() != 'explore' else None
+
     # Check if user wants KPI exploration
     if question.lower() == 'explore':
         console.print("[bold magenta]Starting KPI Exploration...[/bold magenta]")
-        explorer = KPIExplorer(console=console)
+        if explorer is None:
+            explorer = KPIExplorer(mysql_engine=mysql_engine, console=console, sql_cache=sql_cache,
+                                   result_cache=result_cache)
 
         # Ask how many questions to generate
         count_input = console.input("[cyan]How many questions to explore? (default: 5): [/cyan]")
@@ -254,45 +206,164 @@ while True:
                     answer=result['answer'],
                     question_gen_seconds=result['question_gen_seconds'],
                     query_gen_seconds=result['query_gen_seconds'],
-                    answer_gen_seconds=result['answer_gen_seconds'])
+                    answer_gen_seconds=result['answer_gen_seconds'],
+                    token_usage=result['token_usage'])
 
+        # Write the burst of new KPIs now so the duplicate count is known
+        explorer.kpi_writer.flush()
+        console.print(f"[dim]{explorer.kpi_writer.summary()}[/dim]")
+        console.print(f"[dim]{explorer.novelty_filter.report()}[/dim]")
+        console.print(f"[dim]{explorer.token_ledger.report()}[/dim]")
 
         #continue
+    elif snapshot is not None:
+        # A materialized KPI: no SQL generation, query or answer LLM
+        tracer.record_span("kpi_snapshot", this_ts, version=snapshot['version'])
+        console.print(f"[bold green]From KPI snapshot[/bold green] v{snapshot['version']}, refreshed "
+                      f"{(time() - snapshot['refreshed_at']) / 60:.0f} min ago ({time() - this_ts:.3f}s): "
+                      f"{snapshot['question']}")
+        console.print(f"SQL:\n{snapshot['sql_query']}")
+        console.print(f"Dataset ({len(snapshot['dataframe'])} rows):\n{snapshot['dataframe'].head(20).to_markdown()}")
+        if snapshot['diff'] is not None:
+            console.print(f"[dim]Changed since the previous refresh:\n{describe_diff(snapshot['diff'])}[/dim]")
+        console.print(f"Answer:\n{snapshot['answer']}")
     else:
         start_ts = time()
+        span = tracer.start_span("repl_question")
 
         this_ts = time()
-        response = sql_llm_so.invoke([
-            SystemMessage(content=sql_system_prompt),
-            HumanMessage(content=question_prompt_template.format(question=question))
-        ])
-        sql_query = response.sql_query
+        token_usage = {}
+        sql_query = sql_cache.get(question, sql_schema_hash)
+        sql_cache_hit = sql_query is not None
+        if not sql_cache_hit:
+            link_ts = time()
+            linked = schema_linker.link(question)
+            tracer.record_span("schema_linking", link_ts, tables=len(linked['tables']), full=linked['full'])
+            console.print(f"[dim]{schema_linker.summary(linked)}[/dim]")
+            sql_system_text = sql_system_prompt.format(schema=linked['text'])
+            sql_system_sections = {f"system {name}": section
+                                   for name, section in heading_sections(sql_system_text).items()}
+            response = sql_llm_so.invoke([
+                SystemMessage(content=sql_system_text),
+                HumanMessage(content=question_prompt_template.format(question=question))
+            ])
+            sql_query = response.sql_query
+            token_usage['query'] = token_ledger.record(
+                "query", {**sql_system_sections, **prompt_sections(question_prompt_template, question=question)},
+                response.model_dump_json(), time() - this_ts, sql_llm_base.model)
 
         query_gen_seconds = time() - this_ts
+        tracer.record_span("sql_generation", this_ts, model=sql_llm_base.model, cache_hit=sql_cache_hit)
+        # Show the SQL and dataset as soon as they exist instead of after the answer
+        console.print(f"SQL ({query_gen_seconds:.2f}s{', cached' if sql_cache_hit else ''}):\n{sql_query}")
+
+        def show_preview(result):
+            # Called as soon as the first rows arrive, while the rest are still streaming in
+            console.print(f"Dataset (first rows after {time() - this_ts:.2f}s):\n{result.head.to_markdown()}")
+
+        def retry_sql(feedback):
+            # One cheap regeneration with the validator's errors, instead of a failed database round trip
+            problems = "\n".join(line for line in feedback.splitlines() if line.startswith("- "))
+            console.print(f"[yellow]SQL failed validation, regenerating:\n{problems}[/yellow]")
+            retry_ts = time()
+            response = sql_llm_so.invoke([
+                SystemMessage(content=sql_system_text),
+                HumanMessage(content=question_prompt_template.format(question=question)),
+                HumanMessage(content=feedback)
+            ])
+            token_usage['query_retry'] = token_ledger.record(
+                "query_retry", {**sql_system_sections, **prompt_sections(question_prompt_template, question=question),
+                                "validation errors": feedback},
+                response.model_dump_json(), time() - retry_ts, sql_llm_base.model)
+            tracer.record_span("sql_retry", retry_ts, model=sql_llm_base.model)
+            console.print(f"SQL, regenerated ({time() - retry_ts:.2f}s):\n{response.sql_query}")
+            return response.sql_query
 
         try:
+            if not sql_cache_hit:
+                sql_query = sql_validator.regenerate(sql_query, retry_sql)
             this_ts = time()
-            df = read_sql(text(sql_query), mysql_engine)
+            try:
+                result, result_cache_hit = result_cache.stream(sql_query, on_preview=show_preview)
+            except QueryCostExceeded as e:
+                # Too expensive to run: send it back once, with the plan estimate, for a cheaper rewrite
+                if sql_cache_hit:
+                    sql_cache.invalidate(question, sql_schema_hash)
+                console.print(f"[yellow]{e}. Asking for a cheaper query...[/yellow]")
+                this_ts = time()
+                sql_system_text = sql_system_prompt.format(schema=schema_linker.link(question)['text'])
+                response = sql_llm_so.invoke([
+                    SystemMessage(content=sql_system_text),
+                    HumanMessage(content=question_prompt_template.format(question=question)),
+                    HumanMessage(content=e.rewrite_request())
+                ])
+                sql_query = response.sql_query
+                sql_cache_hit = False
+                token_usage['query_rewrite'] = token_ledger.record(
+                    "query_rewrite", {**{f"system {name}": section
+                                         for name, section in heading_sections(sql_system_text).items()},
+                                      **prompt_sections(question_prompt_template, question=question),
+                                      "rejected query": e.rewrite_request()},
+                    response.model_dump_json(), time() - this_ts, sql_llm_base.model)
+                tracer.record_span("sql_rewrite", this_ts, model=sql_llm_base.model)
+                console.print(f"SQL, rewritten ({time() - this_ts:.2f}s):\n{sql_query}")
+                # The rewrite is freshly generated SQL too
+                sql_query = sql_validator.regenerate(sql_query, retry_sql)
+                this_ts = time()
+                result, result_cache_hit = result_cache.stream(sql_query, on_preview=show_preview)
+            except Exception:
+                if sql_cache_hit:
+                    sql_cache.invalidate(question, sql_schema_hash)
+                raise
             query_exec_seconds = time() - this_ts
+            tracer.record_span("query_execution", this_ts, rows=result.rows, bytes=result.peak_bytes,
+                               cache_hit=result_cache_hit)
+            if not sql_cache_hit:
+                sql_cache.put(question, sql_schema_hash, sql_query)
+
+            console.print(f"{result.rows} rows ({query_exec_seconds:.2f}s{', cached' if result_cache_hit else ''})")
+            if result.sampled:
+                console.print("[yellow]Sampled: the query was over the cost budget, so it ran on a subset of rows[/yellow]")
+            console.print()
+            console.print(f"Question: {question}")
 
-            this_ts = time()
-            answer_response = answer_llm_so.invoke(answer_prompt_template.format(
+            encoded_results = encode_results(result, map_reduce_llm=answer_llm_base)
+            answer_prompt_text = answer_prompt_template.format(
                 question=question,
                 query=sql_query,
-                results=df.to_markdown()
-            ))
-            answer_gen_seconds = time() - this_ts
-
-            console.print(f"SQL ({query_gen_seconds:.2f}s):\n{sql_query}")
-            console.print(f"Dataset ({query_exec_seconds:.2f}s):\n{df.head(20).to_markdown()}")
-            console.print()
-            console.print(f"Question: {question}")
-            console.print(f"Answer ({answer_gen_seconds:.2f}s) ({time() - start_ts:.2f}s):\n{answer_response.answer}")
+                results=encoded_results
+            )
+            # Streaming latency, recorded with the answer's span and token usage
+            answer_timing = {}
+            if streaming_enabled():
+                console.print("Answer:")
+                this_ts = time()
+                streamed = stream_answer(answer_llm_base, answer_prompt_text, console)
+                answer_gen_seconds = streamed['answer_gen_seconds']
+                answer_text = streamed['answer']
+                answer_timing = {key: streamed[key] for key in ("answer_ttft_seconds", "answer_tokens_per_second")}
+                console.print(f"[dim]Answer {answer_gen_seconds:.2f}s, first token {streamed['answer_ttft_seconds']:.2f}s, "
+                              f"{streamed['answer_tokens_per_second']:.1f} tokens/s ({time() - start_ts:.2f}s total)[/dim]")
+            else:
+                this_ts = time()
+                answer_response = answer_llm_so.invoke(answer_prompt_text)
+                answer_gen_seconds = time() - this_ts
+                answer_text = answer_response.model_dump_json()
+                console.print(f"Answer ({answer_gen_seconds:.2f}s) ({time() - start_ts:.2f}s):\n{answer_response.answer}")
+            token_usage['answer'] = token_ledger.record(
+                "answer", prompt_sections(answer_prompt_template, question=question, query=sql_query,
+                                          results=encoded_results),
+                answer_text, answer_gen_seconds, answer_llm_base.model)
+            token_usage['answer'].update(answer_gen_seconds=answer_gen_seconds, **answer_timing)
+            tracer.record_span("answer_generation", this_ts, model=answer_llm_base.model,
+                               streamed=streaming_enabled(), prompt_tokens=token_usage['answer']['prompt_tokens'],
+                               completion_tokens=token_usage['answer']['completion_tokens'], **answer_timing)
+            console.print(f"[dim]{sql_cache.summary()} | {result_cache.summary()} | {sql_validator.summary()}[/dim]")
 
             # Prepare logging parameters
             user_prompt = question
             generated_query = sql_query
-            num_results = len(df)
+            num_results = result.rows
             user_feedback = False  # or None if you want to leave it undefined
             results_returned_fl = True
 
@@ -304,17 +375,26 @@ while True:
                 results_returned_fl = False
 
             # Create an instance and call the method
+            this_ts = time()
             logger = AuroraLogging()
-            logger.log_new_prompt(user_prompt, generated_query, num_results, user_feedback, results_returned_fl)
-
+            logger.log_new_prompt(user_prompt, generated_query, num_results, user_feedback, results_returned_fl,
+                                  token_usage=json.dumps(token_usage))
+            tracer.record_span("logging", this_ts, table="prompt_logs")
+
+        except KeyboardInterrupt as e:
+            # QueryGuard has already killed the query on the server
+            console.print("[yellow]Cancelled[/yellow]")
+            span.end(error=e)
         except Exception as e:
             console.print(f"Error: {e}")
-            console.print(sql_query)
             PromptErrors.log_error(str(e))
+            span.end(error=e)
+        span.end()
 
     print()
     print("*" * 60)
     print()
     print("Prompt Errors: %s" % (PromptErrors.get_errors()))
-    print("Explorer Errors: %s" % (KPIExplorer().ExplorerErrors.get_errors()))
+    print("Explorer Errors: %s" % (explorer.ExplorerErrors.get_errors() if explorer is not None else []))
+    print(token_ledger.report())
     print()
@@ -0,0 +1,93 @@
+import sys
+from os import path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from SQLValidator import SQLValidator, SQLValidationError
+
+
+def table(*names):
+    return {"columns": [[name, "text", True, None] for name in names], "indexes": {}}
+
+
+@pytest.fixture
+def validator():
+    schema = SimpleNamespace(schema_hash="test", tables={
+        "workflow_steps": table("workflow_id", "product_id", "team_name", "team_member", "workflow_step_date",
+                                "workflow_step_elapsed_duration_hours", "is_automated_step"),
+        "workflows": table("workflow_id", "workflow_status"),
+        "products": table("product_id", "product_name"),
+    })
+    return SQLValidator(schema)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT ws.team_name, COUNT(*) AS n FROM workflow_steps ws GROUP BY ws.team_name ORDER BY n DESC",
+    # GROUP BY a select alias whose expression isn't a plain column
+    "SELECT DATE_FORMAT(workflow_step_date, '%Y-%m') AS month, AVG(workflow_step_elapsed_duration_hours) "
+    "FROM workflow_steps GROUP BY month",
+    "SELECT CASE WHEN workflow_step_elapsed_duration_hours < 24 THEN 'fast' ELSE 'slow' END AS speed, COUNT(*) "
+    "FROM workflow_steps GROUP BY speed",
+    "SELECT DATE_FORMAT(workflow_step_date, '%Y-%m') AS month, team_name, COUNT(*) FROM workflow_steps "
+    "GROUP BY month, team_name",
+    "SELECT DATE_FORMAT(workflow_step_date, '%Y-%m') AS month, COUNT(*) FROM workflow_steps GROUP BY 1",
+    "SELECT DATE_FORMAT(workflow_step_date, '%Y-%m'), COUNT(*) FROM workflow_steps "
+    "GROUP BY DATE_FORMAT(workflow_step_date, '%Y-%m')",
+    "SELECT team_name, SUM(CASE WHEN is_automated_step = 1 THEN 1 ELSE 0 END) AS automated FROM workflow_steps "
+    "GROUP BY team_name HAVING automated > 1",
+    "WITH t AS (SELECT workflow_id, COUNT(*) AS n FROM workflow_steps GROUP BY workflow_id) "
+    "SELECT t.workflow_id, t.n, w.workflow_status FROM t JOIN workflows w ON w.workflow_id = t.workflow_id",
+    "SELECT w.workflow_id, (SELECT MAX(s.workflow_step_date) FROM workflow_steps s "
+    "WHERE s.workflow_id = w.workflow_id) AS last_step FROM workflows w",
+    "SELECT w.workflow_id, COUNT(*) FROM workflows w WHERE EXISTS (SELECT 1 FROM workflow_steps s "
+    "WHERE s.workflow_id = w.workflow_id) GROUP BY w.workflow_id",
+    "SELECT team_name FROM workflow_steps UNION SELECT product_name FROM products",
+    # Uncorrelated subqueries reading columns the outer tables don't have
+    "SELECT team_name FROM workflow_steps WHERE workflow_id IN "
+    "(SELECT workflow_id FROM workflows WHERE workflow_status = 'CNCL')",
+    "SELECT team_name FROM workflow_steps WHERE workflow_id NOT IN "
+    "(SELECT workflow_id FROM workflows WHERE workflow_status = 'CNCL')",
+    "SELECT team_name, (SELECT COUNT(*) FROM workflows WHERE workflow_status = 'CNCL') AS cancelled "
+    "FROM workflow_steps",
+])
+def test_valid_queries_pass(validator, sql):
+    assert validator.validate(sql) == []
+
+
+@pytest.mark.parametrize("sql, message", [
+    ("SELECT w.team_name, COUNT(*) FROM workflow_steps ws GROUP BY ws.team_name", "alias `w`"),
+    ("SELECT team_name, AVG(elapsed_duration_hours) FROM workflow_steps GROUP BY team_name",
+     "Unknown column `elapsed_duration_hours`"),
+    ("SELECT workflow_id FROM workflow_steps ws JOIN workflows w ON w.workflow_id = ws.workflow_id",
+     "Ambiguous column `workflow_id`"),
+    ("SELECT COUNT(*) FROM workflow_steps GROUP BY team_name", "GROUP BY `team_name` is not in the select list"),
+    ("SELECT team_name, team_member, COUNT(*) FROM workflow_steps GROUP BY team_name",
+     "`team_member` is selected but neither in the GROUP BY nor aggregated"),
+    ("SELECT DATE_FORMAT(workflow_step_date, '%Y-%m') AS month, team_name, COUNT(*) FROM workflow_steps "
+     "GROUP BY month", "`team_name` is selected but neither in the GROUP BY nor aggregated"),
+    ("SELECT * FROM workflow_step", "Unknown table `workflow_step`"),
+    ("DELETE FROM workflow_steps", "read-only"),
+    ("SELECT team_name FROM workflow_steps FOR UPDATE", "read-only"),
+    ("SELECT 1; SELECT 2", "exactly one SQL statement"),
+    ("SELEC team_name FROM workflow_steps", "Syntax error"),
+])
+def test_invalid_queries_report_the_problem(validator, sql, message):
+    errors = validator.validate(sql)
+    assert any(message in error for error in errors), errors
+
+
+def test_regenerate_retries_with_feedback(validator):
+    feedback = []
+    fixed = "SELECT ws.team_name FROM workflow_steps ws"
+    assert validator.regenerate("SELECT w.team_name FROM workflow_steps ws",
+                                lambda text: feedback.append(text) or fixed) == fixed
+    assert "alias `w`" in feedback[0]
+    assert validator.retries == 1
+
+
+def test_regenerate_raises_when_retries_run_out(validator):
+    with pytest.raises(SQLValidationError):
+        validator.regenerate("SELECT * FROM nope", lambda text: "SELECT * FROM still_nope")
+    assert validator.failed == 1
@@ -3,12 +3,15 @@ from langchain_litellm import ChatLiteLLM
 from langchain_core.prompts import PromptTemplate
 from pydantic import BaseModel
 from pydantic import Field
-from sqlalchemy import create_engine
-from sqlalchemy import text
-from pandas import read_sql
 from rich.console import Console
 from time import time
 from os import environ
+from EngineRegistry import get_engine
+from ResultEncoder import encode_results
+from PipelineTracing import get_tracer
+from QueryGuard import QueryGuard
+from SchemaService import get_schema_service
+from SQLValidator import SQLValidator
 
 
 
@@ -20,13 +23,16 @@ class Answer(BaseModel):
     answer: str = Field(description="The answer to the question")
 
 
-SQL_HOST = environ.get("SQL_HOST", "localhost")
-SQL_USER = environ.get("SQL_USER", "zero")
-SQL_PASS = environ.get("SQL_PASS", "zero")
-mysql_engine = create_engine(f"mysql+pymysql://" + SQL_USER + ":zero@" + SQL_HOST + "/aurora")
+mysql_engine = get_engine(database="aurora")
 
 
 console = Console()
+query_guard = QueryGuard(mysql_engine)
+
+schema_service = get_schema_service(mysql_engine)
+workflows_schema = schema_service.render(["workflow_steps", "products"])
+# Catches alias mismatches, invented columns and GROUP BY slips before the database does
+sql_validator = SQLValidator(schema_service)
 
 
 #sql_llm_base = ChatOllama(model="llama3.1:8b", temperature=0.0)
@@ -77,38 +83,7 @@ Key Rules:
 Generate a SQL query that answers the question `{question}`.
 
 Schema:
-CREATE TABLE `workflow_steps` (
-  `index` bigint(20) DEFAULT NULL,
-  `workflow_step_id` bigint(20) DEFAULT NULL,
-  `order_id` bigint(20) DEFAULT NULL,
-  `product_id` bigint(20) DEFAULT NULL,
-  `team_manager_name` text DEFAULT NULL,
-  `order_item_id` bigint(20) DEFAULT NULL,
-  `workflow_id` bigint(20) DEFAULT NULL,
-  `workflow_name` text DEFAULT NULL,
-  `workflow_step_description` text DEFAULT NULL,
-  `status_during_step` text DEFAULT NULL,
-  `estimated_duration_days` double DEFAULT NULL,
-  `team_name` text DEFAULT NULL,
-  `team_id` bigint(20) DEFAULT NULL,
-  `employee_name` text DEFAULT NULL,
-  `promised_due_dt` datetime DEFAULT NULL,
-  `is_automated_step` bigint(20) DEFAULT NULL,
-  `elapsed_duration_hours` double DEFAULT NULL,
-  `workflow_step_date` datetime DEFAULT NULL,
-  KEY `ix_workflow_steps_index` (`index`)
-)
-
-CREATE TABLE `products` (
-  `index` bigint(20) DEFAULT NULL,
-  `product_id` bigint(20) DEFAULT NULL,
-  `external_identifier` text DEFAULT NULL,
-  `name` text DEFAULT NULL,
-  `service_name` text DEFAULT NULL,
-  `group_product_name` text DEFAULT NULL,
-  `parent_product_name` text DEFAULT NULL,
-  KEY `ix_products_index` (`index`)
-)
+{schema}
 
 
 ### Table relations:
@@ -120,7 +95,7 @@ Based on the provided schema and question, here is the MariaDB SQL query:
 ```sql
 """
 
-code_prompt_template = PromptTemplate(template=query_prompt, input_variables=["question"])
+code_prompt_template = PromptTemplate(template=query_prompt, input_variables=["schema", "question"])
 
 
 answer_prompt = """
@@ -158,36 +133,52 @@ questions = [
 ]
 
 
+tracer = get_tracer()
+
 for question in questions:
     start_ts = time()
 
     this_ts = time()
-    prompt = code_prompt_template.format(question=question)
+    prompt = code_prompt_template.format(schema=workflows_schema, question=question)
     response = sql_llm_so.invoke(prompt)
     sql_query = response.sql_query
 
     query_gen_seconds = time() - this_ts
+    tracer.record_span("sql_generation", this_ts, model=sql_llm_base.model)
+
+    def retry_sql(feedback):
+        # One cheap regeneration with the validator's errors, instead of a failed database round trip
+        retry_ts = time()
+        response = sql_llm_so.invoke(prompt + "\n\n" + feedback)
+        tracer.record_span("sql_retry", retry_ts, model=sql_llm_base.model)
+        return response.sql_query
 
     try:
-        this_ts = time()
-        df = read_sql(text(sql_query), mysql_engine)
+        stage, this_ts = "sql_validation", time()
+        sql_query = sql_validator.regenerate(sql_query, retry_sql)
+
+        stage, this_ts = "query_execution", time()
+        result = query_guard.stream(sql_query)
         query_exec_seconds = time() - this_ts
+        tracer.record_span(stage, this_ts, rows=result.rows, bytes=result.peak_bytes)
 
-        this_ts = time()
+        stage, this_ts = "answer_generation", time()
         answer_response = answer_llm_so.invoke(answer_prompt_template.format(
             question=question,
             query=sql_query,
-            results=df.to_markdown()
+            results=encode_results(result)
         ))
         answer_gen_seconds = time() - this_ts
+        tracer.record_span(stage, this_ts, model=answer_llm_base.model)
 
         console.print(f"SQL ({query_gen_seconds:.2f}s):\n{sql_query}")
-        console.print(f"Dataset ({query_exec_seconds:.2f}s):\n{df.head(20).to_markdown()}")
+        console.print(f"Dataset ({result.rows} rows, {query_exec_seconds:.2f}s):\n{result.head.to_markdown()}")
         console.print()
         console.print(f"Question: {question}")
         console.print(f"Answer ({answer_gen_seconds:.2f}s) ({time() - start_ts:.2f}s):\n{answer_response.answer}")
 
     except Exception as e:
+        tracer.record_span(stage, this_ts, error=e)
         console.print(sql_query)
         console.print(f"Error: {e}")
 
@@ -195,4 +186,6 @@ for question in questions:
     print()
     print("*" * 60)
     print()
-    print()
\ No newline at end of file
+    print()
+console.print(sql_validator.summary())
+console.print(tracer.report())